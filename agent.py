@@ -1,28 +1,58 @@
 import os
+import re
 import json
+import time
+import sqlite3
+import hashlib
+import atexit
 import asyncio
+import threading
+import weakref
+import concurrent.futures
+import contextvars
+import functools
+import textwrap
+from collections import OrderedDict
+from datetime import timedelta
 from typing import Type, Optional, Union
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain.agents import create_react_agent, AgentExecutor, create_openai_tools_agent
+from langchain.agents.format_scratchpad.openai_tools import format_to_openai_tool_messages
+from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
 from langchain.tools import tool
 from langchain.prompts import PromptTemplate
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
-from contextlib import asynccontextmanager
+from mcp.shared.exceptions import McpError
+from contextlib import aclosing, asynccontextmanager, closing
 import chainlit as cl
 from pydantic import BaseModel, Field
-from langchain_core.tools import BaseTool
+from langchain_core.tools import BaseTool, StructuredTool, create_schema_from_function
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, message_chunk_to_message
+from langchain_core.messages.tool import invalid_tool_call
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.load import dumps, loads
 from langchain_tavily import TavilySearch
 
 # yfinance ไม่จำเป็นต้องใช้ในไฟล์นี้แล้ว เพราะเราจะเรียกผ่าน server ทั้งหมด
 # import yfinance as yf
 import pandas as pd
 
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
 load_dotenv()
 
 MODEL = os.getenv("OPENROUTER_MODEL", "openai/gpt-4o-mini")
+# โมเดลเร็ว/ราคาถูกสำหรับขั้นเลือก tool และเติม arguments (ว่าง = ใช้ MODEL ทุกขั้นแบบเดิม)
+CHEAP_MODEL = os.getenv("OPENROUTER_CHEAP_MODEL", "")
 OPENAI_API_KEY = os.getenv("OPENROUTER_API_KEY")
 SERVER_COMMAND = "python"
 SERVER_ARGS = ["server.py"]
@@ -35,40 +65,273 @@ async def _setup_mcp():
             await session.initialize()
             yield session
 
-# --- 💡 โค้ดที่แก้ไขแล้ว ---
+# ------------------- MCP SESSION POOL -------------------
+
+# จำนวน server.py ที่เปิดค้างไว้ (warm) และใช้ร่วมกันทุกแชท
+MCP_POOL_SIZE = max(1, int(os.getenv("MCP_POOL_SIZE", "2")))
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "120"))
+MCP_HEALTH_INTERVAL = float(os.getenv("MCP_HEALTH_INTERVAL", "30"))
+MCP_RESPAWN_BACKOFF = 1.0
+
+# Tools ที่มี state อยู่ใน process ของ server (เช่น index ของ ChromaDB ที่โหลดไว้ใน memory)
+# ต้องถูกส่งไปที่ worker ตัวแรกเสมอ ไม่เช่นนั้น worker แต่ละตัวจะเห็นข้อมูลไม่ตรงกัน
+MCP_PINNED_TOOLS = {"save_memory_chunk", "save_memory_chunks", "search_relevant_memories", "list_all_memories",
+                    "maintain_memories", "memory_maintenance_report", "ingest_documents", "write_chunk",
+                    "search_workspace"}
+
+
+class MCPSessionPool:
+    """
+    Pool ของ MCP sessions ที่เปิดค้างไว้ตลอดอายุของ process แทนการ spawn server.py ใหม่ทุกครั้ง
+
+    ทุก session อยู่บน event loop ของ background thread เดียว (session ของ MCP ผูกกับ loop ที่สร้างมัน)
+    worker แต่ละตัวถือ server process หนึ่งตัว, ping เป็นระยะเมื่อว่าง และ respawn อัตโนมัติเมื่อ process ตาย
+    """
+
+    def __init__(self, size: int = MCP_POOL_SIZE, call_timeout: float = MCP_CALL_TIMEOUT,
+                 health_interval: float = MCP_HEALTH_INTERVAL):
+        self.size = size
+        self.call_timeout = call_timeout
+        self.health_interval = health_interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: list[asyncio.Queue] = []
+        self._pending = [0] * size
+        self._healthy = [False] * size
+        self._tasks: list[asyncio.Task] = []
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "errors": 0, "respawns": 0, "total_latency_ms": 0.0}
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run_loop():
+                asyncio.set_event_loop(loop)
+                self._queues = [asyncio.Queue() for _ in range(self.size)]
+                self._tasks = [loop.create_task(self._worker(i)) for i in range(self.size)]
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=_run_loop, name="mcp-session-pool", daemon=True).start()
+            ready.wait()
+            self._loop = loop
+            atexit.register(self.close)
+            return loop
+
+    async def _worker(self, worker_id: int):
+        """เปิด server process หนึ่งตัวแล้วรับงานจาก queue ของตัวเอง, respawn เมื่อ session พัง"""
+        while True:
+            try:
+                async with _setup_mcp() as session:
+                    self._healthy[worker_id] = True
+                    await self._serve(worker_id, session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"!!! MCP worker {worker_id} failed: {e} - respawning !!!")
+            self._healthy[worker_id] = False
+            with self._lock:
+                self._stats["respawns"] += 1
+            await asyncio.sleep(MCP_RESPAWN_BACKOFF)
+
+    async def _serve(self, worker_id: int, session: ClientSession):
+        """รับงานจาก queue แล้วยิงเข้า session เดียวกันพร้อมกันได้หลายงาน (MCP รองรับ request แบบ multiplex)"""
+        queue = self._queues[worker_id]
+        async with asyncio.TaskGroup() as task_group:
+            while True:
+                try:
+                    job = await asyncio.wait_for(queue.get(), timeout=self.health_interval)
+                except asyncio.TimeoutError:
+                    # Health check: ถ้า ping ไม่ผ่าน exception จะทำให้ worker respawn
+                    await session.send_ping()
+                    continue
+                try:
+                    task_group.create_task(self._run_job(worker_id, session, job))
+                except RuntimeError:
+                    # งานอื่นทำให้ session พังไปแล้ว (task group กำลังปิด): คืนงานเข้า queue ให้ session ที่ respawn รัน
+                    queue.put_nowait(job)
+                    raise
+
+    async def _run_job(self, worker_id: int, session: ClientSession, job: tuple):
+        tool_name, arguments, future, attempt = job
+        if future.done():
+            self._pending[worker_id] -= 1
+            return
+        try:
+            result = await session.call_tool(
+                tool_name, arguments=arguments,
+                read_timeout_seconds=timedelta(seconds=self.call_timeout),
+            )
+        except asyncio.CancelledError:
+            # session ถูกปิดเพราะงานอื่นทำให้พัง: คืนงานนี้เข้า queue เพื่อรันบน session ใหม่
+            self._queues[worker_id].put_nowait(job)
+            raise
+        except McpError as e:
+            # error ระดับ protocol (เช่น timeout ของ tool) session ยังใช้ต่อได้
+            self._pending[worker_id] -= 1
+            if not future.done():
+                future.set_exception(e)
+            return
+        except Exception as e:
+            # session นี้ใช้ต่อไม่ได้แล้ว: ลองงานนี้ใหม่อีกครั้งบน session ที่ respawn แล้ว
+            if attempt == 0:
+                self._queues[worker_id].put_nowait((tool_name, arguments, future, attempt + 1))
+            else:
+                self._pending[worker_id] -= 1
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        self._pending[worker_id] -= 1
+        if not future.done():
+            future.set_result(result.content[0].text if result.content else '{"error": "No content returned from tool"}')
+
+    def _pick_worker(self, tool_name: str) -> int:
+        if tool_name in MCP_PINNED_TOOLS or self.size == 1:
+            return 0
+        return min(range(self.size), key=lambda i: (not self._healthy[i], self._pending[i]))
+
+    async def _submit(self, tool_name: str, arguments: dict) -> str:
+        """รันบน loop ของ pool: ส่งงานเข้า queue ของ worker ที่เหมาะสมแล้วรอผลลัพธ์"""
+        worker_id = self._pick_worker(tool_name)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[worker_id] += 1
+        self._queues[worker_id].put_nowait((tool_name, arguments, future, 0))
+        return await future
+
+    def _call_timeout_total(self) -> float:
+        # เผื่อเวลาให้ respawn ได้หนึ่งครั้งก่อนจะยอมแพ้
+        return self.call_timeout * 2 + 30
+
+    def _record(self, started: float, failed: bool = False):
+        # ถูกเรียกจากทั้ง thread ของผู้เรียก (call) และ loop ของแชท (acall) จึงต้องถือ lock
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["errors"] += int(failed)
+            self._stats["total_latency_ms"] += (time.perf_counter() - started) * 1000
+
+    def call(self, tool_name: str, arguments: dict) -> str:
+        """เรียก MCP tool แบบ synchronous ผ่าน session ที่เปิดค้างไว้"""
+        loop = self._ensure_started()
+        started = time.perf_counter()
+        concurrent_future = asyncio.run_coroutine_threadsafe(self._submit(tool_name, arguments), loop)
+        try:
+            result = concurrent_future.result(timeout=self._call_timeout_total())
+        except Exception as e:
+            concurrent_future.cancel()
+            self._record(started, failed=True)
+            return json.dumps({"error": f"Failed to run async tool {tool_name}: {e}"})
+        self._record(started)
+        return result
+
+    async def acall(self, tool_name: str, arguments: dict) -> str:
+        """
+        เรียก MCP tool จาก event loop ใดก็ได้ (เช่น loop ของ Chainlit) โดยไม่ block loop นั้น
+        งานจริงรันบน loop ของ pool แล้วค่อยส่งผลกลับมาผ่าน future
+        """
+        loop = self._ensure_started()
+        started = time.perf_counter()
+        concurrent_future = asyncio.run_coroutine_threadsafe(self._submit(tool_name, arguments), loop)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(concurrent_future), timeout=self._call_timeout_total())
+        except asyncio.CancelledError:
+            concurrent_future.cancel()
+            raise
+        except Exception as e:
+            concurrent_future.cancel()
+            self._record(started, failed=True)
+            return json.dumps({"error": f"Failed to run async tool {tool_name}: {e}"})
+        self._record(started)
+        return result
+
+    def stats(self) -> dict:
+        """สถิติของ pool สำหรับวัด latency ต่อการเรียก tool"""
+        with self._lock:
+            stats = dict(self._stats)
+        calls = stats["calls"]
+        return {
+            **stats,
+            "avg_latency_ms": round(stats["total_latency_ms"] / calls, 2) if calls else 0.0,
+            "healthy_workers": sum(self._healthy),
+            "pending": list(self._pending),
+        }
+
+    def close(self):
+        """ปิด server processes ทั้งหมด (เรียกอัตโนมัติตอน process จบ)"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def _shutdown():
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(_shutdown(), loop).result(timeout=10)
+        except Exception as e:
+            print(f"!!! MCP pool shutdown error: {e} !!!")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+# Pool กลางที่ใช้ร่วมกันทุกแชทใน process นี้
+mcp_pool = MCPSessionPool()
 
 def _run_async_tool(tool_name: str, arguments: dict) -> str:
-    """Helper function to run an async MCP tool synchronously."""
-    async def _async_call():
-        async with _setup_mcp() as session:
-            result = await session.call_tool(tool_name, arguments=arguments)
-            return result.content[0].text if result.content else '{"error": "No content returned from tool"}'
+    """Helper function to run an MCP tool synchronously through the shared session pool."""
+    return mcp_pool.call(tool_name, arguments)
 
-    try:
-        # ใช้ asyncio.run() ซึ่งจัดการ loop ให้เอง
-        return asyncio.run(_async_call())
-    except Exception as e:
-        return json.dumps({"error": f"Failed to run async tool {tool_name}: {e}"})
+async def _arun_mcp_tool(tool_name: str, arguments: dict) -> str:
+    """Helper function to await an MCP tool without blocking the caller's event loop."""
+    return await mcp_pool.acall(tool_name, arguments)
 
 # Sync wrappers ที่เรียกใช้ MCP Server ทั้งหมด
 # --- 💡 โค้ดที่แก้ไขแล้ว ---
-def sync_get_stock_price(tickers: list[str]) -> str:
+def sync_get_stock_price(tickers: list[str], output_format: str = "records") -> str:
     """Wrapper สำหรับเรียก tool get_stock_price ที่รองรับหลาย tickers."""
-    return _run_async_tool("get_stock_price", {"tickers": tickers})
+    return _run_async_tool("get_stock_price", {"tickers": tickers, "output_format": output_format})
+
+def sync_analyze_stocks(tickers: list[str], period: str = "6mo") -> str:
+    """Wrapper สำหรับเรียก tool analyze_stocks (สรุปตัวชี้วัดของหุ้นหลายตัว) บน MCP server."""
+    return _run_async_tool("analyze_stocks", {"tickers": tickers, "period": period})
 
 # --- 💡 1. เพิ่ม wrapper functions สำหรับ file tools ---
 def sync_get_current_date() -> str:
     """Wrapper สำหรับเรียก tool get_current_date บน MCP server."""
     return _run_async_tool("get_current_date", {})
 
-def sync_write_to_file(filename: str, content: str) -> str:
+def sync_write_to_file(filename: str, content: str, mode: str = "overwrite", compress: bool = False) -> str:
     """Wrapper สำหรับเรียก tool write_to_file บน MCP server."""
-    return _run_async_tool("write_to_file", {"filename": filename, "content": content})
+    return _run_async_tool("write_to_file", {"filename": filename, "content": content, "mode": mode, "compress": compress})
+
+def sync_write_chunk(content: str, handle: str = None, filename: str = None, final: bool = False,
+                     append: bool = False, compress: bool = False, abort: bool = False) -> str:
+    """Wrapper สำหรับเรียก tool write_chunk (เขียนไฟล์ใหญ่ทีละส่วน) บน MCP server."""
+    args = {"content": content, "handle": handle, "filename": filename, "final": final, "append": append,
+            "compress": compress, "abort": abort}
+    return _run_async_tool("write_chunk", {k: v for k, v in args.items() if v is not None})
 
 def sync_read_from_file(filename: str) -> str:
     """Wrapper สำหรับเรียก tool read_from_file บน MCP server."""
     return _run_async_tool("read_from_file", {"filename": filename})
 
+def sync_read_chunk(handle: str, offset: int = 0) -> str:
+    """Wrapper สำหรับเรียก tool read_chunk (อ่านส่วนถัดไปของหน้าเว็บ/ไฟล์) บน MCP server."""
+    return _run_async_tool("read_chunk", {"handle": handle, "offset": offset})
+
+def sync_ingest_documents(filenames: list[str] = None, pattern: str = None, index_to_memory: bool = False) -> str:
+    """Wrapper สำหรับเรียก tool ingest_documents (extract ข้อความจากเอกสารหลายไฟล์) บน MCP server."""
+    args = {"filenames": filenames, "pattern": pattern, "index_to_memory": index_to_memory}
+    return _run_async_tool("ingest_documents", {k: v for k, v in args.items() if v is not None})
+
+def sync_search_workspace(query: str, pattern: str = None, limit: int = 20) -> str:
+    """Wrapper สำหรับเรียก tool search_workspace (ค้นข้อความในทุกไฟล์ของ workspace) บน MCP server."""
+    args = {"query": query, "pattern": pattern, "limit": limit}
+    return _run_async_tool("search_workspace", {k: v for k, v in args.items() if v is not None})
+
 def sync_calculator(expression: str) -> str:
     """Wrapper สำหรับเรียก tool calculator บน MCP server."""
     return _run_async_tool("calculator", {"expression": expression})
@@ -81,10 +344,18 @@ def sync_save_memory_chunk(content: str, metadata: dict = None) -> str:
         args["metadata"] = metadata
     return _run_async_tool("save_memory_chunk", args)
 
+def sync_save_memory_chunks(chunks: list[dict]) -> str:
+    """Wrapper สำหรับเรียก tool save_memory_chunks บน MCP server."""
+    return _run_async_tool("save_memory_chunks", {"chunks": chunks})
+
 # --- 💡 เพิ่ม wrapper สำหรับ browse_url ---
-def sync_browse_url(url: str) -> str:
+def sync_browse_url(url: str, main_content_only: bool = False) -> str:
     """Wrapper สำหรับเรียก tool browse_url บน MCP server."""
-    return _run_async_tool("browse_url", {"url": url})
+    return _run_async_tool("browse_url", {"url": url, "main_content_only": main_content_only})
+
+def sync_browse_urls(urls: list[str]) -> str:
+    """Wrapper สำหรับเรียก tool browse_urls (อ่านหลาย URL พร้อมกัน) บน MCP server."""
+    return _run_async_tool("browse_urls", {"urls": urls})
 
 # --- 💡 เพิ่ม wrapper functions สำหรับ REAL GUI tools ---
 def sync_see_screen() -> str:
@@ -107,16 +378,109 @@ def sync_execute_shell_command(command: str) -> str:
     """Wrapper สำหรับเรียก tool execute_shell_command บน MCP server."""
     return _run_async_tool("execute_shell_command", {"command": command})
 
-def sync_search_relevant_memories(query: str) -> str:
+def sync_search_relevant_memories(query: str, n_results: int = 5, mode: str = "hybrid", source: str = None,
+                                  saved_after: str = None, saved_before: str = None) -> str:
     """Wrapper สำหรับเรียก tool search_relevant_memories บน MCP server."""
-    return _run_async_tool("search_relevant_memories", {"query": query})
+    args = {"query": query, "n_results": n_results, "mode": mode,
+            "source": source, "saved_after": saved_after, "saved_before": saved_before}
+    return _run_async_tool("search_relevant_memories", {k: v for k, v in args.items() if v is not None})
 
 # --- 💡 1. เพิ่ม wrapper functions สำหรับ command center tools ---
-def sync_list_all_memories() -> str:
-    return _run_async_tool("list_all_memories", {})
+def sync_list_all_memories(offset: int = 0, limit: int = 50, cursor: str = None, mode: str = "full") -> str:
+    args = {"offset": offset, "limit": limit, "mode": mode}
+    if cursor:
+        args["cursor"] = cursor
+    return _run_async_tool("list_all_memories", args)
+
+def sync_list_workspace_files(pattern: str = None, extensions: list[str] = None, names: list[str] = None,
+                             sort_by: str = "name", descending: bool = False, offset: int = 0, limit: int = 200) -> str:
+    args = {"pattern": pattern, "extensions": extensions, "names": names,
+            "sort_by": sort_by, "descending": descending, "offset": offset, "limit": limit}
+    return _run_async_tool("list_workspace_files", {k: v for k, v in args.items() if v is not None})
+
+# --- 💡 Async wrappers: await MCP session โดยตรง ไม่ block event loop ของ Chainlit ---
+async def async_get_stock_price(tickers: list[str], output_format: str = "records") -> str:
+    return await _arun_mcp_tool("get_stock_price", {"tickers": tickers, "output_format": output_format})
+
+async def async_analyze_stocks(tickers: list[str], period: str = "6mo") -> str:
+    return await _arun_mcp_tool("analyze_stocks", {"tickers": tickers, "period": period})
+
+async def async_get_current_date() -> str:
+    return await _arun_mcp_tool("get_current_date", {})
+
+async def async_write_to_file(filename: str, content: str, mode: str = "overwrite", compress: bool = False) -> str:
+    return await _arun_mcp_tool("write_to_file", {"filename": filename, "content": content, "mode": mode, "compress": compress})
+
+async def async_write_chunk(content: str, handle: str = None, filename: str = None, final: bool = False,
+                            append: bool = False, compress: bool = False, abort: bool = False) -> str:
+    args = {"content": content, "handle": handle, "filename": filename, "final": final, "append": append,
+            "compress": compress, "abort": abort}
+    return await _arun_mcp_tool("write_chunk", {k: v for k, v in args.items() if v is not None})
+
+async def async_read_from_file(filename: str) -> str:
+    return await _arun_mcp_tool("read_from_file", {"filename": filename})
+
+async def async_read_chunk(handle: str, offset: int = 0) -> str:
+    return await _arun_mcp_tool("read_chunk", {"handle": handle, "offset": offset})
+
+async def async_ingest_documents(filenames: list[str] = None, pattern: str = None, index_to_memory: bool = False) -> str:
+    args = {"filenames": filenames, "pattern": pattern, "index_to_memory": index_to_memory}
+    return await _arun_mcp_tool("ingest_documents", {k: v for k, v in args.items() if v is not None})
+
+async def async_search_workspace(query: str, pattern: str = None, limit: int = 20) -> str:
+    args = {"query": query, "pattern": pattern, "limit": limit}
+    return await _arun_mcp_tool("search_workspace", {k: v for k, v in args.items() if v is not None})
+
+async def async_calculator(expression: str) -> str:
+    return await _arun_mcp_tool("calculator", {"expression": expression})
 
-def sync_list_workspace_files() -> str:
-    return _run_async_tool("list_workspace_files", {})
+async def async_save_memory_chunk(content: str, metadata: dict = None) -> str:
+    args = {"content": content}
+    if metadata is not None:
+        args["metadata"] = metadata
+    return await _arun_mcp_tool("save_memory_chunk", args)
+
+async def async_save_memory_chunks(chunks: list[dict]) -> str:
+    return await _arun_mcp_tool("save_memory_chunks", {"chunks": chunks})
+
+async def async_browse_url(url: str, main_content_only: bool = False) -> str:
+    return await _arun_mcp_tool("browse_url", {"url": url, "main_content_only": main_content_only})
+
+async def async_browse_urls(urls: list[str]) -> str:
+    return await _arun_mcp_tool("browse_urls", {"urls": urls})
+
+async def async_see_screen() -> str:
+    return await _arun_mcp_tool("see_screen", {})
+
+async def async_mouse_move(x: int, y: int) -> str:
+    return await _arun_mcp_tool("mouse_move", {"x": x, "y": y})
+
+async def async_mouse_click(x: int, y: int, button: str = 'left') -> str:
+    return await _arun_mcp_tool("mouse_click", {"x": x, "y": y, "button": button})
+
+async def async_keyboard_type(text: str) -> str:
+    return await _arun_mcp_tool("keyboard_type", {"text": text})
+
+async def async_execute_shell_command(command: str) -> str:
+    return await _arun_mcp_tool("execute_shell_command", {"command": command})
+
+async def async_search_relevant_memories(query: str, n_results: int = 5, mode: str = "hybrid", source: str = None,
+                                         saved_after: str = None, saved_before: str = None) -> str:
+    args = {"query": query, "n_results": n_results, "mode": mode,
+            "source": source, "saved_after": saved_after, "saved_before": saved_before}
+    return await _arun_mcp_tool("search_relevant_memories", {k: v for k, v in args.items() if v is not None})
+
+async def async_list_all_memories(offset: int = 0, limit: int = 50, cursor: str = None, mode: str = "full") -> str:
+    args = {"offset": offset, "limit": limit, "mode": mode}
+    if cursor:
+        args["cursor"] = cursor
+    return await _arun_mcp_tool("list_all_memories", args)
+
+async def async_list_workspace_files(pattern: str = None, extensions: list[str] = None, names: list[str] = None,
+                                    sort_by: str = "name", descending: bool = False, offset: int = 0, limit: int = 200) -> str:
+    args = {"pattern": pattern, "extensions": extensions, "names": names,
+            "sort_by": sort_by, "descending": descending, "offset": offset, "limit": limit}
+    return await _arun_mcp_tool("list_workspace_files", {k: v for k, v in args.items() if v is not None})
 
 # ------------------- ROBUST TAVILY TOOL (THE FIX) -------------------
 
@@ -125,6 +489,11 @@ class TavilyInput(BaseModel):
     query: str = Field(description="The search query.")
     include_domains: Optional[Union[str, list[str]]] = Field(description="A list of domains to specifically search within.")
 
+@functools.lru_cache(maxsize=1)
+def _get_tavily_search() -> TavilySearch:
+    """สร้าง TavilySearch ครั้งเดียวแล้วใช้ซ้ำ แทนการสร้างใหม่ทุกครั้งที่ค้นหา"""
+    return TavilySearch(max_results=5)
+
 class RobustTavilySearchTool(BaseTool):
     """
     A wrapper for TavilySearch that is more forgiving with its input types.
@@ -139,8 +508,8 @@ class RobustTavilySearchTool(BaseTool):
 
     def _run(self, query: str, include_domains: Optional[Union[str, list[str]]] = None) -> str:
         """Use the tool."""
-        # สร้าง instance ของ tool จริง
-        tavily_tool = TavilySearch(max_results=5)
+        # ใช้ instance ของ tool จริงที่สร้างไว้ครั้งเดียว
+        tavily_tool = _get_tavily_search()
         
         # --- 💡 นี่คือ "เกราะป้องกัน" ของเรา ---
         final_domains = include_domains
@@ -152,8 +521,8 @@ class RobustTavilySearchTool(BaseTool):
 
     async def _arun(self, query: str, include_domains: Optional[Union[str, list[str]]] = None) -> str:
         """Use the tool asynchronously."""
-        # สร้าง instance ของ tool จริง
-        tavily_tool = TavilySearch(max_results=5)
+        # ใช้ instance ของ tool จริงที่สร้างไว้ครั้งเดียว
+        tavily_tool = _get_tavily_search()
 
         # --- 💡 "เกราะป้องกัน" สำหรับโหมด async ---
         final_domains = include_domains
@@ -164,82 +533,176 @@ class RobustTavilySearchTool(BaseTool):
 
 # ------------------- EXISTING TOOLS -------------------
 
+def _mcp_tool(sync_func):
+    """
+    สร้าง LangChain tool จาก async function ที่ถูก decorate (ชื่อ, คำอธิบาย และ schema มาจาก async function นั้น)
+    พร้อม sync_func สำหรับผู้เรียกแบบ sync (.invoke() ใน script ทดสอบ)
+    ใน Chainlit ทุก tool จะถูกเรียกผ่าน coroutine (ainvoke) ซึ่งไม่ block event loop
+    """
+    def _decorate(coroutine) -> StructuredTool:
+        name = coroutine.__name__
+        return StructuredTool.from_function(
+            func=sync_func,
+            coroutine=coroutine,
+            name=name,
+            description=textwrap.dedent(coroutine.__doc__).strip(),
+            args_schema=create_schema_from_function(name, coroutine),
+        )
+    return _decorate
+
 # LangChain Tools (clean description)
-@tool
-def get_stock_price(tickers: list[str]) -> str:
+@_mcp_tool(sync_get_stock_price)
+async def get_stock_price(tickers: list[str], output_format: str = "records") -> str:
     """
     ใช้ดึงข้อมูลหุ้นย้อนหลัง 10 วันล่าสุดสำหรับ Ticker "หลายตัว" พร้อมกันในครั้งเดียว
     เช่น ["NVDA", "GOOGL"]
+    output_format: 'records' (ค่าเริ่มต้น: dict ต่อแถว), 'columnar' (กระชับกว่า: ชื่อคอลัมน์ครั้งเดียว
+    + array ของค่าแต่ละคอลัมน์ เหมาะกับหลาย ticker/ช่วงยาว) หรือ 'csv'/'arrow' (บันทึกเป็นไฟล์ใน workspace แล้วคืนแค่สรุป)
     """
-    return sync_get_stock_price(tickers)
+    return await async_get_stock_price(tickers, output_format)
+
+@_mcp_tool(sync_analyze_stocks)
+async def analyze_stocks(tickers: list[str], period: str = "6mo") -> str:
+    """
+    ใช้วิเคราะห์หุ้น "หลายตัว" พร้อมกันในครั้งเดียว คืนค่าเป็นสรุปตัวเลขที่คำนวณไว้แล้ว:
+    ผลตอบแทน, ความผันผวน, max drawdown, SMA, RSI และ correlation ระหว่างหุ้น
+    ใช้แทนการดึงข้อมูลดิบแล้วคำนวณเองทีละขั้นด้วย calculator (period เช่น '3mo', '6mo', '1y')
+    """
+    return await async_analyze_stocks(tickers, period)
 
 # --- 💡 2. เพิ่ม LangChain tool definitions สำหรับ file tools ---
-@tool
-def get_current_date() -> str:
+@_mcp_tool(sync_get_current_date)
+async def get_current_date() -> str:
     """
     ใช้เครื่องมือนี้เมื่อต้องการทราบวันที่หรือเวลาปัจจุบัน
     """
-    return sync_get_current_date()
+    return await async_get_current_date()
 
-@tool
-def write_to_file(filename: str, content: str) -> str:
+@_mcp_tool(sync_write_to_file)
+async def write_to_file(filename: str, content: str, mode: str = "overwrite", compress: bool = False) -> str:
     """
     ใช้เครื่องมือนี้เพื่อเขียนหรือบันทึกข้อมูลที่เป็นข้อความ (content) ลงในไฟล์ (filename)
     มีประโยชน์มากสำหรับการบันทึกสรุป, ร่างอีเมล, หรือผลลัพธ์การทำงาน
+    mode="append" จะต่อท้ายไฟล์เดิม (ส่งเฉพาะข้อมูลใหม่ ไม่ต้องส่งเนื้อหาเดิมซ้ำ), compress=True บันทึกเป็น .gz
     """
-    return sync_write_to_file(filename, content)
+    return await async_write_to_file(filename, content, mode, compress)
 
-@tool
-def read_from_file(filename: str) -> str:
+@_mcp_tool(sync_write_chunk)
+async def write_chunk(content: str, handle: str = None, filename: str = None, final: bool = False,
+                      append: bool = False, compress: bool = False, abort: bool = False) -> str:
+    """
+    ใช้เขียนไฟล์ขนาดใหญ่ (เช่น รายงานหรือ CSV ยาวๆ) ทีละส่วนข้ามหลายขั้นตอน
+    ครั้งแรกใส่ filename แล้วจะได้ handle กลับมา ครั้งต่อไปใส่ handle เดิมกับ content ส่วนถัดไป
+    ส่วนสุดท้ายให้ใส่ final=True ไฟล์จึงจะถูกบันทึกจริง ถ้าต้องการยกเลิกให้ใส่ handle กับ abort=True
+    """
+    return await async_write_chunk(content, handle, filename, final, append, compress, abort)
+
+@_mcp_tool(sync_read_from_file)
+async def read_from_file(filename: str) -> str:
     """
-    ใช้เครื่องมือนี้เพื่ออ่านเนื้อหาทั้งหมดจากไฟล์ (filename) ที่มีอยู่
+    ใช้เครื่องมือนี้เพื่ออ่านเนื้อหาจากไฟล์ (filename) ที่มีอยู่ (คืนค่าทีละ chunk พร้อม handle)
+    รองรับไฟล์ข้อความ และ .pdf / .docx (extract ข้อความให้อัตโนมัติ เฉพาะหน้าที่อ่านถึง)
     มีประโยชน์เมื่อต้องการข้อมูลจากไฟล์เพื่อนำมาตอบคำถามหรือทำงานต่อ
     """
-    return sync_read_from_file(filename)
+    return await async_read_from_file(filename)
 
-@tool
-def calculator(expression: str) -> str:
+@_mcp_tool(sync_ingest_documents)
+async def ingest_documents(filenames: list[str] = None, pattern: str = None, index_to_memory: bool = False) -> str:
+    """
+    extract ข้อความจากเอกสารหลายไฟล์ใน workspace (PDF, DOCX, CSV, Markdown, TXT) พร้อมกัน
+    ระบุ filenames หรือ pattern (glob เช่น "*.pdf") และใส่ index_to_memory=True เพื่อบันทึกเนื้อหาลงความจำระยะยาว
+    (ค้นภายหลังได้ด้วย search_relevant_memories โดย source คือชื่อไฟล์)
+    """
+    return await async_ingest_documents(filenames, pattern, index_to_memory)
+
+@_mcp_tool(sync_search_workspace)
+async def search_workspace(query: str, pattern: str = None, limit: int = 20) -> str:
+    """
+    ค้นหาว่าไฟล์ไหนใน workspace (รวม PDF/DOCX) มีข้อความที่ต้องการ คืนชื่อไฟล์ เลขบรรทัด และ snippet
+    ใช้แทนการเปิดอ่านทุกไฟล์ คำค้นแต่ละคำต้องยาวอย่างน้อย 3 ตัวอักษร, pattern เช่น "*.md" ใช้จำกัดไฟล์ (ไม่บังคับ)
+    """
+    return await async_search_workspace(query, pattern, limit)
+
+@_mcp_tool(sync_read_chunk)
+async def read_chunk(handle: str, offset: int = 0) -> str:
+    """
+    ใช้อ่าน "ส่วนถัดไป" ของหน้าเว็บหรือไฟล์ที่ยาวเกินหนึ่ง chunk
+    ใส่ handle และ next_offset จากผลลัพธ์ของ browse_url หรือ read_from_file (ไม่ต้องดาวน์โหลดใหม่)
+    """
+    return await async_read_chunk(handle, offset)
+
+@_mcp_tool(sync_calculator)
+async def calculator(expression: str) -> str:
     """
     ใช้เครื่องมือนี้เมื่อต้องการคำนวณทางคณิตศาสตร์เท่านั้น
     เช่น '2 * (3 + 4)', '(8000 + 36500)', etc.
     """
-    return sync_calculator(expression)
+    return await async_calculator(expression)
 
 # เพิ่ม tool definitions สำหรับ memory tools
-@tool
-def save_memory_chunk(content: str, metadata: dict = None) -> str:
+@_mcp_tool(sync_save_memory_chunk)
+async def save_memory_chunk(content: str, metadata: dict = None) -> str:
     """
     ใช้เพื่อบันทึกข้อมูลสำคัญ, ข้อเท็จจริง, หรือบทสรุปที่ได้เรียนรู้ลงในความจำระยะยาว
     metadata เป็น dict ที่ไม่บังคับ สำหรับเก็บข้อมูลเสริม เช่น {"source": "URL"}
     """
-    return sync_save_memory_chunk(content, metadata)
+    return await async_save_memory_chunk(content, metadata)
+
+@_mcp_tool(sync_save_memory_chunks)
+async def save_memory_chunks(chunks: list[dict]) -> str:
+    """
+    ใช้เพื่อบันทึกข้อมูลสำคัญ "หลายชิ้นพร้อมกัน" ลงในความจำระยะยาว (เร็วกว่าเรียก save_memory_chunk ทีละชิ้น)
+    chunks เป็นลิสต์ของ {"content": "ข้อความ", "metadata": {...} (ไม่บังคับ)}
+    เนื้อหาที่เคยบันทึกไว้แล้วจะไม่ถูกบันทึกซ้ำ
+    """
+    return await async_save_memory_chunks(chunks)
 
 # --- 💡 เพิ่ม LangChain tool definition สำหรับ browse_url ---
-@tool
-def browse_url(url: str) -> str:
+@_mcp_tool(sync_browse_url)
+async def browse_url(url: str, main_content_only: bool = False) -> str:
     """
     ใช้เครื่องมือนี้เมื่อต้องการเข้าไป "อ่านเนื้อหาทั้งหมด" จาก URL ที่ระบุโดยตรง
     นี่คือเครื่องมือหลักสำหรับการวิจัยเชิงลึกหลังจากที่ได้ URL มาแล้ว
+    ตั้ง main_content_only=True เพื่อเอาเฉพาะเนื้อหาหลักของบทความ (ตัดเมนูและลิงก์รวมทิ้ง)
     """
-    return sync_browse_url(url)
+    return await async_browse_url(url, main_content_only)
 
-@tool
-def search_relevant_memories(query: str) -> str:
+@_mcp_tool(sync_browse_urls)
+async def browse_urls(urls: list[str]) -> str:
+    """
+    ใช้เครื่องมือนี้เมื่อต้องการอ่านเนื้อหาจาก "หลาย URL พร้อมกัน" ในครั้งเดียว
+    เร็วกว่าการเรียก browse_url ทีละตัวมาก คืนค่าผลลัพธ์ (หรือ error) แยกตามแต่ละ URL
+    """
+    return await async_browse_urls(urls)
+
+@_mcp_tool(sync_search_relevant_memories)
+async def search_relevant_memories(query: str, n_results: int = 5, mode: str = "hybrid", source: str = None,
+                                   saved_after: str = None, saved_before: str = None) -> str:
     """
     ค้นหาความรู้หรือข้อมูลที่เกี่ยวข้องจากระบบความจำถาวรเพื่อช่วยในการแก้ปัญหา
+    ค้นทั้งความหมายและคำที่ตรงตัว (ชื่อ, ticker, ID) โดย mode เป็น "hybrid" (default), "vector" หรือ "keyword"
+    กรองได้ด้วย source (metadata.source) และช่วงวันที่บันทึก saved_after / saved_before (ISO เช่น "2025-01-31")
     """
-    return sync_search_relevant_memories(query)
+    return await async_search_relevant_memories(query, n_results, mode, source, saved_after, saved_before)
 
 # --- 💡 2. เพิ่ม LangChain tool definitions ---
-@tool
-def list_all_memories() -> str:
-    """แสดงรายการความทรงจำทั้งหมดที่บันทึกไว้"""
-    return sync_list_all_memories()
+@_mcp_tool(sync_list_all_memories)
+async def list_all_memories(offset: int = 0, limit: int = 50, cursor: str = None, mode: str = "full") -> str:
+    """
+    แสดงรายการความทรงจำที่บันทึกไว้ทีละหน้า (offset/limit หรือส่ง next_cursor จากหน้าก่อนเพื่อดูหน้าถัดไป)
+    mode: "full" (default), "metadata" (ไม่มีเนื้อหา) หรือ "count" (นับจำนวนอย่างเดียว)
+    """
+    return await async_list_all_memories(offset, limit, cursor, mode)
 
-@tool
-def list_workspace_files() -> str:
-    """แสดงรายการไฟล์ทั้งหมดในพื้นที่ทำงาน (workspace)"""
-    return sync_list_workspace_files()
+@_mcp_tool(sync_list_workspace_files)
+async def list_workspace_files(pattern: str = None, extensions: list[str] = None, names: list[str] = None,
+                               sort_by: str = "name", descending: bool = False, offset: int = 0, limit: int = 200) -> str:
+    """
+    แสดงรายการไฟล์ในพื้นที่ทำงาน (workspace) พร้อมขนาดรวม
+    กรองได้ด้วย pattern (glob เช่น "*.csv") หรือ extensions (เช่น ["csv", "md"]),
+    เรียงด้วย sort_by ("name", "size", "modified") และแบ่งหน้าด้วย offset/limit
+    """
+    return await async_list_workspace_files(pattern, extensions, names, sort_by, descending, offset, limit)
 
 # --- 💡 เพิ่ม Tool ใหม่สำหรับ Human-in-the-Loop ---
 @tool
@@ -257,75 +720,839 @@ async def ask_user(question: str) -> str:
         return "The user did not respond in time."
 
 # --- 💡 เพิ่ม tool definitions สำหรับ REAL GUI tools ---
-@tool
-def see_screen() -> str:
+@_mcp_tool(sync_see_screen)
+async def see_screen() -> str:
     """ใช้เพื่อ 'มองเห็น' และวิเคราะห์สิ่งที่อยู่บนหน้าจอปัจจุบันทั้งหมด"""
-    return sync_see_screen()
+    return await async_see_screen()
 
-@tool
-def mouse_move(x: int, y: int) -> str:
+@_mcp_tool(sync_mouse_move)
+async def mouse_move(x: int, y: int) -> str:
     """ย้ายเมาส์ไปยังพิกัด (x, y)"""
-    return sync_mouse_move(x, y)
+    return await async_mouse_move(x, y)
 
-@tool
-def mouse_click(x: int, y: int, button: str = 'left') -> str:
+@_mcp_tool(sync_mouse_click)
+async def mouse_click(x: int, y: int, button: str = 'left') -> str:
     """คลิกเมาส์ที่พิกัด (x, y)"""
-    return sync_mouse_click(x, y, button)
+    return await async_mouse_click(x, y, button)
 
-@tool
-def keyboard_type(text: str) -> str:
+@_mcp_tool(sync_keyboard_type)
+async def keyboard_type(text: str) -> str:
     """พิมพ์ข้อความด้วยคีย์บอร์ด"""
-    return sync_keyboard_type(text)
+    return await async_keyboard_type(text)
 
-@tool
-def execute_shell_command(command: str) -> str:
+@_mcp_tool(sync_execute_shell_command)
+async def execute_shell_command(command: str) -> str:
     """รันคำสั่งใน command line (จำกัดเฉพาะคำสั่งปลอดภัย)"""
-    return sync_execute_shell_command(command)
+    return await async_execute_shell_command(command)
+
+
+# ------------------- PARALLEL TOOL DISPATCH -------------------
+
+# จำนวน tool calls สูงสุดที่รันพร้อมกันได้ใน step เดียวของ agent (tool calls จาก LLM turn เดียวกัน)
+# แต่ละแชทมีโควตาของตัวเอง แชทหนึ่งที่สั่ง tool จำนวนมากจึงไม่แย่ง slot ของแชทอื่น
+TOOL_MAX_PARALLEL = max(1, int(os.getenv("TOOL_MAX_PARALLEL", "5")))
+
+# Tools ที่ใช้ทรัพยากรร่วมกันถูกจัดเป็นกลุ่ม และจำกัดจำนวนที่รันพร้อมกันต่อกลุ่ม (รวมทุกแชทบน event loop เดียวกัน)
+# GUI tools ใช้หน้าจอ/เมาส์ชุดเดียวกัน จึงต้องทำทีละขั้นตามลำดับที่ LLM สั่ง
+TOOL_CONCURRENCY_GROUPS = {
+    "see_screen": "gui", "mouse_move": "gui", "mouse_click": "gui",
+    "keyboard_type": "gui", "execute_shell_command": "gui",
+    "ask_user": "ask_user",
+}
+TOOL_CONCURRENCY_CAPS = {"gui": 1, "ask_user": 1}
+
+# semaphore ของ step ที่กำลังรันอยู่ (task ที่ asyncio.gather สร้างให้แต่ละ tool call จะได้ค่านี้ไปด้วย)
+_step_slots: contextvars.ContextVar[Optional[asyncio.Semaphore]] = contextvars.ContextVar("tool_step_slots", default=None)
+
+
+class ToolDispatcher:
+    """
+    จำกัดการรัน tool calls พร้อมกันด้วย semaphore ต่อ step ของ agent + semaphore ต่อกลุ่มของ tool
+
+    Semaphore ของกลุ่มใช้ร่วมกันทุกแชท แต่ asyncio ผูก semaphore กับ event loop จึงแยกชุดตาม loop ที่เรียกใช้
+    """
+
+    def __init__(self, max_parallel: int = TOOL_MAX_PARALLEL, caps: dict = None, groups: dict = None):
+        self.max_parallel = max_parallel
+        self.caps = TOOL_CONCURRENCY_CAPS if caps is None else caps
+        self.groups = TOOL_CONCURRENCY_GROUPS if groups is None else groups
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def begin_step(self) -> contextvars.Token:
+        """เริ่ม step ใหม่ของ agent: tool calls ที่สร้างหลังจากนี้ใช้โควตา max_parallel ชุดใหม่"""
+        return _step_slots.set(asyncio.Semaphore(self.max_parallel))
+
+    def end_step(self, token: contextvars.Token):
+        try:
+            _step_slots.reset(token)
+        except ValueError:
+            pass  # generator ถูกปิดจาก context อื่น (เช่น ตอน garbage collect) ค่าใน context เดิมไม่ถูกใช้ต่อแล้ว
+
+    def _slots(self, tool_name: str) -> list[asyncio.Semaphore]:
+        slots = []
+        group = self.groups.get(tool_name)
+        if group in self.caps:
+            semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+            if group not in semaphores:
+                semaphores[group] = asyncio.Semaphore(self.caps[group])
+            # จองกลุ่มก่อน slot ของ step เพื่อไม่ให้ tool ที่รอคิวกลุ่มไปกิน slot ของ step ไว้เปล่าๆ
+            slots.append(semaphores[group])
+        step_slots = _step_slots.get()
+        if step_slots is not None:
+            slots.append(step_slots)
+        return slots
+
+    async def run(self, tool_name: str, coroutine_factory):
+        """รอ slot ที่ว่างแล้วค่อยรัน coroutine ของ tool"""
+        slots = self._slots(tool_name)
+        for slot in slots:
+            await slot.acquire()
+        try:
+            return await coroutine_factory()
+        finally:
+            for slot in reversed(slots):
+                slot.release()
+
+
+tool_dispatcher = ToolDispatcher()
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor ที่รัน tool calls อิสระจาก LLM turn เดียวกันพร้อมกันผ่าน tool_dispatcher
+
+    ในโหมด async ตัว AgentExecutor จะ gather ทุก action ของ step เดียวกันอยู่แล้ว (ผลลัพธ์เรียงตามลำดับเดิม)
+    คลาสนี้เพิ่มแค่การจำกัดจำนวนที่รันพร้อมกัน ทั้งต่อ step และต่อกลุ่มของ tool
+    """
+
+    async def _aiter_next_step(self, *args, **kwargs):
+        token = tool_dispatcher.begin_step()
+        try:
+            async for item in super()._aiter_next_step(*args, **kwargs):
+                yield item
+        finally:
+            tool_dispatcher.end_step(token)
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        return await tool_dispatcher.run(
+            agent_action.tool,
+            lambda: super(ParallelAgentExecutor, self)._aperform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            ),
+        )
+
+
+# ------------------- LLM RESPONSE CACHE -------------------
+
+# off = ไม่แคช, deterministic = แคชเฉพาะเมื่อ temperature = 0 (ผลลัพธ์ซ้ำได้), always = แคชทุกครั้ง
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "deterministic").lower()
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_PATH = os.path.join("cache", "llm_responses.sqlite3")
+LLM_TEMPERATURE = float(os.environ["LLM_TEMPERATURE"]) if os.getenv("LLM_TEMPERATURE") else None
+
+
+def _message_fingerprint(message: BaseMessage) -> dict:
+    """ส่วนของข้อความที่มีผลต่อคำตอบ (ตัด id/metadata ที่เปลี่ยนทุกครั้งทิ้ง เช่น id ของ run และ tool call)"""
+    fingerprint = {"type": message.type, "content": message.content}
+    if isinstance(message, AIMessage) and message.tool_calls:
+        fingerprint["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in message.tool_calls]
+    return fingerprint
+
+
+def _as_chunk(message: AIMessage) -> AIMessageChunk:
+    return AIMessageChunk(
+        content=message.content,
+        additional_kwargs=message.additional_kwargs,
+        tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False), "id": call["id"], "index": i}
+            for i, call in enumerate(message.tool_calls)
+        ],
+    )
+
+
+class LLMResponseCache:
+    """
+    แคชคำตอบของ LLM สองชั้น: LRU ในหน่วยความจำ + SQLite บนดิสก์ (อยู่รอดข้ามการรีสตาร์ท)
+    key มาจาก model + ข้อความทั้งหมด + schema ของ tools ที่ bind ไว้
+
+    single-flight: ถ้ามี request ที่ key เดียวกันกำลังรออยู่ (เช่น retry หรือหลายแชทถามเรื่องเดียวกันพร้อมกัน)
+    request ที่มาทีหลังจะรอผลของตัวแรกแทนการยิง API ซ้ำ
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MEMORY_ENTRIES, ttl: float = LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple[float, AIMessage]]" = OrderedDict()
+        self._inflight: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "deduplicated": 0, "bypassed": 0}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, message TEXT, created_at REAL)")
+
+    @staticmethod
+    def make_key(params: dict, messages: list[BaseMessage]) -> str:
+        payload = {"params": params, "messages": [_message_fingerprint(m) for m in messages]}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def record(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key: str) -> AIMessage | None:
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached and now - cached[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return cached[1]
+            row = self._conn.execute("SELECT message, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if not row or now - row[1] > self.ttl:
+            return None
+        message = loads(row[0])
+        with self._lock:
+            self._remember_locked(key, row[1], message)
+            self._stats["disk_hits"] += 1
+        return message
+
+    def _lead_or_follow(self, key: str) -> concurrent.futures.Future | None:
+        """None = ผู้เรียกเป็น leader ของ key นี้ (ต้องเรียก LLM เอง) ไม่เช่นนั้นคืน future ของ leader ที่ต้องรอ"""
+        # มี leader ได้ทีละตัวต่อ key: ถ้า leader ล้มเหลว ตัวที่รออยู่ตัวแรกที่ตื่นจะเป็น leader คนใหม่ ที่เหลือรอต่อ
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is None:
+                self._inflight[key] = concurrent.futures.Future()
+                self._stats["misses"] += 1
+                return None
+        self.record("deduplicated")
+        return leader
+
+    def get_or_wait(self, key: str) -> AIMessage | None:
+        """เหมือน aget_or_wait สำหรับผู้เรียกแบบ sync (block thread นี้ระหว่างรอ leader)"""
+        while True:
+            message = self.get(key)
+            if message is not None:
+                return message
+            leader = self._lead_or_follow(key)
+            if leader is None:
+                return None
+            leader.result()
+
+    async def aget_or_wait(self, key: str) -> AIMessage | None:
+        """คืนคำตอบที่แคชไว้ หรือ None ถ้าผู้เรียกต้องเรียก LLM เอง (และต้องเรียก put/release ตามมา)"""
+        while True:
+            message = self.get(key)
+            if message is not None:
+                return message
+            leader = self._lead_or_follow(key)
+            if leader is None:
+                return None
+            # concurrent future รอได้จากทุก event loop (แชทคนละ thread/loop ก็รอ leader ตัวเดียวกันได้)
+            await asyncio.shield(asyncio.wrap_future(leader))
+
+    def _remember_locked(self, key: str, created_at: float, message: AIMessage):
+        self._memory[key] = (created_at, message)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, message: AIMessage):
+        now = time.time()
+        with self._lock:
+            self._remember_locked(key, now, message)
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, dumps(message), now))
+            self._conn.commit()
+        self.release(key)
+
+    def release(self, key: str):
+        """ปลุก request ที่รอ key นี้อยู่ (ถ้า leader ล้มเหลว ตัวที่รอตัวแรกจะเป็น leader คนใหม่และเรียก LLM เอง)"""
+        with self._lock:
+            leader = self._inflight.pop(key, None)
+        if leader is not None and not leader.done():
+            leader.set_result(None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return {**self._stats, "hit_rate": round(hits / lookups, 3) if lookups else 0.0}
+
+
+llm_cache = LLMResponseCache()
+
+
+class CachedChatOpenAI(ChatOpenAI):
+    """ChatOpenAI ที่ผ่าน llm_cache ก่อนเรียก API ทั้งแบบ invoke และแบบ stream"""
+
+    def _cache_key(self, messages: list[BaseMessage], stop, kwargs: dict) -> str | None:
+        deterministic = self.temperature == 0 or "seed" in (self.model_kwargs or {})
+        if LLM_CACHE_MODE == "off" or (LLM_CACHE_MODE == "deterministic" and not deterministic) or (self.n or 1) > 1:
+            llm_cache.record("bypassed")
+            return None
+        params = {"model": self.model_name, "temperature": self.temperature, "stop": stop, **kwargs}
+        return llm_cache.make_key(params, messages)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._cache_key(messages, stop, kwargs)
+        if key is None:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        cached = llm_cache.get_or_wait(key)
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=cached)])
+        try:
+            result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException:
+            llm_cache.release(key)
+            raise
+        llm_cache.put(key, result.generations[0].message)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._cache_key(messages, stop, kwargs)
+        if key is None:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        cached = await llm_cache.aget_or_wait(key)
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=cached)])
+        try:
+            result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException:
+            llm_cache.release(key)
+            raise
+        llm_cache.put(key, result.generations[0].message)
+        return result
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._cache_key(messages, stop, kwargs)
+        if key is None:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+        cached = await llm_cache.aget_or_wait(key)
+        if cached is not None:
+            yield ChatGenerationChunk(message=_as_chunk(cached))
+            return
+        aggregated = None
+        completed = False
+        try:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                aggregated = chunk if aggregated is None else aggregated + chunk
+                yield chunk
+            completed = aggregated is not None
+        finally:
+            # stream ไม่ครบ (error/ถูกยกเลิก) จะไม่ถูกแคช แต่ต้องปล่อยตัวที่รออยู่ให้ไปเรียก LLM เอง
+            if not completed:
+                llm_cache.release(key)
+        if completed:
+            llm_cache.put(key, message_chunk_to_message(aggregated.message))
+
+
+# ------------------- MODEL TIER ROUTING -------------------
+
+# tag ของ run โมเดลราคาถูก: token ที่ stream ออกมาใช้ตัดสินใจภายใน router ไม่ใช่ข้อความสำหรับผู้ใช้
+CHEAP_TIER_TAG = "model_tier:cheap"
+
+
+class ModelTierRouter:
+    """
+    แบ่งงานแต่ละขั้นของ AgentExecutor ระหว่างโมเดล 2 ระดับ:
+    - cheap: เรียกก่อนทุกขั้น ถ้าได้ tool calls ที่ถูกต้องครบ ใช้ผลนั้นเลย (ขั้นวางแผน/เลือก tool)
+    - strong: ใช้เมื่อ cheap จะตอบผู้ใช้เอง (final synthesis) หรือ cheap ล้มเหลว/เรียก tool ผิด (escalation)
+    cheap ถูก stream และหยุดทันทีที่ได้ token ข้อความแรกที่ไม่ใช่ tool call แล้วส่งต่อให้ strong
+    (ไม่ต้องรอ cheap เขียนคำตอบจนจบแล้วทิ้ง) token ของ cheap ติด tag CHEAP_TIER_TAG เพื่อให้ UI กรองออก
+    """
+
+    TIERS = ("cheap", "strong")
+
+    def __init__(self, cheap_llm: ChatOpenAI, strong_llm: ChatOpenAI):
+        self.cheap_llm = cheap_llm
+        self.strong_llm = strong_llm
+        self._lock = threading.Lock()
+        self._tiers = {tier: {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0} for tier in self.TIERS}
+        self._outcomes = {"tool_steps": 0, "synthesis": 0, "escalations": 0}
+
+    def _record(self, tier: str, started: float, messages: list[BaseMessage], result: AIMessage | None):
+        usage = getattr(result, "usage_metadata", None) or {}
+        # provider บางรายไม่ส่ง usage มาตอน stream จึงประมาณด้วย tokenizer แทน
+        prompt_tokens = usage.get("input_tokens") or count_tokens(messages)
+        completion_tokens = usage.get("output_tokens") or (count_tokens([result]) if result is not None else 0)
+        with self._lock:
+            stats = self._tiers[tier]
+            stats["calls"] += 1
+            stats["seconds"] += time.perf_counter() - started
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._outcomes[outcome] += 1
+
+    @staticmethod
+    def _escalation_reason(message: AIMessage | None, tool_names: set[str]) -> str | None:
+        """None = ใช้ผลของ cheap ได้; อื่นๆ = เหตุผลที่ต้องส่งต่อให้ strong"""
+        if message is None:
+            return "error"
+        if getattr(message, "invalid_tool_calls", None):
+            return "invalid_tool_calls"
+        if not message.tool_calls:
+            return "synthesis"
+        if any(call["name"] not in tool_names for call in message.tool_calls):
+            return "unknown_tool"
+        return None
+
+    def _accept_or_escalate(self, message: AIMessage | None, tool_names: set[str]) -> bool:
+        reason = self._escalation_reason(message, tool_names)
+        if reason is None:
+            self._count("tool_steps")
+            return True
+        if reason == "synthesis":
+            self._count("synthesis")
+        else:
+            self._count("escalations")
+            print(f"--- Cheap model step escalated to {MODEL} ({reason}) ---")
+        return False
+
+    @staticmethod
+    def _is_synthesis(aggregated: AIMessageChunk) -> bool:
+        """cheap เริ่มเขียนข้อความถึงผู้ใช้ (มี content แต่ยังไม่มี tool call) ซึ่งเป็นงานของ strong"""
+        return bool(isinstance(aggregated.content, str) and aggregated.content.strip()
+                    and not aggregated.tool_call_chunks)
+
+    @staticmethod
+    def _as_message(aggregated: AIMessageChunk | None) -> AIMessage | None:
+        if aggregated is None:
+            return None
+        message = message_chunk_to_message(aggregated)
+        # ตอน stream langchain แปลง arguments ด้วย partial JSON parser ซึ่ง "ซ่อม" JSON ที่ขาดกลางทางได้
+        # จึงต้องตรวจแบบเข้มเหมือนคำตอบที่ไม่ stream ไม่เช่นนั้น tool call ที่เสียจะไม่ถูกส่งต่อให้ strong
+        broken = []
+        for chunk in aggregated.tool_call_chunks:
+            try:
+                json.loads(chunk["args"] or "{}")
+            except json.JSONDecodeError as e:
+                broken.append(invalid_tool_call(name=chunk["name"], args=chunk["args"], id=chunk["id"], error=str(e)))
+        if not broken:
+            return message
+        broken_ids = {call["id"] for call in broken}
+        return message.model_copy(update={
+            "tool_calls": [call for call in message.tool_calls if call["id"] not in broken_ids],
+            "invalid_tool_calls": message.invalid_tool_calls + broken,
+        })
+
+    def runnable(self, tools: list) -> RunnableLambda:
+        """ตัวแทน llm.bind_tools(tools) ใน agent: รับ prompt value แล้วคืน AIMessage จาก tier ที่เหมาะสม"""
+        cheap = self.cheap_llm.bind_tools(tools).with_config(tags=[CHEAP_TIER_TAG])
+        strong = self.strong_llm.bind_tools(tools)
+        tool_names = {t.name for t in tools}
+
+        def route(prompt_value, config):
+            messages = prompt_value.to_messages()
+            started = time.perf_counter()
+            aggregated = None
+            try:
+                with closing(cheap.stream(messages, config)) as chunks:
+                    for chunk in chunks:
+                        aggregated = chunk if aggregated is None else aggregated + chunk
+                        if self._is_synthesis(aggregated):
+                            break
+                message = self._as_message(aggregated)
+            except Exception as e:
+                print(f"--- Cheap model failed: {e} ---")
+                message = None
+            self._record("cheap", started, messages, message)
+            if self._accept_or_escalate(message, tool_names):
+                return message
+            started = time.perf_counter()
+            message = strong.invoke(messages, config)
+            self._record("strong", started, messages, message)
+            return message
+
+        async def aroute(prompt_value, config):
+            messages = prompt_value.to_messages()
+            started = time.perf_counter()
+            aggregated = None
+            try:
+                async with aclosing(cheap.astream(messages, config)) as chunks:
+                    async for chunk in chunks:
+                        aggregated = chunk if aggregated is None else aggregated + chunk
+                        if self._is_synthesis(aggregated):
+                            break
+                message = self._as_message(aggregated)
+            except Exception as e:
+                print(f"--- Cheap model failed: {e} ---")
+                message = None
+            self._record("cheap", started, messages, message)
+            if self._accept_or_escalate(message, tool_names):
+                return message
+            # ainvoke ภายใต้ astream_events ยังส่ง token ของ strong ออกไปเป็น stream ให้ UI ได้ตามปกติ
+            started = time.perf_counter()
+            message = await strong.ainvoke(messages, config)
+            self._record("strong", started, messages, message)
+            return message
+
+        return RunnableLambda(route, afunc=aroute, name="ModelTierRouter")
+
+    def create_agent(self, tools: list, prompt: ChatPromptTemplate):
+        """เหมือน create_openai_tools_agent แต่ใช้ router แทน llm ตัวเดียว"""
+        return (
+            RunnablePassthrough.assign(agent_scratchpad=lambda x: format_to_openai_tool_messages(x["intermediate_steps"]))
+            | prompt
+            | self.runnable(tools)
+            | OpenAIToolsAgentOutputParser()
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            tiers = {
+                tier: {**stats, "avg_latency_ms": round(stats["seconds"] * 1000 / stats["calls"]) if stats["calls"] else 0}
+                for tier, stats in self._tiers.items()
+            }
+            return {"tiers": tiers, **self._outcomes}
+
+
+# ------------------- PROMPT & TOOL ROUTING -------------------
+
+# system prompt แยกเป็นส่วน: ส่วนคงที่อยู่ต้นสุดเสมอ (provider แคช prefix ของ prompt ได้)
+# ส่วน GUI protocol ที่ยาวที่สุดจะใส่เฉพาะ turn ที่เปิดให้ใช้ GUI tools
+CIPHER_PERSONA_PROMPT = """คุณคือ "Cipher V4 - The Navigator" สุดยอด AI Assistant ที่มีความสามารถในการมองเห็นและควบคุมคอมพิวเตอร์ได้โดยตรง (จำลอง)
+
+**บุคลิกและสไตล์การตอบ:**
+- สื่อสารอย่างชัดเจนและเป็นมิตรเสมอ
+- จัดรูปแบบคำตอบด้วย Markdown ทุกครั้งเพื่อให้อ่านง่าย"""
+
+CIPHER_GUI_PROTOCOL_PROMPT = """**กระบวนการทำงานสำหรับงาน GUI (GUI Operation Protocol):**
+1.  **Understand Goal:** ทำความเข้าใจเป้าหมายสุดท้ายของผู้ใช้ (เช่น "วาดวงกลมสีแดงใน Paint")
+2.  **Decompose:** แตกเป้าหมายใหญ่ออกเป็นขั้นตอนย่อยๆ ที่ทำได้จริง (เช่น "เปิดโปรแกรม", "หาปุ่มวงกลม", "หาปุ่มสีแดง", "คลิกและลากเมาส์", "บันทึกไฟล์")
+3.  **See & Act Loop (วงจรการทำงานหลัก):**
+    a.  **See:** ใช้ `see_screen()` เพื่อวิเคราะห์หน้าจอปัจจุบันและหาพิกัดของ UI element ที่ต้องการ
+    b.  **Plan Action:** ตัดสินใจว่าจะทำอะไรต่อไป (เช่น `mouse_click`, `keyboard_type`)
+    c.  **[!!!] SAFETY PROTOCOL [!!!]**
+    d.  **ก่อน** ที่จะใช้เครื่องมือที่ "ลงมือทำ" (`mouse_move`, `mouse_click`, `keyboard_type`, `execute_shell_command`) ทุกครั้ง **คุณต้องทำสิ่งนี้ก่อนเสมอ:**
+        - **ใช้เครื่องมือ `ask_user` เพื่อ "ขออนุญาต" จากผู้ใช้ก่อน**
+        - ในคำขออนุญาตนั้น **คุณต้องอธิบายอย่างชัดเจนและละเอียดที่สุด** ว่าคุณกำลังจะทำอะไร, จะคลิกที่ไหน, จะพิมพ์อะไร, หรือจะรันคำสั่งอะไร
+        - **ตัวอย่าง:** `ask_user(question="ผมกำลังจะจำลองคลิกเมาส์ซ้ายที่ปุ่ม 'Save' ที่พิกัด [123, 456] เพื่อบันทึกไฟล์ คุณอนุญาตหรือไม่ครับ?")`
+        - **ห้าม** ดำเนินการใดๆ จนกว่าจะได้รับคำตอบ "อนุญาต" หรือ "ใช่" จากผู้ใช้
+    e.  **Act:** ลงมือทำตามแผน (จำลอง)"""
+
+CIPHER_ABILITIES_PROMPT = """**ความสามารถอื่นๆ:**
+- คุณยังคงมีความสามารถเดิมทั้งหมด (ค้นหาเว็บ, ความจำ, คำนวณ, อ่าน URL, ฯลฯ) จงใช้มันร่วมกันเพื่อแก้ปัญหาที่ซับซ้อน"""
+
+CIPHER_GUI_MOCK_NOTE = """- **เครื่องมือ GUI ทั้งหมดเป็นการจำลอง (MOCK)** - ไม่มีการควบคุมจริง แต่จะแสดงผลลัพธ์จำลองเพื่อให้คุณฝึกคิดและวางแผน"""
+
+# เปิด/ปิดการเลือก tools ตามข้อความของผู้ใช้ (ปิด = ส่ง schema ของทุก tool ทุก turn แบบเดิม)
+TOOL_ROUTER_ENABLED = os.getenv("TOOL_ROUTER_ENABLED", "true").lower() == "true"
+
+# tools ที่เล็กและใช้บ่อย เปิดให้ใช้ทุก turn
+CORE_TOOL_NAMES = {"get_current_date", "calculator", "ask_user"}
+# เมื่อ router เลือกแค่บางกลุ่ม ยังเปิดค้นเว็บไว้เสมอ เผื่อกลุ่มที่เลือกไม่พอจะตอบคำถาม
+FALLBACK_TOOL_NAMES = {"tavily_search_results_json"}
+
+# กลุ่มของ tools กับคำที่บ่งบอกว่า turn นี้น่าจะต้องใช้
+# คำภาษาอังกฤษต้องตรงทั้งคำ (รวมรูปพหูพจน์) ส่วนคำภาษาไทยไม่มีช่องว่างคั่นคำจึงจับแบบ substring
+# คำไทยจึงต้องยาวพอที่จะไม่ไปตรงกับส่วนหนึ่งของคำอื่น (เช่น "จำ" อยู่ใน "จำนวน", "หาร" อยู่ใน "อาหาร")
+TOOL_ROUTES = {
+    "web": ({"tavily_search_results_json", "browse_url", "browse_urls", "read_chunk"},
+            ("เว็บ", "ค้นหา", "ค้นคว้า", "search", "ข่าว", "news", "url", "ลิงก์", "link", "ล่าสุด", "latest",
+             "google", "หาข้อมูล", "ข้อมูล", "research", "วิจัย")),
+    "stocks": ({"get_stock_price", "analyze_stocks"},
+               ("หุ้น", "stock", "ticker", "ราคา", "price", "ตลาดหลักทรัพย์", "market", "พอร์ต", "portfolio", "ผลตอบแทน",
+                "return", "volatility", "ความผันผวน", "กองทุน", "etf", "crypto", "bitcoin")),
+    "files": ({"write_to_file", "write_chunk", "read_from_file", "read_chunk", "ingest_documents", "search_workspace",
+               "list_workspace_files"},
+              ("ไฟล์", "file", "บันทึกลง", "save", "เขียน", "write", "csv", "pdf", "docx", "เอกสาร", "document",
+               "workspace", "รายงาน", "report", "อ่าน", "read", "export")),
+    "memory": ({"save_memory_chunk", "save_memory_chunks", "search_relevant_memories", "list_all_memories"},
+               ("จดจำ", "จำไว้", "ช่วยจำ", "จำได้", "remember", "memory", "memories", "ความทรงจำ", "เคยคุย", "เคยบอก",
+                "ก่อนหน้านี้", "last time", "recall")),
+    "gui": ({"see_screen", "mouse_move", "mouse_click", "keyboard_type", "execute_shell_command", "ask_user"},
+            ("หน้าจอ", "screen", "คลิก", "click", "เมาส์", "mouse", "คีย์บอร์ด", "keyboard", "พิมพ์ข้อความ", "โปรแกรม",
+             "paint", "shell", "command", "terminal", "รันคำสั่ง", "เปิดแอป")),
+    "date_math": (set(), ("วันที่", "วันนี้", "today", "date", "เวลา", "time", "คำนวณ", "calculate", "บวก", "คูณ",
+                          "หารด้วย", "ลบด้วย")),
+}
+
+
+def _keyword_pattern(keywords: tuple[str, ...]) -> re.Pattern:
+    parts = []
+    for keyword in keywords:
+        if keyword.isascii():
+            parts.append(rf"(?<![a-z0-9]){re.escape(keyword)}(?:e?s)?(?![a-z0-9])")
+        else:
+            parts.append(re.escape(keyword))
+    return re.compile("|".join(parts))
+
+
+_ROUTE_PATTERNS = {name: _keyword_pattern(keywords) for name, (_, keywords) in TOOL_ROUTES.items()}
+# URL และชื่อไฟล์ในข้อความบ่งบอกกลุ่มได้ชัดกว่าคำทั่วไป
+_URL_PATTERN = re.compile(r"https?://|www\.", re.IGNORECASE)
+_FILENAME_PATTERN = re.compile(r"[\w-]+\.(?:csv|txt|md|json|pdf|docx|xlsx)\b", re.IGNORECASE)
+# ตัวย่อหุ้น เช่น NVDA, PTT.BK หรือนิพจน์คณิตศาสตร์ เช่น 12*7
+_TICKER_PATTERN = re.compile(r"(?<![A-Za-z0-9.])[A-Z]{3,5}(?:\.[A-Z]{1,2})?(?![A-Za-z0-9])")
+# ตัวย่อตัวพิมพ์ใหญ่ที่ใช้บ่อยแต่ไม่ใช่ชื่อหุ้น
+_TICKER_STOPWORDS = {"API", "PDF", "CSV", "HTML", "JSON", "XML", "HTTP", "HTTPS", "URL", "SQL", "DOCX", "TXT", "PNG",
+                     "JPG", "CSS", "CPU", "GPU", "RAM", "LLM", "MCP", "FAQ", "ASAP", "USB", "OCR", "UTF"}
+_MATH_PATTERN = re.compile(r"\d\s*[-+*/^%]\s*\d")
+
+
+def route_tool_groups(user_input: str) -> set[str]:
+    """router แบบ local ราคาถูก: เลือกกลุ่ม tools จากคำใน input (ว่าง = ไม่แน่ใจ ให้ใช้ทุก tool)"""
+    text = user_input.lower()
+    groups = {name for name, pattern in _ROUTE_PATTERNS.items() if pattern.search(text)}
+    if _URL_PATTERN.search(user_input):
+        groups.add("web")
+    if _FILENAME_PATTERN.search(user_input):
+        groups.add("files")
+    if any(match not in _TICKER_STOPWORDS for match in _TICKER_PATTERN.findall(user_input)):
+        groups.add("stocks")
+    if _MATH_PATTERN.search(user_input):
+        groups.add("date_math")
+    return groups
+
 
 class AdvancedWebAgent:
+    """
+    เครื่องยนต์ของ Agent (LLM client, tools, prompt และ AgentExecutor) ที่ไม่มี state ของแชทใดๆ
+    ใช้ get_shared_agent() เพื่อใช้ instance เดียวร่วมกันทุกแชท ส่วนประวัติแชทเก็บแยกต่อ session
+
+    แต่ละ turn จะส่งให้ LLM เฉพาะ schema ของ tools ที่เกี่ยวข้องกับข้อความของผู้ใช้ (ดู route_tool_groups)
+    และใช้ system prompt แบบย่อเมื่อไม่ได้เปิด GUI tools; agent ของแต่ละชุด tools ถูกสร้างครั้งเดียวแล้วแคชไว้
+    """
+
     def __init__(self):
-        self.llm = ChatOpenAI(model=MODEL, api_key=OPENAI_API_KEY, base_url="https://openrouter.ai/api/v1")
+        self.llm = CachedChatOpenAI(model=MODEL, api_key=OPENAI_API_KEY, base_url="https://openrouter.ai/api/v1",
+                                    temperature=LLM_TEMPERATURE)
+        # tool plumbing ไปที่โมเดลราคาถูก ส่วนคำตอบสุดท้ายใช้ self.llm (ปิดได้โดยไม่ตั้ง OPENROUTER_CHEAP_MODEL)
+        self.model_router = None
+        if CHEAP_MODEL and CHEAP_MODEL != MODEL:
+            cheap_llm = CachedChatOpenAI(model=CHEAP_MODEL, api_key=OPENAI_API_KEY, base_url="https://openrouter.ai/api/v1",
+                                         temperature=LLM_TEMPERATURE, stream_usage=True)
+            self.model_router = ModelTierRouter(cheap_llm, self.llm)
         # --- 💡 3. เพิ่ม tool ใหม่เข้าไปในลิสต์เครื่องมือของ Agent ---
-        self.tools = [RobustTavilySearchTool(), browse_url, see_screen, mouse_move, mouse_click, keyboard_type, execute_shell_command, get_stock_price, get_current_date, write_to_file, read_from_file, ask_user, calculator, save_memory_chunk, search_relevant_memories, list_all_memories, list_workspace_files]
+        self.tools = [
+            RobustTavilySearchTool(), browse_url, browse_urls,
+            see_screen, mouse_move, mouse_click, keyboard_type, execute_shell_command,
+            get_stock_price, analyze_stocks, get_current_date,
+            write_to_file, write_chunk, read_from_file, read_chunk, ingest_documents, search_workspace,
+            ask_user, calculator,
+            save_memory_chunk, save_memory_chunks, search_relevant_memories, list_all_memories,
+            list_workspace_files,
+        ]
+        self._agents: dict[frozenset, object] = {}
+        self._agents_lock = threading.Lock()
 
+        # --- 💡 จุดแก้ไขที่สำคัญ: เราจะสร้าง AgentExecutor ที่นี่ที่เดียว ---
+        # AgentExecutor นี้จะถูก "ห่อหุ้ม" ด้วยระบบความจำในภายหลัง
+        # agent เป็น router: เลือก agent ที่ bind เฉพาะ tools ของ turn นั้น ส่วน executor รู้จักทุก tool
+        self.agent_executor = ParallelAgentExecutor(
+            agent=RunnableLambda(lambda inputs: self._agent_for(self.select_tools(inputs["input"]))),
+            tools=self.tools,
+            verbose=True,
+            handle_parsing_errors=True
+        )
+
+    def select_tools(self, user_input: str) -> list:
+        """tools ที่เปิดให้ใช้ใน turn นี้ (ถ้า router ไม่แน่ใจ จะเปิดทุก tool)"""
+        groups = route_tool_groups(user_input) if TOOL_ROUTER_ENABLED else set()
+        if not groups:
+            return self.tools
+        names = CORE_TOOL_NAMES | FALLBACK_TOOL_NAMES
+        for group in groups:
+            names |= TOOL_ROUTES[group][0]
+        return [t for t in self.tools if t.name in names]
+
+    def _prompt_for(self, tools: list) -> ChatPromptTemplate:
+        uses_gui = any(TOOL_CONCURRENCY_GROUPS.get(t.name) == "gui" for t in tools)
+        sections = [CIPHER_PERSONA_PROMPT]
+        if uses_gui:
+            sections.append(CIPHER_GUI_PROTOCOL_PROMPT)
+        sections.append(CIPHER_ABILITIES_PROMPT + ("\n" + CIPHER_GUI_MOCK_NOTE if uses_gui else ""))
         # --- 💡 THE NAVIGATOR PROMPT with SAFETY PROTOCOL ---
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """คุณคือ "Cipher V4 - The Navigator" สุดยอด AI Assistant ที่มีความสามารถในการมองเห็นและควบคุมคอมพิวเตอร์ได้โดยตรง (จำลอง)
-
-            **บุคลิกและสไตล์การตอบ:**
-            - สื่อสารอย่างชัดเจนและเป็นมิตรเสมอ
-            - จัดรูปแบบคำตอบด้วย Markdown ทุกครั้งเพื่อให้อ่านง่าย
-
-            **กระบวนการทำงานสำหรับงาน GUI (GUI Operation Protocol):**
-            1.  **Understand Goal:** ทำความเข้าใจเป้าหมายสุดท้ายของผู้ใช้ (เช่น "วาดวงกลมสีแดงใน Paint")
-            2.  **Decompose:** แตกเป้าหมายใหญ่ออกเป็นขั้นตอนย่อยๆ ที่ทำได้จริง (เช่น "เปิดโปรแกรม", "หาปุ่มวงกลม", "หาปุ่มสีแดง", "คลิกและลากเมาส์", "บันทึกไฟล์")
-            3.  **See & Act Loop (วงจรการทำงานหลัก):**
-                a.  **See:** ใช้ `see_screen()` เพื่อวิเคราะห์หน้าจอปัจจุบันและหาพิกัดของ UI element ที่ต้องการ
-                b.  **Plan Action:** ตัดสินใจว่าจะทำอะไรต่อไป (เช่น `mouse_click`, `keyboard_type`)
-                c.  **[!!!] SAFETY PROTOCOL [!!!]**
-                d.  **ก่อน** ที่จะใช้เครื่องมือที่ "ลงมือทำ" (`mouse_move`, `mouse_click`, `keyboard_type`, `execute_shell_command`) ทุกครั้ง **คุณต้องทำสิ่งนี้ก่อนเสมอ:**
-                    - **ใช้เครื่องมือ `ask_user` เพื่อ "ขออนุญาต" จากผู้ใช้ก่อน**
-                    - ในคำขออนุญาตนั้น **คุณต้องอธิบายอย่างชัดเจนและละเอียดที่สุด** ว่าคุณกำลังจะทำอะไร, จะคลิกที่ไหน, จะพิมพ์อะไร, หรือจะรันคำสั่งอะไร
-                    - **ตัวอย่าง:** `ask_user(question="ผมกำลังจะจำลองคลิกเมาส์ซ้ายที่ปุ่ม 'Save' ที่พิกัด [123, 456] เพื่อบันทึกไฟล์ คุณอนุญาตหรือไม่ครับ?")`
-                    - **ห้าม** ดำเนินการใดๆ จนกว่าจะได้รับคำตอบ "อนุญาต" หรือ "ใช่" จากผู้ใช้
-                e.  **Act:** ลงมือทำตามแผน (จำลอง)
-
-            **ความสามารถอื่นๆ:**
-            - คุณยังคงมีความสามารถเดิมทั้งหมด (ค้นหาเว็บ, ความจำ, คำนวณ, อ่าน URL, ฯลฯ) จงใช้มันร่วมกันเพื่อแก้ปัญหาที่ซับซ้อน
-            - **เครื่องมือ GUI ทั้งหมดเป็นการจำลอง (MOCK)** - ไม่มีการควบคุมจริง แต่จะแสดงผลลัพธ์จำลองเพื่อให้คุณฝึกคิดและวางแผน"""),
+        return ChatPromptTemplate.from_messages([
+            ("system", "\n\n".join(sections)),
             ("placeholder", "{chat_history}"),
             ("human", "{input}"),
             ("placeholder", "{agent_scratchpad}"),
         ])
 
-        # สร้าง Agent หลัก
-        agent = create_openai_tools_agent(self.llm, self.tools, self.prompt)
+    def _agent_for(self, tools: list):
+        key = frozenset(t.name for t in tools)
+        with self._agents_lock:
+            if key not in self._agents:
+                prompt = self._prompt_for(tools)
+                if self.model_router:
+                    self._agents[key] = self.model_router.create_agent(tools, prompt)
+                else:
+                    self._agents[key] = create_openai_tools_agent(self.llm, tools, prompt)
+            return self._agents[key]
 
-        # --- 💡 จุดแก้ไขที่สำคัญ: เราจะสร้าง AgentExecutor ที่นี่ที่เดียว ---
-        # AgentExecutor นี้จะถูก "ห่อหุ้ม" ด้วยระบบความจำในภายหลัง
-        self.agent_executor = AgentExecutor(
-            agent=agent,
-            tools=self.tools,
-            verbose=True,
-            handle_parsing_errors=True
-        )
+
+# ------------------- BOUNDED CHAT HISTORY -------------------
+
+# งบ token ของประวัติแชทที่ส่งไปกับทุก turn และจำนวน turn ล่าสุดที่เก็บแบบคำต่อคำ
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_KEEP_TURNS = max(1, int(os.getenv("HISTORY_KEEP_TURNS", "6")))
+# ย้าย turns เก่าที่ถูกสรุปแล้วไปเก็บใน collection `memories` ด้วยหรือไม่
+HISTORY_OFFLOAD_TO_MEMORY = os.getenv("HISTORY_OFFLOAD_TO_MEMORY", "false").lower() == "true"
+
+HISTORY_SUMMARY_PROMPT = (
+    "คุณคือผู้ช่วยสรุปบทสนทนา รวม 'สรุปเดิม' กับ 'บทสนทนาใหม่' ให้เป็นสรุปเดียวที่กระชับ "
+    "เก็บข้อเท็จจริง, ชื่อ, ตัวเลข, ชื่อไฟล์ และงานที่ยังค้างอยู่ไว้ให้ครบ ตอบเป็นสรุปอย่างเดียว"
+)
+
+@functools.lru_cache(maxsize=1)
+def _get_token_encoder():
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"WARNING: tiktoken encoding unavailable ({e}). Falling back to approximate token counts.")
+        return None
+
+def count_tokens(messages: list[BaseMessage]) -> int:
+    """นับ token ของ messages (ประมาณจากจำนวนตัวอักษรถ้าไม่มี tiktoken)"""
+    encoder = _get_token_encoder()
+    total = 0
+    for message in messages:
+        text = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+        total += 4 + (len(encoder.encode(text)) if encoder else len(text) // 3)
+    return total
+
+
+# สรุปประวัติแชทใน thread แยกหลังตอบผู้ใช้แล้ว (ไม่อยู่ในเส้นทางของคำตอบ และไม่ติด callback ของ turn นั้น
+# ซึ่งจะทำให้ token ของการสรุปหลุดไปแสดงในแชท)
+_history_summarizer = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+
+class SummarizingChatMessageHistory(BaseChatMessageHistory):
+    """
+    ประวัติแชทที่มีขอบเขต: เก็บ N turns ล่าสุดแบบคำต่อคำ ส่วน turns ที่เก่ากว่านั้น
+    (หรือเกินงบ token) จะถูกพับรวมเข้าไปในสรุปที่อัปเดตทีละส่วน
+    การสรุปทำเบื้องหลังหลังจากบันทึก turn แล้ว ระหว่างนั้น turns เก่ายังอยู่ในประวัติแบบคำต่อคำ
+    แล้วจึงถูกแทนด้วยสรุปเมื่อสรุปเสร็จ (ไม่มีช่วงที่ข้อมูลหายไปจาก prompt)
+    """
+
+    def __init__(self, llm, session_id: str = "", token_budget: int = HISTORY_TOKEN_BUDGET,
+                 keep_turns: int = HISTORY_KEEP_TURNS, offload_to_memory: bool = HISTORY_OFFLOAD_TO_MEMORY):
+        self.llm = llm
+        self.session_id = session_id
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.offload_to_memory = offload_to_memory
+        self.summary = ""
+        self.turns: list[list[BaseMessage]] = []
+        self.metrics = {"prompt_tokens_per_turn": [], "summaries": 0, "offloaded_turns": 0}
+        self._lock = threading.RLock()
+        self._folding: concurrent.futures.Future | None = None
+
+    def _render(self, turns: list[list[BaseMessage]]) -> list[BaseMessage]:
+        prefix = [SystemMessage(content=f"สรุปบทสนทนาก่อนหน้า:\n{self.summary}")] if self.summary else []
+        return prefix + [message for turn in turns for message in turn]
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        with self._lock:
+            return self._render(self.turns)
+
+    def _append(self, messages):
+        with self._lock:
+            # ประวัติก่อนเพิ่ม turn นี้ คือสิ่งที่ถูกส่งไปใน prompt ของ turn นี้
+            self.metrics["prompt_tokens_per_turn"].append(count_tokens(self.messages))
+            for message in messages:
+                if isinstance(message, HumanMessage) or not self.turns:
+                    self.turns.append([message])
+                else:
+                    self.turns[-1].append(message)
+
+    def _stale_turn_count(self) -> int:
+        """จำนวน turns เก่าที่ต้องพับเมื่อเกินขอบเขต (พับลงครึ่งหนึ่ง เพื่อไม่ต้องสรุปใหม่ทุก turn)"""
+        if len(self.turns) <= self.keep_turns and count_tokens(self.messages) <= self.token_budget:
+            return 0
+        count = 0
+        target_turns = max(1, self.keep_turns // 2)
+        while len(self.turns) - count > 1 and (
+            len(self.turns) - count > target_turns or count_tokens(self._render(self.turns[count:])) > self.token_budget
+        ):
+            count += 1
+        return count
+
+    @staticmethod
+    def _transcript(stale: list[list[BaseMessage]]) -> str:
+        return "\n".join(f"{message.type}: {message.content}" for turn in stale for message in turn)
+
+    def _summary_request(self, transcript: str) -> list[BaseMessage]:
+        return [
+            SystemMessage(content=HISTORY_SUMMARY_PROMPT),
+            HumanMessage(content=f"สรุปเดิม:\n{self.summary or '-'}\n\nบทสนทนาใหม่:\n{transcript}"),
+        ]
+
+    def _offload_metadata(self) -> dict:
+        return {"source": "chat_history", "session_id": str(self.session_id)}
+
+    def _schedule_fold(self):
+        with self._lock:
+            if self._folding is not None and not self._folding.done():
+                return  # สรุปได้ทีละครั้ง turn ถัดไปจะตรวจขอบเขตใหม่อีกรอบ
+            count = self._stale_turn_count()
+            if count:
+                self._folding = _history_summarizer.submit(self._fold, self.turns[:count])
+
+    def _fold(self, stale: list[list[BaseMessage]]):
+        transcript = self._transcript(stale)
+        summary = None
+        try:
+            summary = self.llm.invoke(self._summary_request(transcript)).content
+        except Exception as e:
+            print(f"!!! ERROR summarizing chat history: {e} !!!")
+        if self.offload_to_memory:
+            sync_save_memory_chunk(transcript, self._offload_metadata())
+        with self._lock:
+            if len(self.turns) < len(stale) or any(a is not b for a, b in zip(self.turns, stale)):
+                return  # ประวัติถูก clear() ระหว่างสรุป
+            del self.turns[:len(stale)]
+            if summary is not None:
+                self.summary = summary
+                self.metrics["summaries"] += 1
+            if self.offload_to_memory:
+                self.metrics["offloaded_turns"] += len(stale)
+
+    def wait_for_summary(self, timeout: float | None = None):
+        """รอให้การสรุปที่กำลังทำอยู่เบื้องหลัง (ถ้ามี) เสร็จ"""
+        folding = self._folding
+        if folding is not None:
+            concurrent.futures.wait([folding], timeout=timeout)
+
+    def add_messages(self, messages) -> None:
+        self._append(messages)
+        self._schedule_fold()
+
+    async def aadd_messages(self, messages) -> None:
+        self.add_messages(messages)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.summary = ""
+            self.turns = []
+
+
+# ------------------- SHARED AGENT ENGINE -------------------
+
+_shared_agent: Optional[AdvancedWebAgent] = None
+_shared_agent_lock = threading.Lock()
+
+def get_shared_agent() -> AdvancedWebAgent:
+    """
+    คืน AdvancedWebAgent ตัวเดียวที่ใช้ร่วมกันทั้ง process (สร้างครั้งแรกที่ถูกเรียก)
+    ChatOpenAI client (และ HTTP connection pool ของมัน), tools และ AgentExecutor จึงถูกสร้างแค่ครั้งเดียว
+    """
+    global _shared_agent
+    if _shared_agent is None:
+        with _shared_agent_lock:
+            if _shared_agent is None:
+                started = time.perf_counter()
+                _shared_agent = AdvancedWebAgent()
+                print(f"--- Shared agent engine ready in {time.perf_counter() - started:.2f}s ---")
+    return _shared_agent
@@ -1,13 +1,26 @@
 import chainlit as cl
-from agent import AdvancedWebAgent
+from agent import get_shared_agent, SummarizingChatMessageHistory, llm_cache, CHEAP_TIER_TAG
 import json
+import logging
 import re
 import os
-from langchain_community.chat_message_histories import ChatMessageHistory
+import time
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
-# (import sync functions ยังคงจำเป็นสำหรับ action callbacks)
-from agent import sync_list_all_memories, sync_list_workspace_files
+# (import async functions สำหรับ action callbacks เพื่อไม่ให้ block event loop)
+from agent import async_list_all_memories, async_list_workspace_files
+
+# ตัวเลขประสิทธิภาพของแต่ละ turn (TTFT, cache, tokens) ถูก log ที่ระดับ DEBUG เท่านั้น
+logger = logging.getLogger(__name__)
+
+# --- 💡 สร้าง "Agent ที่มีความจำ" ครั้งเดียวตอนเริ่ม process แล้วใช้ร่วมกันทุกแชท ---
+# cl.user_session ผูกกับแชทที่กำลังทำงานอยู่ จึงดึงประวัติแชทของแต่ละคนได้ถูกต้องแม้ runnable จะเป็นตัวเดียวกัน
+agent_with_memory = RunnableWithMessageHistory(
+    get_shared_agent().agent_executor,
+    lambda session_id: cl.user_session.get("chat_history"),
+    input_messages_key="input",
+    history_messages_key="chat_history",
+)
 
 
 @cl.on_chat_start
@@ -15,22 +28,12 @@ async def start():
     """
     ฟังก์ชันนี้จะถูกเรียกเมื่อผู้ใช้เริ่มแชทใหม่
     """
-    # สร้าง Agent instance (ที่ตอนนี้เป็นแค่เครื่องยนต์)
-    agent_instance = AdvancedWebAgent()
-
-    # --- 💡 สร้าง Agent ที่มีความจำที่ถูกต้องที่นี่! ---
-    # เราจะผูก AgentExecutor เข้ากับระบบจัดการประวัติแชทของ Chainlit
-    agent_with_memory = RunnableWithMessageHistory(
-        agent_instance.agent_executor,
-        # ใช้ cl.user_session.get("chat_history") เพื่อให้ Chainlit จัดการ memory ให้
-        lambda session_id: cl.user_session.get("chat_history"),
-        input_messages_key="input",
-        history_messages_key="chat_history",
-    )
-
-    # บันทึกประวัติแชท (ที่เริ่มต้นว่างเปล่า) และ "Agent ที่มีความจำ" ไว้ใน session
-    cl.user_session.set("chat_history", ChatMessageHistory())
-    cl.user_session.set("agent_with_memory", agent_with_memory)
+    # state ต่อแชทมีแค่ประวัติแชทเท่านั้น ส่วน Agent ใช้ตัวกลางที่สร้างไว้แล้ว
+    # --- 💡 ประวัติแชทแบบมีงบ token: turns เก่าจะถูกพับรวมเป็นสรุป ไม่ส่งทั้งหมดทุก turn ---
+    cl.user_session.set("chat_history", SummarizingChatMessageHistory(
+        llm=get_shared_agent().llm,
+        session_id=cl.user_session.get("id"),
+    ))
 
     # --- 💡 ยกเครื่องหน้าจอเริ่มต้นทั้งหมด ---
 
@@ -54,11 +57,26 @@ async def start():
 
 
 # --- Action Callbacks ยังคงจำเป็นสำหรับ Help Command ---
+# ตัดผลลัพธ์ของ tool ที่แสดงใน step ให้สั้นลง (ผลลัพธ์เต็มยังส่งให้ LLM ตามปกติ)
+TOOL_STEP_OUTPUT_CHARS = 2000
+
+# จำนวนความทรงจำต่อหน้า: โหลดหน้าถัดไปเมื่อผู้ใช้กด "โหลดเพิ่ม" เท่านั้น
+MEMORY_PAGE_SIZE = 20
+
 @cl.action_callback("view_memories")
 async def on_action_view_memories(action: cl.Action):
-    await cl.Message(content="กำลังดึงข้อมูลความทรงจำทั้งหมด...").send()
-    
-    response_str = sync_list_all_memories()
+    await cl.Message(content="กำลังดึงข้อมูลความทรงจำ...").send()
+    await _send_memory_page(cursor=None)
+
+
+@cl.action_callback("view_memories_more")
+async def on_action_view_memories_more(action: cl.Action):
+    await action.remove()  # ซ่อนปุ่มของหน้าก่อนหน้า กันกดซ้ำ
+    await _send_memory_page(cursor=action.payload.get("cursor"))
+
+
+async def _send_memory_page(cursor: str | None):
+    response_str = await async_list_all_memories(limit=MEMORY_PAGE_SIZE, cursor=cursor)
     response_data = json.loads(response_str)
 
     if "error" in response_data:
@@ -70,20 +88,29 @@ async def on_action_view_memories(action: cl.Action):
         await cl.Message(content="ยังไม่มีความทรงจำใดๆ ถูกบันทึกไว้ครับ").send()
         return
 
-    formatted_text = "### 🧠 All Saved Memories\n\n"
+    start = response_data["offset"] + 1
+    end = response_data["offset"] + len(memories)
+    formatted_text = f"### 🧠 Saved Memories ({start}–{end} of {response_data['total']})\n\n"
     for mem in memories:
         formatted_text += f"**ID:** `{mem['id']}`\n"
         formatted_text += f"**Content:**\n```\n{mem['content']}\n```\n"
         formatted_text += f"**Metadata:** `{json.dumps(mem['metadata'])}`\n---\n"
 
-    await cl.Message(content=formatted_text).send()
+    actions = []
+    if response_data.get("next_cursor"):
+        actions.append(cl.Action(
+            name="view_memories_more",
+            payload={"cursor": response_data["next_cursor"]},
+            label="⬇️ โหลดเพิ่ม",
+        ))
+    await cl.Message(content=formatted_text, actions=actions).send()
 
 
 @cl.action_callback("explore_workspace")
 async def on_action_explore_workspace(action: cl.Action):
     await cl.Message(content="กำลังสำรวจพื้นที่ทำงาน...").send()
     
-    response_str = sync_list_workspace_files()
+    response_str = await async_list_workspace_files()
     response_data = json.loads(response_str)
 
     if "error" in response_data:
@@ -123,26 +150,81 @@ async def on_action_help(action: cl.Action):
     ).send()
 
 
+def _log_turn_metrics(turn_started: float, first_token_at: float | None, tools_used: int):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    turn_seconds = time.perf_counter() - turn_started
+    ttft = f"{(first_token_at - turn_started) * 1000:.0f} ms" if first_token_at else "n/a"
+    logger.debug("Time to first token: %s (turn total: %.2f s, tool calls: %d)", ttft, turn_seconds, tools_used)
+
+    cache_stats = llm_cache.stats()
+    logger.debug("LLM cache hit rate: %.0f%% (deduplicated: %d, bypassed: %d)",
+                 cache_stats["hit_rate"] * 100, cache_stats["deduplicated"], cache_stats["bypassed"])
+
+    model_router = get_shared_agent().model_router
+    if model_router:
+        tier_stats = model_router.stats()
+        for tier, stats in tier_stats["tiers"].items():
+            logger.debug("%s model: %d calls, avg %s ms, tokens in/out: %d/%d", tier, stats["calls"],
+                         stats["avg_latency_ms"], stats["prompt_tokens"], stats["completion_tokens"])
+        logger.debug("Tier routing: tool steps on cheap model: %d, synthesis: %d, escalations: %d",
+                     tier_stats["tool_steps"], tier_stats["synthesis"], tier_stats["escalations"])
+
+    history_metrics = cl.user_session.get("chat_history").metrics
+    logger.debug("History prompt tokens this turn: %s (summaries: %d)",
+                 history_metrics["prompt_tokens_per_turn"][-1], history_metrics["summaries"])
+
+
 @cl.on_message
 async def main(message: cl.Message):
     """
     ฟังก์ชันนี้จะทำงานทุกครั้งที่ผู้ใช้ส่งข้อความแชทเข้ามา
     """
     # --- 💡 โค้ดส่วนรัน Agent ---
-    agent_with_memory = cl.user_session.get("agent_with_memory")
     session_id = str(cl.user_session.get("id")) # ใช้เป็น string เพื่อความแน่ใจ
     main_actions = cl.user_session.get("main_actions") # ดึงปุ่มหลักที่เก็บไว้ออกมา
 
-    callbacks = [cl.LangchainCallbackHandler(stream_final_answer=False)]
-
-    async with cl.Step(name="Cipher's Thought Process", type="chain"):
-        response = await agent_with_memory.ainvoke(
-            {"input": message.content},
-            config={"callbacks": callbacks, "configurable": {"session_id": session_id}}
-        )
+    # --- 💡 Streaming: ส่ง token ของคำตอบ และสถานะของแต่ละ tool ให้ผู้ใช้เห็นทันทีที่เกิดขึ้น ---
+    answer_message = cl.Message(content="")
+    tool_steps = {}
+    tools_used = 0
+    response = {}
+    turn_started = time.perf_counter()
+    first_token_at = None
+
+    async for event in agent_with_memory.astream_events(
+        {"input": message.content},
+        config={"configurable": {"session_id": session_id}},
+        version="v2",
+    ):
+        kind = event["event"]
+        if kind == "on_chat_model_stream" and CHEAP_TIER_TAG not in event.get("tags", ()):
+            chunk = event["data"]["chunk"]
+            # chunk ที่เป็นการเรียก tool ไม่ใช่ข้อความสำหรับผู้ใช้
+            if isinstance(chunk.content, str) and chunk.content and not getattr(chunk, "tool_call_chunks", None):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                await answer_message.stream_token(chunk.content)
+        elif kind == "on_tool_start":
+            step = cl.Step(name=event["name"], type="tool")
+            step.input = event["data"].get("input")
+            await step.send()
+            tool_steps[event["run_id"]] = step
+            tools_used += 1
+        elif kind == "on_tool_end":
+            step = tool_steps.pop(event["run_id"], None)
+            if step:
+                output = event["data"].get("output")
+                step.output = str(getattr(output, "content", output))[:TOOL_STEP_OUTPUT_CHARS]
+                await step.update()
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # event จบของ runnable ชั้นนอกสุด คือผลลัพธ์สุดท้ายของ AgentExecutor
+            response = event["data"].get("output") or {}
 
     final_answer = response.get("output", "ขออภัย, ผมไม่สามารถหาคำตอบได้ในขณะนี้")
 
+    _log_turn_metrics(turn_started, first_token_at, tools_used)
+
     # --- 💡 ลบการจัดการ history ด้วยมือทิ้งไป! ---
     # RunnableWithMessageHistory จะทำส่วนนี้ให้เราโดยอัตโนมัติ
 
@@ -153,20 +235,29 @@ async def main(message: cl.Message):
     # ตัวอย่าง: "ผมได้บันทึกข้อมูลลงในไฟล์ `NVDA_stock_prices.csv` เรียบร้อยแล้ว"
     filenames = re.findall(r"`(.*?\.(?:csv|txt|md|json|png|jpg|pdf|docx))`", final_answer)
 
-    for filename in filenames:
-        # สร้าง path ที่ถูกต้องไปยังไฟล์ใน workspace
-        file_path = os.path.join("workspace", filename)
+    # ตรวจว่าไฟล์มีอยู่จริงจาก index ของ workspace บน server ครั้งเดียว แทนการ stat ทีละไฟล์
+    existing_files = set()
+    if filenames:
+        response_data = json.loads(await async_list_workspace_files(names=list(dict.fromkeys(filenames))))
+        existing_files = {f["filename"] for f in response_data.get("files", [])}
 
-        if os.path.exists(file_path):
+    for filename in dict.fromkeys(filenames):
+        if filename in existing_files:
             # สร้าง File Element สำหรับแนบไปกับข้อความ
             elements.append(cl.File(
                 name=filename,
-                path=file_path,
+                path=os.path.join("workspace", filename),
                 display="inline" # "inline" จะแสดงไฟล์ในแชท, "side" จะแสดงด้านข้าง
             ))
 
-    await cl.Message(
-        content=final_answer,
-        actions=main_actions,
-        elements=elements # <--- 💡 แนบ Elements ทั้งหมดไปกับข้อความสุดท้าย
-    ).send()
\ No newline at end of file
+    # ข้อความที่ stream มาระหว่างทางอาจมีความคิดก่อนเรียก tool ปนอยู่ จึงแทนด้วยคำตอบสุดท้ายที่สมบูรณ์
+    answer_message.content = final_answer
+    answer_message.actions = main_actions
+    answer_message.elements = elements # <--- 💡 แนบ Elements ทั้งหมดไปกับข้อความสุดท้าย
+    if first_token_at is None:
+        await answer_message.send()
+    else:
+        # ข้อความถูกสร้างไปแล้วตอน stream token แรก: update() แก้แค่เนื้อหา ปุ่มและไฟล์แนบต้องส่งแยก
+        await answer_message.update()
+        for item in [*main_actions, *elements]:
+            await item.send(for_id=answer_message.id)
\ No newline at end of file
@@ -0,0 +1,250 @@
+"""
+ของที่ benchmark ทุกตัวใช้ร่วมกัน: รันในโฟลเดอร์ชั่วคราว (server.py/agent.py สร้าง workspace/, cache/, memory_db/
+ใน cwd ตอน import จึงไม่แตะข้อมูลจริงของ repo), จับเวลา และพิมพ์ผลเป็นตาราง
+ต้อง import โมดูลนี้ก่อน server/agent เสมอ
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SANDBOX = tempfile.mkdtemp(prefix="cipher-bench-")
+os.chdir(SANDBOX)
+os.environ.setdefault("OPENROUTER_API_KEY", "bench-key")
+os.environ.setdefault("TAVILY_API_KEY", "bench-key")
+os.environ["NO_PROXY"] = "127.0.0.1,localhost"
+# log ของทุก HTTP request (จาก chainlit/httpx) กลบตารางผลลัพธ์
+logging.getLogger("httpx").setLevel(logging.WARNING)
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+
+@contextmanager
+def timer():
+    """with timer() as t: ... แล้วอ่าน t["seconds"]"""
+    result = {}
+    started = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = time.perf_counter() - started
+
+
+def print_table(title: str, rows: list[dict]):
+    print(f"\n{title}")
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[_format(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(cell[i]) for cell in cells)) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    print("  ".join("-" * width for width in widths))
+    for cell in cells:
+        print("  ".join(value.ljust(width) for value, width in zip(cell, widths)))
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        return f"{value:,.3f}" if abs(value) < 100 else f"{value:,.0f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return "" if value is None else str(value)
+
+
+def _token_encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+_ENCODER = _token_encoder()
+TOKEN_COUNTER = "tiktoken o200k_base" if _ENCODER else "approx. chars/3 (tiktoken encoding unavailable)"
+
+
+def count_text_tokens(text: str) -> int:
+    """นับ token แบบเดียวกับ agent.count_tokens (tiktoken o200k_base หรือประมาณจากจำนวนตัวอักษร)"""
+    return len(_ENCODER.encode(text)) if _ENCODER else len(text) // 3
+
+
+class SyntheticMarketClient:
+    """
+    แทน Yahoo: คืนแท่งทุกวันทำการในช่วง [start, end) ด้วยราคาที่ดูสมจริง (ทศนิยมเต็ม)
+    และหน่วง latency วินาทีต่อ request เหมือนรอ network
+    """
+
+    def __init__(self, latency: float = 0.25):
+        import threading
+
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def fetch_bars(self, ticker, start, end):
+        import numpy as np
+        import pandas as pd
+
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        days = pd.bdate_range(start, end - pd.Timedelta(days=1))
+        rng = np.random.default_rng(abs(hash(ticker)) % 2**32)
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+        return pd.DataFrame({
+            "Open": close * (1 + rng.normal(0, 0.005, len(days))),
+            "High": close * 1.01,
+            "Low": close * 0.99,
+            "Close": close,
+            "Volume": rng.integers(1_000_000, 50_000_000, len(days)).astype(float),
+        }, index=days)
+
+
+class FakeOpenAIServer:
+    """
+    endpoint /v1/chat/completions แบบ OpenAI บน 127.0.0.1 ที่ตอบข้อความ answer ทันที (รองรับทั้งแบบ stream และไม่ stream)
+    เก็บ body ของทุก request ไว้ใน requests เพื่อวัดขนาด prompt ที่ agent ส่งจริง
+    """
+
+    def __init__(self, answer: str = "ok"):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.requests = []
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.requests.append(body)
+                message = {"role": "assistant", "content": answer}
+                if body.get("stream"):
+                    chunks = [
+                        {"choices": [{"index": 0, "delta": message, "finish_reason": None}]},
+                        {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+                    ]
+                    payload = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+                    content_type = "text/event-stream"
+                else:
+                    payload = json.dumps({
+                        "id": "bench", "object": "chat.completion", "created": 0, "model": body["model"],
+                        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 1, "total_tokens": 1},
+                    })
+                    content_type = "application/json"
+                data = payload.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class _Server(ThreadingHTTPServer):
+            request_queue_size = 1024  # ค่าเริ่มต้น 5 ทำให้ client จำนวนมากที่ต่อพร้อมกันโดน reset แล้ว retry
+            daemon_threads = True
+
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class HashingEmbeddings:
+    """
+    แทน embedding model (โมเดลจริงต้องดาวน์โหลด): vector จาก hash ของ token และหน่วงเวลาเหมือนรันบน CPU
+    คือ per_call วินาทีต่อการเรียกหนึ่งครั้ง + per_text วินาทีต่อข้อความ (batch จึงคุ้มกว่าเรียกทีละข้อความ)
+    ตั้ง BENCH_REAL_EMBEDDINGS=1 เพื่อใช้ EMBEDDING_BACKEND จริงแทน
+    """
+
+    def __init__(self, dimensions: int = 384, per_call: float = 0.004, per_text: float = 0.0015):
+        self.dimensions = dimensions
+        self.per_call = per_call
+        self.per_text = per_text
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, texts):
+        import hashlib
+
+        import numpy as np
+        import server
+
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.per_call + self.per_text * len(texts))
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for token in server._keyword_tokens(text):
+                vector[int(hashlib.md5(token.encode("utf-8")).hexdigest(), 16) % self.dimensions] += 1.0
+            norm = np.linalg.norm(vector)
+            vectors.append(vector / norm if norm else vector)
+        return vectors
+
+
+EMBEDDINGS = "EMBEDDING_BACKEND" if os.getenv("BENCH_REAL_EMBEDDINGS") == "1" else "synthetic (hashing, CPU-like latency)"
+
+
+def fresh_memory_store(name: str, **buffer_options):
+    """
+    collection ความจำใหม่ (ว่าง) ใน SANDBOX แล้วใช้แทน collection/index/buffer กลางของ server
+    คืน (store, model) โดย model คือ HashingEmbeddings ที่นับจำนวนครั้งที่ถูกเรียก (None ถ้าใช้โมเดลจริง)
+    """
+    from collections import OrderedDict
+    from types import SimpleNamespace
+
+    import chromadb
+    import server
+
+    path = os.path.join(SANDBOX, "memory", name)
+    model = None if os.getenv("BENCH_REAL_EMBEDDINGS") == "1" else HashingEmbeddings()
+    embeddings = server.CachedEmbeddingFunction(backend=model, path=os.path.join(SANDBOX, f"embeddings-{name}.sqlite3"))
+    collection = chromadb.PersistentClient(path=path).get_or_create_collection(
+        name="memories", embedding_function=embeddings)
+    index = server.MemoryKeywordIndex(collection)
+    buffer = server.MemoryWriteBuffer(collection, on_write=index.add, **{"flush_interval": 3600, **buffer_options})
+    server.embedding_function = embeddings
+    server.memory_collection = collection
+    server.memory_index = index
+    server.memory_buffer = buffer
+    server._memory_query_cache = OrderedDict()
+    return SimpleNamespace(collection=collection, index=index, buffer=buffer, embeddings=embeddings), model
+
+
+def write_text_pdf(path: str, pages: list[list[str]]):
+    """เขียน PDF ข้อความล้วน (ASCII, Helvetica) หนึ่งหน้าต่อ list ของบรรทัด ไม่ต้องพึ่ง library สร้าง PDF"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        escaped = (line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines)
+        stream = ("BT /F1 9 Tf 11 TL 36 806 Td " + " ".join(f"({line}) Tj T*" for line in escaped) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects))
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+    body, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, content in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n%s\nendobj\n" % (number, content)
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    body += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(body)
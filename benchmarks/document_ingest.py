@@ -0,0 +1,85 @@
+"""
+วัด throughput ของ ingest_documents บนชุด PDF/DOCX สังเคราะห์: extract ด้วย thread (แบบเดิม) เทียบกับ worker process
+และรันซ้ำเมื่อทุกไฟล์อยู่ในแคชแล้ว แต่ละโหมดเริ่มจากแคชเอกสารว่าง
+
+    python benchmarks/document_ingest.py [จำนวน PDF] [หน้าต่อไฟล์]
+
+pypdf ถือ GIL ตลอด ผลต่างระหว่าง thread กับ process จึงขึ้นกับจำนวน CPU ของเครื่อง (แสดงในหัวตาราง)
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+
+import docx
+
+from _harness import SANDBOX, print_table, timer, write_text_pdf
+
+import server
+
+WORDS = ["revenue", "margin", "guidance", "quarter", "segment", "growth", "outlook", "capex", "cash", "debt"]
+
+
+def _build_corpus(pdfs: int, pages: int, docxs: int) -> int:
+    os.makedirs(server.WORKSPACE_DIR, exist_ok=True)
+    for i in range(pdfs):
+        write_text_pdf(os.path.join(server.WORKSPACE_DIR, f"report-{i:03d}.pdf"), [
+            [f"Report {i} page {p} line {line}: " + " ".join(WORDS[(i + p + line + k) % len(WORDS)] for k in range(12))
+             for line in range(60)]
+            for p in range(pages)
+        ])
+    for i in range(docxs):
+        document = docx.Document()
+        for paragraph in range(300):
+            document.add_paragraph(f"Memo {i} paragraph {paragraph}: " + " ".join(WORDS[(i + paragraph + k) % len(WORDS)]
+                                                                                 for k in range(15)))
+        document.save(os.path.join(server.WORKSPACE_DIR, f"memo-{i:03d}.docx"))
+    server.workspace_index.invalidate()
+    return pdfs + docxs
+
+
+def _ingest(mode: str) -> dict:
+    with redirect_stdout(io.StringIO()), timer() as t:
+        report = json.loads(asyncio.run(server.ingest_documents.fn(pattern="*.*")))
+    assert not report["errors"], report["errors"]
+    documents = report["documents"]
+    return {
+        "mode": mode,
+        "docs": len(documents),
+        "pages": report["total_pages"],
+        "seconds": t["seconds"],
+        "docs_per_s": len(documents) / t["seconds"],
+        "chars_per_s": sum(d["chars"] for d in documents) / t["seconds"],
+        "cached": sum(d["cached"] for d in documents),
+    }
+
+
+def _fresh_cache(name: str):
+    server.document_cache = server.DocumentTextCache(os.path.join(SANDBOX, f"documents-{name}.sqlite3"))
+
+
+def main():
+    pdfs = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    _build_corpus(pdfs, pages, docxs=max(1, pdfs // 4))
+    rows = []
+
+    server.DOCUMENT_PROCESSES = False
+    _fresh_cache("threads")
+    rows.append(_ingest(f"{server.DOCUMENT_WORKERS} threads (before)"))
+
+    server.DOCUMENT_PROCESSES = True
+    _fresh_cache("processes")
+    rows.append(_ingest(f"{server.DOCUMENT_WORKERS} processes, cold pool"))
+    _fresh_cache("processes-warm")
+    rows.append(_ingest(f"{server.DOCUMENT_WORKERS} processes, warm pool"))
+    rows.append(_ingest("all documents cached"))
+
+    print_table(f"ingest_documents, {pdfs} PDFs x {pages} pages + {max(1, pdfs // 4)} DOCX "
+                f"(CPUs: {os.cpu_count()})", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+เทียบการ extract ข้อความจาก HTML แบบเดิม (BeautifulSoup ทั้งหน้า แล้ว decompose boilerplate) กับ HtmlTextExtractor
+(streaming บน parser target ของ lxml) บนชุดหน้าเว็บที่บันทึกไว้: เวลา, หน่วยความจำสูงสุด และคุณภาพของผลลัพธ์
+
+    python benchmarks/html_extraction.py [โฟลเดอร์ของไฟล์ .html]
+
+ถ้าไม่ระบุโฟลเดอร์ จะสร้างชุดหน้าข่าว/บทความสังเคราะห์ (มีเมนู, script, sidebar, ลิงก์รวม, ความคิดเห็น)
+พร้อมไฟล์ .txt ของเนื้อหาบทความจริงคู่กัน จึงวัดได้ว่าได้เนื้อหาครบแค่ไหน (recall) และมีขยะปนมาเท่าไร (noise)
+HtmlTextExtractor หยุดที่ EXTRACT_MAX_CHARS (capped = จำนวนหน้าที่ถึงงบ) recall ของมันจึงนับเฉพาะเนื้อหาภายในงบ
+หน่วยความจำวัดด้วย tracemalloc (object ของ Python ทั้ง tree ของ BeautifulSoup และข้อความที่ extract)
+"""
+import glob
+import os
+import random
+import sys
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from _harness import SANDBOX, print_table, timer
+
+import server
+
+FEED_BYTES = 64 * 1024  # ขนาด chunk ที่ได้จาก response.iter_bytes()
+THAI_WORDS = ["ตลาดหุ้น", "นักลงทุน", "ปรับตัวขึ้น", "ดอกเบี้ย", "เศรษฐกิจ", "ธนาคารกลาง", "รายงาน", "ผลประกอบการ"]
+ENGLISH_WORDS = ["market", "investors", "inflation", "earnings", "guidance", "outlook", "policy", "growth", "quarter"]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = THAI_WORDS if rng.random() < 0.5 else ENGLISH_WORDS
+    return " ".join(rng.choice(words) for _ in range(rng.randint(8, 20))) + "."
+
+
+def _page(rng: random.Random, paragraphs: int, script_kb: int) -> tuple[str, list[str]]:
+    article = []
+    body = []
+    for i in range(paragraphs):
+        if i % 8 == 0:
+            heading = f"Section {i // 8 + 1}: " + _sentence(rng)[:40]
+            article.append(heading)
+            body.append(f"<h2>{heading}</h2>")
+        text = " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+        article.append(text)
+        body.append(f"<p>{text}</p>")
+    links = "".join(f'<li><a href="/news/{i}">Headline {i}</a></li>' for i in range(60))
+    script = "var data = [" + ",".join(str(rng.random()) for _ in range(script_kb * 1024 // 20)) + "];"
+    html = (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>News</title>"
+        f"<style>{'.c{color:red}' * 500}</style><script>{script}</script></head><body>"
+        f"<header><nav><ul>{links}</ul></nav></header>"
+        f"<div class='ad'><a href='/promo'>Subscribe now</a> | <a href='/login'>Log in</a></div>"
+        f"<main><article><h1>Top story</h1>{''.join(body)}</article></main>"
+        f"<div class='related'><ul>{links}</ul></div>"
+        f"<aside><h3>Most read</h3><ul>{links}</ul></aside>"
+        "<div class='comments'>" + "".join(f"<div><a href='/u/{i}'>user{i}</a> <span>nice</span></div>" for i in range(40))
+        + f"</div><footer>{links}</footer></body></html>"
+    )
+    return html, ["Top story"] + article
+
+
+def _build_corpus(folder: str, count: int = 40):
+    rng = random.Random(7)
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        # หน้าส่วนใหญ่ขนาดทั่วไป มีบางหน้าเป็นบทความยาวมาก หรือมี inline script ใหญ่
+        paragraphs = rng.choice([20, 40, 80, 150]) if i % 10 else 1500
+        html, article = _page(rng, paragraphs, script_kb=rng.choice([20, 100, 600]))
+        with open(os.path.join(folder, f"page-{i:03d}.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+        with open(os.path.join(folder, f"page-{i:03d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(article))
+
+
+def _old_extract(raw: bytes) -> str:
+    soup = BeautifulSoup(raw, "lxml")
+    for element in soup(["script", "style", "nav", "footer", "header", "aside", "form"]):
+        element.decompose()
+    return soup.get_text(separator="\n", strip=True)
+
+
+def _new_extractor(main_content_only: bool):
+    def _extract(raw: bytes) -> str:
+        extractor = server.HtmlTextExtractor(main_content_only=main_content_only)
+        for i in range(0, len(raw), FEED_BYTES):
+            extractor.feed(raw[i:i + FEED_BYTES])
+            if extractor.done:
+                break
+        return extractor.finish()
+    return _extract
+
+
+def _quality(output: str, truth: list[str] | None, cap: int | None) -> tuple[float, float] | tuple[None, None]:
+    """
+    recall = สัดส่วนย่อหน้าของบทความที่อยู่ในผลลัพธ์ (ถ้า extractor มีงบ cap ตัวอักษร นับเฉพาะย่อหน้าที่อยู่ในงบ)
+    noise = สัดส่วนตัวอักษรของบรรทัดที่ไม่ใช่เนื้อหาบทความ
+    """
+    if truth is None:
+        return None, None
+    if cap is not None:
+        within, size = [], 0
+        for part in truth:
+            size += len(part) + 1
+            if size > cap * 0.95:  # เผื่อบรรทัดขยะที่อาจมาก่อนเนื้อหา
+                break
+            within.append(part)
+        truth_for_recall = within
+    else:
+        truth_for_recall = truth
+    normalized = " ".join(output.split())
+    recall = sum(" ".join(part.split()) in normalized for part in truth_for_recall) / len(truth_for_recall)
+    truth_text = "\n".join(truth)
+    lines = [line for line in output.splitlines() if line.strip()]
+    noise_chars = sum(len(line) for line in lines if line.strip() not in truth_text)
+    return recall, noise_chars / max(1, sum(len(line) for line in lines))
+
+
+def _run(mode: str, extract, pages: list[tuple[str, bytes, list[str] | None]], cap: int | None = None) -> dict:
+    with timer() as t:
+        outputs = [extract(raw) for _, raw, _ in pages]
+    tracemalloc.start()
+    peak = 0
+    for _, raw, _ in pages:
+        tracemalloc.reset_peak()
+        extract(raw)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    qualities = [_quality(output, truth, cap) for output, (_, _, truth) in zip(outputs, pages)]
+    has_truth = all(recall is not None for recall, _ in qualities)
+    total_mb = sum(len(raw) for _, raw, _ in pages) / 1024 ** 2
+    return {
+        "extractor": mode,
+        "seconds": t["seconds"],
+        "mb_per_s": total_mb / t["seconds"],
+        "peak_mib": peak / 1024 ** 2,
+        "chars_out": sum(len(output) for output in outputs),
+        "capped": sum(cap is not None and len(output) >= cap for output in outputs),
+        "recall": sum(r for r, _ in qualities) / len(qualities) if has_truth else None,
+        "noise": sum(n for _, n in qualities) / len(qualities) if has_truth else None,
+    }
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(SANDBOX, "saved-pages")
+    if len(sys.argv) <= 1:
+        _build_corpus(folder)
+    pages = []
+    for path in sorted(glob.glob(os.path.join(folder, "*.htm*"))):
+        with open(path, "rb") as f:
+            raw = f.read()
+        truth_path = os.path.splitext(path)[0] + ".txt"
+        truth = None
+        if os.path.exists(truth_path):
+            with open(truth_path, encoding="utf-8") as f:
+                truth = f.read().splitlines()
+        pages.append((path, raw, truth))
+    if not pages:
+        sys.exit(f"no .html files in {folder}")
+
+    rows = [
+        _run("BeautifulSoup, whole page (before)", _old_extract, pages),
+        _run("HtmlTextExtractor", _new_extractor(False), pages, server.EXTRACT_MAX_CHARS),
+        _run("HtmlTextExtractor, main_content_only", _new_extractor(True), pages, server.EXTRACT_MAX_CHARS),
+    ]
+    total_mb = sum(len(raw) for _, raw, _ in pages) / 1024 ** 2
+    largest_mb = max(len(raw) for _, raw, _ in pages) / 1024 ** 2
+    print_table(f"{len(pages)} saved pages, {total_mb:.1f} MB (largest {largest_mb:.1f} MB), "
+                f"EXTRACT_MAX_CHARS={server.EXTRACT_MAX_CHARS}; peak_mib = largest single page", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+วัดการอ่านหลายหน้าเว็บจาก server บนเครื่องที่จำลอง latency ของเครือข่าย: connection ใหม่เสียเวลา handshake
+และทุก response รอ latency วินาที เทียบ requests.get + BeautifulSoup ทีละ URL (แบบเดิม), browse_url ทีละ URL
+ผ่าน PooledFetcher (keep-alive) และ browse_urls (หลาย URL พร้อมกัน จำกัดต่อ host ด้วย HTTP_MAX_PER_HOST)
+
+    python benchmarks/http_fetch.py [จำนวน URL] [latency วินาที] [handshake วินาที]
+"""
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from bs4 import BeautifulSoup
+
+from _harness import print_table, timer
+
+import server
+
+PARAGRAPH = "<p>Markets rallied as investors weighed new data on inflation, earnings and rates. </p>"
+
+
+class LatencySite:
+    """server ที่หน่วง handshake ต่อ connection ใหม่ และ latency ต่อ response และนับ connection ที่เปิด"""
+
+    def __init__(self, latency: float, handshake: float, page_kb: int = 60):
+        self.connections = 0
+        site = self
+        body = ("<html><head><title>t</title><script>var x = 1;</script></head><body><nav>Home | News</nav>"
+                "<article>" + PARAGRAPH * (page_kb * 1024 // len(PARAGRAPH)) + "</article></body></html>").encode()
+        lock = threading.Lock()
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with lock:
+                    site.connections += 1
+                time.sleep(handshake)
+
+            def do_GET(self):
+                time.sleep(latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class _Server(ThreadingHTTPServer):
+            request_queue_size = 1024
+            daemon_threads = True
+
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def urls(self, prefix: str, count: int) -> list[str]:
+        return [f"{self.base_url}/{prefix}/article-{i}" for i in range(count)]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _old_browse(url: str) -> str:
+    """browse_url ก่อนมี PooledFetcher: requests.get ใหม่ทุกครั้ง แล้ว parse ทั้งหน้าด้วย BeautifulSoup"""
+    response = requests.get(url, timeout=15, headers={"User-Agent": "Mozilla/5.0"})
+    response.raise_for_status()
+    soup = BeautifulSoup(response.content, "lxml")
+    for element in soup(["script", "style", "nav", "footer", "header", "aside", "form"]):
+        element.decompose()
+    return soup.get_text(separator="\n", strip=True)[:20000]
+
+
+def _measure(mode: str, site: LatencySite, urls: list[str], run) -> dict:
+    connections_before = site.connections
+    with redirect_stdout(io.StringIO()), timer() as t:
+        contents = run(urls)
+    assert all(contents), f"{mode}: empty page"
+    return {"mode": mode, "urls": len(urls), "seconds": t["seconds"], "pages_per_s": len(urls) / t["seconds"],
+            "connections": site.connections - connections_before}
+
+
+def _browse_urls(urls: list[str]) -> list[str]:
+    results = json.loads(asyncio.run(server.browse_urls.fn(urls=urls)))["results"]
+    return [result.get("content") for result in results]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    handshake = float(sys.argv[3]) if len(sys.argv) > 3 else 0.06
+    site = LatencySite(latency, handshake)
+    rows = []
+    try:
+        rows.append(_measure("requests.get per URL, one at a time (before)", site, site.urls("old", count),
+                             lambda urls: [_old_browse(url) for url in urls]))
+        rows.append(_measure("browse_url per URL, pooled keep-alive", site, site.urls("pooled", count),
+                             lambda urls: [server._browse_page(url, 0, 20000).get("content") for url in urls]))
+        rows.append(_measure(f"browse_urls, {server.HTTP_MAX_PER_HOST} per host", site, site.urls("batch", count),
+                             _browse_urls))
+        server.fetcher = server.PooledFetcher(max_per_host=server.BROWSE_MAX_CONCURRENCY)
+        rows.append(_measure(f"browse_urls, {server.BROWSE_MAX_CONCURRENCY} per host", site, site.urls("wide", count),
+                             _browse_urls))
+        rows.append(_measure("browse_urls again (page cache)", site, site.urls("wide", count), _browse_urls))
+    finally:
+        site.close()
+    print_table(f"reading {count} pages from one host (latency {latency * 1000:.0f} ms, "
+                f"new connection +{handshake * 1000:.0f} ms)", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+วัดเวลาของ get_stock_price บน MarketDataStore เมื่อแคชว่าง (cold) เทียบกับเมื่อมีข้อมูลแล้ว (warm)
+และการดึงช่วงที่ขาดทีละ ticker เทียบกับพร้อมกัน (MARKET_DATA_CONCURRENCY) ใช้ client ราคาสังเคราะห์ที่หน่วงเหมือน Yahoo
+
+    python benchmarks/market_data_cache.py [จำนวน ticker] [latency วินาทีต่อ request]
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+
+from _harness import SANDBOX, SyntheticMarketClient, print_table, timer
+
+import server
+
+
+def _request(tickers: list[str], period: str) -> float:
+    with timer() as t:
+        result = json.loads(asyncio.run(server.get_stock_price.fn(tickers, period)))
+    assert set(result) == set(tickers), result
+    return t["seconds"]
+
+
+def _run(name: str, tickers: list[str], latency: float, max_workers: int) -> list[dict]:
+    client = SyntheticMarketClient(latency=latency)
+    server.market_data = server.MarketDataStore(
+        client=client, path=os.path.join(SANDBOX, f"market-{name}.sqlite3"), max_workers=max_workers)
+    rows = []
+    for label, period in [("cold", "6mo"), ("warm, same request", "6mo"), ("warm, shorter period", "10d"),
+                          ("longer period (head gap only)", "1y")]:
+        calls = client.calls
+        seconds = _request(tickers, period)
+        rows.append({"workers": max_workers, "request": f"{label} ({period})", "tickers": len(tickers),
+                     "seconds": seconds, "upstream_fetches": client.calls - calls})
+    return rows
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.25
+    tickers = [f"T{i:03d}" for i in range(count)]
+    with redirect_stdout(io.StringIO()):
+        rows = _run("sequential", tickers, latency, 1) + _run("concurrent", tickers, latency, server.MARKET_DATA_CONCURRENCY)
+    print_table(f"get_stock_price, {count} tickers, {latency * 1000:.0f} ms per upstream request", rows)
+
+
+if __name__ == "__main__":
+    main()
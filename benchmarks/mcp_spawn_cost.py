@@ -0,0 +1,71 @@
+"""
+วัดต้นทุนจริงของการ spawn server.py ต่อการเรียก tool หนึ่งครั้ง (แบบเดิมของ _run_async_tool)
+เทียบกับการเรียกผ่าน MCPSessionPool ที่เปิด server ค้างไว้
+
+    python benchmarks/mcp_spawn_cost.py [จำนวนครั้ง]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from _harness import ROOT, print_table, timer
+
+import agent
+
+agent.SERVER_COMMAND = sys.executable
+agent.SERVER_ARGS = [os.path.join(ROOT, "server.py")]
+
+
+async def _spawn_per_call(calls: int) -> list[float]:
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        async with agent._setup_mcp() as session:
+            await session.call_tool("get_current_date", {})
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def _pooled(pool: agent.MCPSessionPool, calls: int) -> list[float]:
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        pool.call("get_current_date", {})
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def _row(mode: str, latencies: list[float]) -> dict:
+    return {
+        "mode": mode,
+        "calls": len(latencies),
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    spawned = asyncio.run(_spawn_per_call(calls))
+
+    pool = agent.MCPSessionPool(size=agent.MCP_POOL_SIZE)
+    try:
+        with timer() as warm_up:
+            pool.call("get_current_date", {})  # รวมเวลา spawn ทุก worker ใน pool
+        pooled = _pooled(pool, calls * 10)
+    finally:
+        pool.close()
+
+    print_table("get_current_date: spawn server.py per call vs warm MCPSessionPool", [
+        _row("spawn per call", spawned),
+        _row(f"pool (size {pool.size}) first call", [warm_up["seconds"]]),
+        _row(f"pool (size {pool.size}) warm", pooled),
+    ])
+    print(f"\nspawn cost per call ~ {(statistics.mean(spawned) - statistics.mean(pooled)) * 1000:,.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
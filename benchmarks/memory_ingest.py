@@ -0,0 +1,96 @@
+"""
+วัด throughput ของการบันทึกความจำแบบต่างๆ ลง collection ใหม่:
+add ทีละชิ้น (แบบเดิมก่อนมี write buffer), save_memory_chunk ทีละครั้ง / หลาย caller พร้อมกัน (group commit),
+save_memory_chunks ทีละ batch และบันทึกชุดเดิมซ้ำ (dedupe ไม่ต้อง embed ใหม่)
+
+    python benchmarks/memory_ingest.py [จำนวนชิ้น]
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from _harness import EMBEDDINGS, fresh_memory_store, print_table, timer
+
+import server
+
+TOPICS = ["หุ้น", "กาแฟ", "ประชุม", "report", "deadline", "ลูกค้า", "server", "budget"]
+
+
+def _corpus(size: int) -> list[str]:
+    return [f"memory {i}: {TOPICS[i % len(TOPICS)]} note about item {i * 7919 % 10007} for project {i % 37}"
+            for i in range(size)]
+
+
+def _row(mode: str, docs: list[str], seconds: float, store, model) -> dict:
+    stats = store.buffer.stats()
+    return {
+        "mode": mode,
+        "docs": len(docs),
+        "stored": store.collection.count(),
+        "seconds": seconds,
+        "docs_per_s": len(docs) / seconds,
+        "flushes": stats["flushes"] or None,
+        "embed_calls": model.calls if model else None,
+    }
+
+
+def _per_item_add(docs):
+    # เส้นทางเดิม: ทุก save เรียก collection.add หนึ่งครั้ง (embed + HNSW insert ทีละชิ้น)
+    store, model = fresh_memory_store("per-item")
+    with timer() as t:
+        for doc in docs:
+            store.collection.add(ids=[server._memory_id(doc)], documents=[doc],
+                                 metadatas=[{"saved_at": datetime.now().isoformat()}])
+    return _row("collection.add per memory (before)", docs, t["seconds"], store, model)
+
+
+def _save_one_by_one(docs):
+    store, model = fresh_memory_store("sequential")
+    with timer() as t:
+        for doc in docs:
+            assert "success" in asyncio.run(server.save_memory_chunk.fn(doc))
+    return _row("save_memory_chunk, 1 caller", docs, t["seconds"], store, model)
+
+
+def _save_concurrently(docs, callers: int):
+    store, model = fresh_memory_store(f"concurrent-{callers}")
+    with timer() as t, ThreadPoolExecutor(max_workers=callers) as pool:
+        results = list(pool.map(lambda doc: asyncio.run(server.save_memory_chunk.fn(doc)), docs))
+    assert all("success" in result for result in results)
+    return _row(f"save_memory_chunk, {callers} callers", docs, t["seconds"], store, model)
+
+
+def _save_batches(docs, batch: int, name: str = "batches", store=None, model=None):
+    if store is None:
+        store, model = fresh_memory_store(name)
+    calls_before = model.calls if model else 0
+    flushes_before = store.buffer.stats()["flushes"]
+    with timer() as t:
+        for i in range(0, len(docs), batch):
+            chunks = [{"content": doc} for doc in docs[i:i + batch]]
+            assert json.loads(asyncio.run(server.save_memory_chunks.fn(chunks)))["status"] == "success"
+    row = _row(f"save_memory_chunks, {batch} per call", docs, t["seconds"], store, model)
+    row["flushes"] = store.buffer.stats()["flushes"] - flushes_before
+    if model:
+        row["embed_calls"] = model.calls - calls_before
+    return row, store, model
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    docs = _corpus(size)
+    with redirect_stdout(io.StringIO()):
+        rows = [_per_item_add(docs), _save_one_by_one(docs), _save_concurrently(docs, 8)]
+        batched, store, model = _save_batches(docs, 64)
+        repeated, _, _ = _save_batches(docs, 64, store=store, model=model)
+    repeated["mode"] = "same corpus again (all duplicates)"
+    rows += [batched, repeated]
+    print_table(f"memory ingest throughput, {size} memories (embeddings: {EMBEDDINGS})", rows)
+
+
+if __name__ == "__main__":
+    main()
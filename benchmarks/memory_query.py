@@ -0,0 +1,93 @@
+"""
+วัด latency ของ search_relevant_memories บน collection ขนาดใหญ่ (ค่าเริ่มต้น 100k ความจำ):
+คำค้นใหม่ (ต้องรันโมเดล embed คำค้น), คำค้นเดิมหลังมีการเขียน (vector ของคำค้นมาจากแคช embedding)
+และคำค้นเดิมที่ไม่มีการเขียน (แคชผลการค้นหา) แยกตาม mode
+
+    python benchmarks/memory_query.py [จำนวนความจำ] [จำนวนคำค้น]
+
+แบบเดิม (ก่อนมีแคช) ทุกการค้นหาต้อง embed คำค้นใหม่ คือแถว "new query" ของ mode vector
+"""
+import asyncio
+import io
+import json
+import random
+import statistics
+import sys
+from contextlib import redirect_stdout
+
+from _harness import EMBEDDINGS, fresh_memory_store, print_table, timer
+
+import server
+
+TOPICS = ["หุ้น", "กาแฟ", "ประชุม", "report", "deadline", "ลูกค้า", "server", "budget", "เดินทาง", "สุขภาพ"]
+TICKERS = ["NVDA", "AAPL", "MSFT", "PTT", "AOT", "CPALL", "TSLA", "AMZN", "SCB", "KBANK"]
+
+
+def _memories(count: int, rng: random.Random) -> list[str]:
+    return [
+        f"memory {i}: {rng.choice(TOPICS)} {rng.choice(TOPICS)} note about {rng.choice(TICKERS)} "
+        f"item {rng.randrange(100000)} for project {rng.randrange(500)}"
+        for i in range(count)
+    ]
+
+
+def _queries(count: int, rng: random.Random) -> list[str]:
+    return [f"{rng.choice(TOPICS)} {rng.choice(TICKERS)} project {rng.randrange(500)}" for _ in range(count)]
+
+
+def _search(query: str, mode: str) -> float:
+    with timer() as t:
+        result = json.loads(asyncio.run(server.search_relevant_memories.fn(query=query, mode=mode)))
+    assert "memories" in result, result
+    return t["seconds"]
+
+
+def _row(mode: str, case: str, samples: list[float], embedded: int) -> dict:
+    samples = sorted(samples)
+    return {"mode": mode, "case": case, "queries": len(samples),
+            "p50_ms": statistics.median(samples) * 1000, "p95_ms": samples[int(len(samples) * 0.95)] * 1000,
+            "query_embeds": embedded}
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rng = random.Random(3)
+    store, model = fresh_memory_store("query-latency", batch_size=5000)
+    per_call, per_text = (model.per_call, model.per_text) if model else (0, 0)
+
+    with redirect_stdout(io.StringIO()), timer() as build:
+        if model:
+            model.per_call = model.per_text = 0.0  # สร้าง collection โดยไม่หน่วงเวลา เวลาที่วัดคือของการค้นหาเท่านั้น
+        for memory in _memories(size, rng):
+            store.buffer.add(memory)
+        store.buffer.flush()
+        store.index.search("warm up", 1)  # โหลด keyword index จาก collection ก่อนเริ่มจับเวลา
+        if model:
+            model.per_call, model.per_text = per_call, per_text
+
+    rows = []
+    with redirect_stdout(io.StringIO()):
+        for mode in ("vector", "keyword", "hybrid"):
+            queries = _queries(query_count, rng)
+            embeds_before = store.embeddings.stats()["misses"]
+            fresh = [_search(query, mode) for query in queries]
+            rows.append(_row(mode, "new query", fresh, store.embeddings.stats()["misses"] - embeds_before))
+
+            # การเขียนเปลี่ยน version ของ index จึงล้างแคชผลการค้นหา แต่ vector ของคำค้นยังอยู่ในแคช embedding
+            store.buffer.add(f"new memory before repeating {mode} queries")
+            store.buffer.flush()
+            embeds_before = store.embeddings.stats()["misses"]
+            repeated = [_search(query, mode) for query in queries]
+            rows.append(_row(mode, "same query after a write", repeated, store.embeddings.stats()["misses"] - embeds_before))
+
+            embeds_before = store.embeddings.stats()["misses"]
+            cached = [_search(query, mode) for query in queries]
+            rows.append(_row(mode, "same query, no writes", cached, store.embeddings.stats()["misses"] - embeds_before))
+
+    print_table(f"search_relevant_memories on {store.collection.count():,} memories "
+                f"(built in {build['seconds']:.0f}s, embeddings: {EMBEDDINGS})", rows)
+
+
+if __name__ == "__main__":
+    main()
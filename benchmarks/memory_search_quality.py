@@ -0,0 +1,173 @@
+"""
+วัดคุณภาพและ latency ของ search_relevant_memories แต่ละ mode (vector, keyword, hybrid) บนชุดความจำสังเคราะห์
+ที่รู้คำตอบ: ทุกคำค้นมีความจำเป้าหมายหนึ่งรายการปนอยู่กับความจำพื้นหลังที่ใช้คำคล้ายกัน วัด recall@5 และ MRR แยกตามชนิดคำค้น
+    - exact id: เลข ticket/ID ที่ต้องตรงตัว (INC-48213) ท่ามกลาง ID อื่นรูปแบบเดียวกัน
+    - ticker: ticker + หัวข้อ (NVDA กับ "ปันผล") ซึ่งความจำพื้นหลังก็พูดถึง ticker/หัวข้อเดียวกันแยกกัน
+    - thai substring: คำไทยที่อยู่กลางประโยคไม่มีช่องว่าง (ค้น "กาแฟสด" ในความจำ "...ร้านกาแฟสดริมทาง...")
+    - reworded: เรียงคำใหม่/ใช้คำบางส่วนของความจำ ไม่มีคำหายากที่ตรงตัว
+
+    python benchmarks/memory_search_quality.py [จำนวนความจำพื้นหลัง] [จำนวนคำค้นต่อชนิด]
+
+ด้วย embedding ปลอม (hash ของ token) vector search ไม่เข้าใจความหมาย ผลของ mode vector จึงเป็นขั้นต่ำ
+ตั้ง BENCH_REAL_EMBEDDINGS=1 เพื่อวัดด้วยโมเดลจริง แถว "keyword (before), index only" คือ BM25 แบบเดิมที่วนทีละเอกสารใน Python
+(ได้อันดับเดียวกัน จึงแสดงเฉพาะ latency)
+"""
+import asyncio
+import heapq
+import io
+import json
+import math
+import random
+import statistics
+import sys
+from contextlib import redirect_stdout
+
+from _harness import EMBEDDINGS, fresh_memory_store, print_table, timer
+
+import server
+
+TICKERS = ["NVDA", "AAPL", "MSFT", "PTT", "AOT", "CPALL", "TSLA", "AMZN", "SCB", "KBANK", "ADVANC", "GULF"]
+TOPICS = ["ปันผล", "งบการเงิน", "ราคาเป้าหมาย", "ประชุมผู้ถือหุ้น", "แผนลงทุน", "ความเสี่ยง", "รายได้", "หนี้สิน"]
+PLACES = ["ร้านกาแฟสด", "ร้านข้าวมันไก่", "ตลาดนัดกลางคืน", "สวนสาธารณะ", "ห้องสมุดประชาชน", "ร้านหนังสือเก่า",
+          "โรงพยาบาลเอกชน", "ร้านซ่อมรถ", "สนามแบดมินตัน", "ร้านขนมปังอบ"]
+PLACE_QUERIES = {"ร้านกาแฟสด": "กาแฟสด", "ร้านข้าวมันไก่": "ข้าวมันไก่", "ตลาดนัดกลางคืน": "ตลาดนัด",
+                 "สวนสาธารณะ": "สาธารณะ", "ห้องสมุดประชาชน": "ห้องสมุด", "ร้านหนังสือเก่า": "หนังสือเก่า",
+                 "โรงพยาบาลเอกชน": "โรงพยาบาล", "ร้านซ่อมรถ": "ซ่อมรถ", "สนามแบดมินตัน": "แบดมินตัน",
+                 "ร้านขนมปังอบ": "ขนมปัง"}
+FILLER = ["วันนี้", "เมื่อวาน", "สัปดาห์หน้า", "ลูกค้า", "ทีมงาน", "รายงาน", "ติดตาม", "สรุป", "meeting", "note",
+          "deadline", "update", "review", "server", "budget", "plan"]
+AREAS = ["บางนา", "ลาดพร้าว", "สีลม", "อารีย์", "ทองหล่อ", "บางซื่อ", "รังสิต", "นนทบุรี"]
+
+
+def _filler(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(FILLER) for _ in range(count))
+
+
+def _background(count: int, rng: random.Random) -> list[str]:
+    """ความจำพื้นหลังที่ใช้คำชุดเดียวกับเป้าหมาย แต่ไม่มีคู่คำ/ID ที่คำค้นต้องการ"""
+    memories = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            memories.append(f"ticket INC-{rng.randrange(10000, 90000)} {_filler(rng, 5)}")
+        elif kind == 1:
+            memories.append(f"{rng.choice(TICKERS)} {_filler(rng, 4)} {rng.choice(TOPICS)}ของกลุ่มพลังงาน")
+        elif kind == 2:
+            memories.append(f"{_filler(rng, 3)} ไป{rng.choice(AREAS)}กับเพื่อน {_filler(rng, 3)}")
+        else:
+            memories.append(f"{_filler(rng, 6)} {rng.randrange(1000)}")
+    return memories
+
+
+def _labelled(per_kind: int, rng: random.Random) -> list[tuple[str, str, str]]:
+    """คืน (ชนิด, ความจำเป้าหมาย, คำค้น)"""
+    cases = []
+    ids = rng.sample(range(90000, 99999), per_kind)
+    for ticket in ids:
+        cases.append(("exact id", f"ticket INC-{ticket} ลูกค้าแจ้งว่า server ล่ม {_filler(rng, 3)}",
+                      f"สถานะ INC-{ticket}"))
+    for _ in range(per_kind):
+        ticker, topic = rng.choice(TICKERS), rng.choice(TOPICS)
+        amount = rng.randrange(10, 99)
+        cases.append(("ticker", f"{ticker} ประกาศ{topic} {amount} บาท {_filler(rng, 3)}", f"{ticker} {topic} {amount}"))
+    for _ in range(per_kind):
+        place, area = rng.choice(PLACES), rng.choice(AREAS)
+        day = rng.randrange(1, 29)
+        cases.append(("thai substring", f"นัดเจอที่{place}แถว{area}วันที่{day}",
+                      f"{PLACE_QUERIES[place]} {area} {day}"))
+    for _ in range(per_kind):
+        words = [rng.choice(FILLER) for _ in range(3)] + [f"project{rng.randrange(10000)}", rng.choice(AREAS)]
+        memory = " ".join(words) + " " + _filler(rng, 3)
+        query_words = words[1:]
+        rng.shuffle(query_words)
+        cases.append(("reworded", memory, " ".join(query_words)))
+    return cases
+
+
+def _old_keyword_search(index: server.MemoryKeywordIndex, query: str, limit: int) -> list[str]:
+    """BM25 แบบเดิม: วนทุก posting ของทุกคำค้นใน Python แล้ว heapq.nlargest"""
+    total_docs = len(index._doc_tokens)
+    average_length = index._total_length / total_docs or 1.0
+    scores: dict[int, float] = {}
+    for token in set(server._keyword_tokens(query)):
+        postings = index._postings.get(token)
+        if not postings:
+            continue
+        idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+        for ordinal, tf in postings.items():
+            doc_length = index._lengths[ordinal]
+            scores[ordinal] = scores.get(ordinal, 0.0) + idf * tf * (index.k1 + 1) / (
+                tf + index.k1 * (1 - index.b + index.b * doc_length / average_length)
+            )
+    return [index._ids[ordinal] for ordinal in heapq.nlargest(limit, scores, key=scores.get)]
+
+
+def _latency_row(mode: str, kind: str, samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {"mode": mode, "queries": kind, "p50_ms": statistics.median(samples) * 1000,
+            "p95_ms": samples[int(len(samples) * 0.95)] * 1000}
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    per_kind = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(11)
+    store, model = fresh_memory_store("search-quality", batch_size=5000)
+    cases = _labelled(per_kind, rng)
+    per_call, per_text = (model.per_call, model.per_text) if model else (0, 0)
+
+    with redirect_stdout(io.StringIO()), timer() as build:
+        if model:
+            model.per_call = model.per_text = 0.0  # สร้าง collection โดยไม่หน่วงเวลา
+        targets = {}
+        for memory in _background(size, rng):
+            store.buffer.add(memory)
+        for _, memory, query in cases:
+            targets[query] = store.buffer.add(memory)[0]
+        store.buffer.flush()
+        store.index.search("warm up", 1)
+        if model:
+            model.per_call, model.per_text = per_call, per_text
+
+    quality, latency = [], []
+    kinds = list(dict.fromkeys(kind for kind, _, _ in cases))
+    with redirect_stdout(io.StringIO()):
+        for mode in ("vector", "keyword", "hybrid"):
+            samples = []
+            for kind in kinds:
+                hits, reciprocal = 0, 0.0
+                for case_kind, _, query in cases:
+                    if case_kind != kind:
+                        continue
+                    with timer() as t:
+                        result = json.loads(asyncio.run(
+                            server.search_relevant_memories.fn(query=query, n_results=5, mode=mode)))
+                    samples.append(t["seconds"])
+                    ranked = [memory["id"] for memory in result["memories"]]
+                    if targets[query] in ranked:
+                        hits += 1
+                        reciprocal += 1 / (ranked.index(targets[query]) + 1)
+                quality.append({"mode": mode, "queries": kind, "recall@5": hits / per_kind, "mrr": reciprocal / per_kind})
+            latency.append(_latency_row(mode, "all", samples))
+
+    samples = []
+    for _, _, query in cases:
+        with timer() as t:
+            _old_keyword_search(store.index, query, 20)
+        samples.append(t["seconds"])
+    latency.insert(1, _latency_row("keyword (before), index only", "all", samples))
+    samples = []
+    for _, _, query in cases:
+        with timer() as t:
+            store.index.search(query, 20)
+        samples.append(t["seconds"])
+    latency.insert(2, _latency_row("keyword, index only", "all", samples))
+
+    title = (f"{store.collection.count():,} memories, {per_kind} labelled queries per kind "
+             f"(built in {build['seconds']:.0f}s, embeddings: {EMBEDDINGS})")
+    print_table(title, quality)
+    print_table("latency per query", latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+วัดต้นทุนต่อแชทของ agent: สร้าง AdvancedWebAgent ใหม่ทุก session (แบบเดิม) เทียบกับใช้ engine กลางตัวเดียว
+ที่ state ต่อแชทเหลือแค่ SummarizingChatMessageHistory แล้วคำนวณว่า worker หนึ่งตัวรับได้กี่แชทต่อ RAM 1 GiB
+และรันหลายแชทพร้อมกันผ่าน engine กลางไปที่ endpoint แบบ OpenAI จำลอง
+
+    python benchmarks/session_capacity.py [จำนวนแชทที่รันพร้อมกัน]
+
+หน่วยความจำวัดด้วย tracemalloc (เฉพาะ object ของ Python ไม่รวม heap ของ native library)
+"""
+import asyncio
+import statistics
+import sys
+import time
+import tracemalloc
+
+from _harness import FakeOpenAIServer, print_table, timer
+
+with timer() as import_time:
+    import agent
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_openai import ChatOpenAI
+
+GIB = 1024 ** 3
+HISTORY_TURNS = 6  # เท่ากับ HISTORY_KEEP_TURNS ค่าเริ่มต้น: ขนาดประวัติของแชทที่คุยมาสักพัก
+
+
+def _old_session():
+    """สิ่งที่ on_chat_start เคยสร้างต่อแชท: engine ใหม่ทั้งชุด + ตัวห่อความจำ"""
+    engine = agent.AdvancedWebAgent()
+    history = InMemoryChatMessageHistory()
+    return engine, history, RunnableWithMessageHistory(engine.agent_executor, lambda session_id: history,
+                                                       input_messages_key="input", history_messages_key="chat_history")
+
+
+def _new_session(engine):
+    return agent.SummarizingChatMessageHistory(llm=engine.llm, session_id="bench")
+
+
+def _fill(history):
+    for turn in range(HISTORY_TURNS):
+        history.add_messages([HumanMessage(content=f"คำถามที่ {turn} " + "ข้อมูล " * 40),
+                              AIMessage(content=f"คำตอบที่ {turn} " + "รายละเอียด " * 250)])
+    return history
+
+
+def _setup_seconds(factory, count: int) -> float:
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        factory()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def _bytes_per_session(factory, count: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [factory() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del sessions
+    return (after - before) / count
+
+
+def _capacity_row(mode: str, setup: float, per_session: float) -> dict:
+    return {"mode": mode, "setup_ms": setup * 1000, "kib_per_session": per_session / 1024,
+            "sessions_per_gib": int(GIB / per_session)}
+
+
+async def _concurrent_turns(engine, sessions: int) -> dict:
+    histories = {str(i): _new_session(engine) for i in range(sessions)}
+    runnable = RunnableWithMessageHistory(engine.agent_executor, lambda session_id: histories[session_id],
+                                          input_messages_key="input", history_messages_key="chat_history")
+    latencies = []
+
+    async def _turn(sid: str, turn: int):
+        started = time.perf_counter()
+        await runnable.ainvoke({"input": f"สวัสดีครับ รอบที่ {turn}"}, config={"configurable": {"session_id": sid}})
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for turn in range(2):
+        await asyncio.gather(*(_turn(sid, turn) for sid in histories))
+    elapsed = time.perf_counter() - started
+    assert all(len(history.messages) == 4 for history in histories.values())
+    latencies.sort()
+    return {"sessions": sessions, "turns": len(latencies), "seconds": elapsed, "turns_per_s": len(latencies) / elapsed,
+            "p50_ms": latencies[len(latencies) // 2] * 1000, "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000}
+
+
+async def _concurrency_levels(engine, levels: list[int]) -> list[dict]:
+    # event loop เดียวตลอด: async HTTP client ของ ChatOpenAI ใช้ร่วมกันทั้ง process และผูกกับ loop ที่สร้างมัน
+    return [await _concurrent_turns(engine, count) for count in levels]
+
+
+def main():
+    concurrent = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    fake = FakeOpenAIServer(answer="รับทราบครับ")
+    agent.CHEAP_MODEL = ""
+
+    with timer() as engine_time:
+        engine = agent.get_shared_agent()
+    engine.llm = ChatOpenAI(model="bench-model", api_key="bench-key", base_url=fake.base_url, temperature=0)
+    engine.agent_executor.verbose = False
+
+    print_table("startup", [
+        {"step": "import agent", "seconds": import_time["seconds"]},
+        {"step": "get_shared_agent() (once per process)", "seconds": engine_time["seconds"]},
+    ])
+
+    old_setup = _setup_seconds(_old_session, 20)
+    new_setup = _setup_seconds(lambda: _new_session(engine), 1000)
+    rows = [
+        _capacity_row("AdvancedWebAgent per chat (before)", old_setup, _bytes_per_session(_old_session, 50)),
+        _capacity_row(f"AdvancedWebAgent per chat, {HISTORY_TURNS}-turn history (before)", old_setup,
+                      _bytes_per_session(lambda: (_old_session(), _fill(InMemoryChatMessageHistory())), 50)),
+        _capacity_row("shared engine, empty history", new_setup, _bytes_per_session(lambda: _new_session(engine), 2000)),
+        _capacity_row(f"shared engine, {HISTORY_TURNS}-turn history", new_setup,
+                      _bytes_per_session(lambda: _fill(_new_session(engine)), 500)),
+    ]
+    print_table("per-chat setup time and memory (sessions_per_gib = how many chats fit in 1 GiB of Python heap)", rows)
+
+    try:
+        results = asyncio.run(_concurrency_levels(engine, sorted({10, 50, concurrent})))
+    finally:
+        fake.close()
+    print_table("concurrent chats on one shared engine (fake LLM endpoint, 2 turns each)", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+วัด analyze_stocks กับ ticker จำนวนมาก (100+): เวลาเมื่อแคชว่าง/มีข้อมูลแล้ว, เวลาคำนวณแบบ vectorized
+เทียบกับวนคำนวณทีละ ticker และขนาดผลลัพธ์เทียบกับข้อมูลดิบจาก get_stock_price ที่ LLM ต้องคำนวณเอง
+
+    python benchmarks/stock_analytics.py [จำนวน ticker ...]
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+
+from _harness import SANDBOX, TOKEN_COUNTER, SyntheticMarketClient, count_text_tokens, print_table, timer
+
+import server
+
+PERIOD = "1y"
+MA_WINDOWS = [20, 50]
+
+
+def _measure(count: int) -> dict:
+    tickers = [f"T{i:03d}" for i in range(count)]
+    client = SyntheticMarketClient(latency=0.25)
+    server.market_data = server.MarketDataStore(client=client, path=os.path.join(SANDBOX, f"analytics-{count}.sqlite3"))
+
+    with timer() as cold:
+        asyncio.run(server.analyze_stocks.fn(tickers, PERIOD, MA_WINDOWS))
+    with timer() as warm:
+        payload = asyncio.run(server.analyze_stocks.fn(tickers, PERIOD, MA_WINDOWS))
+    assert "error" not in json.loads(payload)
+
+    close, volume = server.market_data.get_panel(tickers, PERIOD)
+    with timer() as vectorized:
+        server._compute_stock_analytics(close, volume, MA_WINDOWS)
+    with timer() as per_ticker:
+        for ticker in close.columns:
+            server._compute_stock_analytics(close[[ticker]], volume[[ticker]], MA_WINDOWS)
+
+    raw = asyncio.run(server.get_stock_price.fn(tickers, PERIOD, "records"))
+    return {
+        "tickers": count,
+        "cold_s": cold["seconds"],
+        "warm_s": warm["seconds"],
+        "compute_ms": vectorized["seconds"] * 1000,
+        "per_ticker_loop_ms": per_ticker["seconds"] * 1000,
+        "result_tokens": count_text_tokens(payload),
+        "raw_rows_tokens": count_text_tokens(raw),
+    }
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 250, 500]
+    with redirect_stdout(io.StringIO()):
+        rows = [_measure(count) for count in counts]
+    print_table(f"analyze_stocks over {PERIOD}, 250 ms per upstream request (tokens: {TOKEN_COUNTER})", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+เทียบขนาดผลลัพธ์ของ get_stock_price แต่ละ output_format (bytes ที่ส่งผ่าน MCP และ token ที่เข้า prompt ของ LLM)
+ใช้ข้อมูลราคาสังเคราะห์ ไม่ต้องต่อ Yahoo
+
+    python benchmarks/stock_payload_formats.py
+"""
+import asyncio
+import json
+
+from _harness import TOKEN_COUNTER, SyntheticMarketClient, count_text_tokens, print_table
+
+import server
+
+FORMATS = ["records", "columnar", "csv"]
+CASES = [(1, "10d"), (5, "10d"), (5, "3mo"), (20, "3mo"), (20, "1y")]
+
+
+def main():
+    server.market_data = server.MarketDataStore(client=SyntheticMarketClient(latency=0), path=":memory:")
+    rows = []
+    for ticker_count, period in CASES:
+        tickers = [f"T{i:03d}" for i in range(ticker_count)]
+        baseline = None
+        for output_format in FORMATS:
+            payload = asyncio.run(server.get_stock_price.fn(tickers, period, output_format))
+            assert "error" not in json.loads(payload), payload
+            size, tokens = len(payload.encode("utf-8")), count_text_tokens(payload)
+            baseline = baseline or tokens
+            rows.append({
+                "tickers": ticker_count, "period": period, "format": output_format,
+                "bytes": size, "prompt_tokens": tokens, "vs_records": f"{tokens / baseline:.0%}",
+            })
+    print_table(f"get_stock_price payload by output_format (tokens: {TOKEN_COUNTER})", rows)
+
+
+if __name__ == "__main__":
+    main()
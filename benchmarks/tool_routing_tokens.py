@@ -0,0 +1,72 @@
+"""
+เทียบ prompt ที่ agent ส่งให้ LLM จริงเมื่อเปิด/ปิด tool router (TOOL_ROUTER_ENABLED)
+ยิงข้อความตัวอย่างผ่าน AgentExecutor ไปที่ endpoint แบบ OpenAI จำลอง แล้วนับ token ของ messages + tools ใน request
+
+    python benchmarks/tool_routing_tokens.py
+"""
+import asyncio
+import json
+
+from _harness import TOKEN_COUNTER, FakeOpenAIServer, count_text_tokens, print_table
+
+from langchain_openai import ChatOpenAI
+
+import agent
+
+SAMPLE_MESSAGES = [
+    "สวัสดีครับ วันนี้เป็นอย่างไรบ้าง",
+    "ราคาหุ้น NVDA กับ AAPL ย้อนหลัง 10 วัน",
+    "ค้นหาข่าวล่าสุดเกี่ยวกับ AI ในประเทศไทย",
+    "อ่านไฟล์ report.csv แล้วสรุปให้หน่อย",
+    "ช่วยจำไว้ว่าฉันชอบกาแฟดำไม่ใส่น้ำตาล",
+    "12 * 7 + 5 เท่ากับเท่าไร",
+    "จำนวนนักเรียนในห้องมี 30 คน sometimes มาสาย",
+    "แปลงเอกสาร API จาก HTML เป็น PDF",
+    "เปิดโปรแกรม paint แล้วคลิกที่หน้าจอ",
+    "https://example.com/article สรุปบทความนี้",
+]
+
+
+def _request_tokens(body: dict) -> tuple[int, int]:
+    tools = body.get("tools") or []
+    text = json.dumps(body["messages"], ensure_ascii=False) + json.dumps(tools, ensure_ascii=False)
+    return len(tools), count_text_tokens(text)
+
+
+async def _run(engine, fake, router_enabled: bool) -> list[tuple[int, int]]:
+    agent.TOOL_ROUTER_ENABLED = router_enabled
+    measured = []
+    for message in SAMPLE_MESSAGES:
+        before = len(fake.requests)
+        await engine.agent_executor.ainvoke({"input": message, "chat_history": []})
+        measured.append(_request_tokens(fake.requests[before]))
+    return measured
+
+
+def main():
+    fake = FakeOpenAIServer(answer="รับทราบครับ")
+    agent.CHEAP_MODEL = ""
+    engine = agent.AdvancedWebAgent()
+    engine.llm = ChatOpenAI(model="bench-model", api_key="bench-key", base_url=fake.base_url, temperature=0)
+    engine.agent_executor.verbose = False
+    try:
+        without_router = asyncio.run(_run(engine, fake, False))
+        with_router = asyncio.run(_run(engine, fake, True))
+    finally:
+        fake.close()
+
+    rows = []
+    for message, (all_tools, full), (tools, routed) in zip(SAMPLE_MESSAGES, without_router, with_router):
+        rows.append({
+            "message": message[:40], "tools_off": all_tools, "tools_on": tools,
+            "tokens_off": full, "tokens_on": routed, "saved": f"{1 - routed / full:.0%}",
+        })
+    total_off = sum(tokens for _, tokens in without_router)
+    total_on = sum(tokens for _, tokens in with_router)
+    rows.append({"message": "TOTAL", "tokens_off": total_off, "tokens_on": total_on,
+                 "saved": f"{1 - total_on / total_off:.0%}"})
+    print_table(f"prompt tokens of the first LLM request per message, router off vs on (tokens: {TOKEN_COUNTER})", rows)
+
+
+if __name__ == "__main__":
+    main()
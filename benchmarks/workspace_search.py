@@ -0,0 +1,129 @@
+"""
+วัด search_workspace บน workspace หลายพันไฟล์ (.md/.txt/.py/.csv ปนภาษาไทยและอังกฤษ ในโฟลเดอร์ย่อย):
+การ index ครั้งแรก, ค้นซ้ำเมื่อไม่มีอะไรเปลี่ยน, ค้นหลังแก้ไขไฟล์จำนวนหนึ่ง (index ใหม่เฉพาะไฟล์ที่เปลี่ยน)
+และหลัง write_to_file เทียบกับแบบเดิมที่ต้องอ่านทุกไฟล์ (read_from_file ทีละไฟล์) เพื่อหาว่าไฟล์ไหนมีคำค้น
+
+    python benchmarks/workspace_search.py [จำนวนไฟล์] [บรรทัดต่อไฟล์]
+
+คอลัมน์ tokens คือขนาดผลลัพธ์ที่ LLM ต้องอ่าน: แบบเดิมคือเนื้อหาทุกไฟล์ แบบใหม่คือ JSON ของ snippet
+"""
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+from contextlib import redirect_stdout
+
+from _harness import TOKEN_COUNTER, count_text_tokens, print_table, timer
+
+import server
+
+WORDS = ["budget", "server", "deploy", "ลูกค้า", "รายงาน", "ประชุม", "invoice", "ticket", "latency", "สัญญา",
+         "migration", "ตรวจสอบ", "release", "dashboard", "ค่าใช้จ่าย", "backup"]
+EXTENSIONS = [".md", ".txt", ".py", ".csv"]
+
+
+def _line(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+
+
+def _build_workspace(files: int, lines: int, rng: random.Random) -> list[str]:
+    """สร้างไฟล์ในโฟลเดอร์ย่อย 50 โฟลเดอร์ ทุก ~100 ไฟล์มีบรรทัดที่มีรหัสโปรเจกต์ (needle) ที่ใช้เป็นคำค้น"""
+    names = []
+    for i in range(files):
+        name = f"team-{i % 50:02d}/notes-{i:05d}{EXTENSIONS[i % len(EXTENSIONS)]}"
+        body = [_line(rng) for _ in range(rng.randint(lines // 2, lines * 3 // 2))]
+        if i % 100 == 7:
+            body.insert(rng.randrange(len(body)), f"project PRJ-{i:05d} ส่งมอบงวดสุดท้าย " + _line(rng))
+        path = os.path.join(server.WORKSPACE_DIR, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(body))
+        names.append(name)
+    server.workspace_index.invalidate()
+    return names
+
+
+def _search(query: str, **kwargs) -> tuple[float, dict]:
+    with redirect_stdout(io.StringIO()), timer() as t:
+        result = json.loads(asyncio.run(server.search_workspace.fn(query=query, **kwargs)))
+    assert "results" in result, result
+    return t["seconds"], result
+
+
+def _read_everything(names: list[str], query: str) -> tuple[float, list[str], int]:
+    """แบบเดิม: ไม่มี index จึงต้อง read_from_file ทุกไฟล์ (และส่งเนื้อหาทั้งหมดให้ LLM) เพื่อหาไฟล์ที่มีคำค้น"""
+    matches, tokens = [], 0
+    with redirect_stdout(io.StringIO()), timer() as t:
+        for name in names:
+            content, offset = "", 0
+            while offset is not None:
+                chunk = json.loads(asyncio.run(server.read_from_file.fn(filename=name, offset=offset)))
+                content += chunk["content"]
+                offset = chunk["next_offset"]
+            tokens += count_text_tokens(content)
+            if query in content:
+                matches.append(name)
+    return t["seconds"], matches, tokens
+
+
+def _row(case: str, samples: list[float], reindexed: int, tokens: int | None, found: int) -> dict:
+    return {"case": case, "searches": len(samples), "p50_ms": statistics.median(samples) * 1000,
+            "max_ms": max(samples) * 1000, "reindexed_files": reindexed, "results": found, "tokens": tokens}
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    rng = random.Random(5)
+    names = _build_workspace(files, lines, rng)
+    needle = f"PRJ-{107:05d}"
+    total_mb = sum(os.path.getsize(os.path.join(server.WORKSPACE_DIR, name)) for name in names) / 1024 ** 2
+    rows = []
+
+    seconds, matches, tokens = _read_everything(names, needle)
+    rows.append({"case": "read_from_file every file (before)", "searches": 1, "p50_ms": seconds * 1000,
+                 "max_ms": seconds * 1000, "reindexed_files": None, "results": len(matches), "tokens": tokens})
+
+    seconds, result = _search(needle)
+    rows.append(_row("first search (builds the index)", [seconds], result["reindexed_files"],
+                     count_text_tokens(json.dumps(result, ensure_ascii=False)), len(result["results"])))
+
+    for case, queries in (("warm, exact project IDs", [f"PRJ-{i:05d}" for i in range(7, files, 100)][:50]),
+                          ("warm, common words (many matches)", ["latency dashboard", "ส่งมอบงวดสุดท้าย", "budget"])):
+        samples, results = [], []
+        for query in queries:
+            seconds, result = _search(query)
+            samples.append(seconds)
+            results.append(result)
+        rows.append(_row(case, samples, sum(r["reindexed_files"] for r in results),
+                         max(count_text_tokens(json.dumps(r, ensure_ascii=False)) for r in results),
+                         min(len(r["results"]) for r in results)))
+
+    seconds, result = _search("ส่งมอบงวดสุดท้าย", pattern="team-07/*", limit=5)
+    rows.append(_row("Thai phrase, one folder, limit 5", [seconds], result["reindexed_files"],
+                     count_text_tokens(json.dumps(result, ensure_ascii=False)), len(result["results"])))
+
+    # แก้ไขไฟล์ 20 ไฟล์จากภายนอก (เช่น editor) แล้วค้นหา: index ใหม่เฉพาะ 20 ไฟล์นั้น
+    for name in rng.sample(names, 20):
+        with open(os.path.join(server.WORKSPACE_DIR, name), "a", encoding="utf-8") as f:
+            f.write(f"\nedited externally EDIT-{name[-9:-4]}")
+    server.workspace_index.invalidate()
+    seconds, result = _search("edited externally")
+    rows.append(_row("after 20 external edits", [seconds], result["reindexed_files"], None, len(result["results"])))
+
+    with redirect_stdout(io.StringIO()):
+        asyncio.run(server.write_to_file.fn(filename="team-00/new-report.md", content="สรุป NEWREPORT-2025 สำหรับลูกค้า"))
+    seconds, result = _search("NEWREPORT-2025")
+    rows.append(_row("after write_to_file", [seconds], result["reindexed_files"], None, len(result["results"])))
+
+    index_mb = sum(os.path.getsize(server.WORKSPACE_SEARCH_PATH + suffix)
+                   for suffix in ("", "-wal") if os.path.exists(server.WORKSPACE_SEARCH_PATH + suffix)) / 1024 ** 2
+    print_table(f"search_workspace on {files:,} files, {total_mb:.1f} MB (index {index_mb:.1f} MB); "
+                f"tokens: {TOKEN_COUNTER}", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,59 @@
+import argparse
+import asyncio
+import atexit
+import base64
+import codecs
+import fnmatch
+import functools
+import gzip
+import hashlib
+import heapq
 import json
+import math
+import multiprocessing
 import os
+import re
+import sqlite3
+import sys
+import threading
+import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from zoneinfo import ZoneInfo
 
-import requests
-from bs4 import BeautifulSoup
+import httpx
+from lxml import etree
 from fastmcp import FastMCP
 
 # --- 💡 1. เพิ่ม import สำหรับความสามารถใหม่ ---
 import chromadb
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
 import pypdf
 import docx
 import numexpr as ne
+import numpy as np
 import pandas as pd
 import yfinance as yf
 import subprocess
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401 (httpx ต้องมี h2 จึงจะเปิด HTTP/2 ได้)
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
 # --- GUI Control Imports (HIGHLY DANGEROUS - USE WITH EXTREME CAUTION) ---
 try:
     import pyautogui
@@ -27,191 +65,1854 @@ except ImportError:
 # สร้าง MCP instance
 mcp = FastMCP("The Archivist's Tools")
 
+
+def _in_thread(func):
+    """
+    ห่อ tool แบบ sync ที่ทำ I/O (ไฟล์, SQLite, ChromaDB, network, subprocess, pyautogui) ให้เป็น async
+    ที่รันใน thread แยก event loop ของ FastMCP จึงยังรับ request อื่นได้ระหว่างที่ tool นี้ทำงาน
+    (functools.wraps คง signature/docstring เดิมไว้ให้ FastMCP สร้าง schema ได้ตามเดิม)
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
 # กำหนดพื้นที่ทำงานที่ปลอดภัย
 WORKSPACE_DIR = "workspace"
 os.makedirs(WORKSPACE_DIR, exist_ok=True)
 
+# แคชบนดิสก์ (SQLite) ของ server ทุกชนิดเก็บไว้ที่นี่
+CACHE_DIR = "cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+
 # --- Memory Setup ---
 MEMORY_DIR = "memory_db"
 os.makedirs(MEMORY_DIR, exist_ok=True)
+
+# --- Embedding Backend + Cache ---
+# onnx = all-MiniLM-L6-v2 บน onnxruntime (ตัวเดียวกับ default ของ Chroma)
+# sentence-transformers = โมเดลใดก็ได้ตาม EMBEDDING_MODEL (ต้องติดตั้ง sentence-transformers เพิ่ม)
+# หมายเหตุ: เปลี่ยนโมเดลแล้วต้องสร้าง memory_db ใหม่ เพราะ vector เดิมคนละ space/มิติ
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx").lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+
+def _load_embedding_backend():
+    """สร้าง embedding function ตาม EMBEDDING_BACKEND (รันบน CPU ในเครื่อง)"""
+    if EMBEDDING_BACKEND == "sentence-transformers":
+        return embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=EMBEDDING_MODEL, device=EMBEDDING_DEVICE, normalize_embeddings=True
+        )
+    if EMBEDDING_BACKEND != "onnx":
+        print(f"WARNING: Unknown EMBEDDING_BACKEND '{EMBEDDING_BACKEND}', falling back to onnx.")
+    return embedding_functions.ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    ครอบ embedding backend ด้วยแคชบนดิสก์ที่ใช้ hash ของ (โมเดล + ข้อความ) เป็น key
+    ข้อความ/คำค้นที่เคย embed แล้วจะไม่ต้องรันโมเดลซ้ำ ส่วนที่ไม่มีในแคชจะ embed เป็น batch
+    """
+
+    def __init__(self, backend=None, path: str = EMBEDDING_CACHE_PATH, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self._backend = backend
+        self.model_key = f"{EMBEDDING_BACKEND}:{EMBEDDING_MODEL}"
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+        self._stats = {"hits": 0, "misses": 0, "inference_seconds": 0.0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, created_at REAL)"
+        )
+
+    @property
+    def backend(self):
+        # โหลดโมเดลเมื่อมี cache miss ครั้งแรกเท่านั้น (server เริ่มเร็วขึ้น)
+        if self._backend is None:
+            self._backend = _load_embedding_backend()
+        return self._backend
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_key}\0{text}".encode("utf-8")).hexdigest()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [self._key(text) for text in input]
+        with self._lock:
+            found = {}
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                found.update(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+        vectors = {key: np.frombuffer(blob, dtype=np.float32) for key, blob in found.items()}
+
+        missing = {key: text for key, text in zip(keys, input) if key not in vectors}
+        if missing:
+            started = time.perf_counter()
+            missing_keys = list(missing)
+            for i in range(0, len(missing_keys), self.batch_size):
+                batch_keys = missing_keys[i:i + self.batch_size]
+                for key, vector in zip(batch_keys, self.backend([missing[key] for key in batch_keys])):
+                    vectors[key] = np.asarray(vector, dtype=np.float32)
+            elapsed = time.perf_counter() - started
+            now = time.time()
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    [(key, vectors[key].tobytes(), now) for key in missing_keys],
+                )
+                self._evict()
+                self._conn.commit()
+                self._stats["inference_seconds"] += elapsed
+
+        with self._lock:
+            self._stats["misses"] += len(missing)
+            self._stats["hits"] += len(keys) - len(missing)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, input: Documents) -> Embeddings:
+        return self(input)
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if total > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY created_at LIMIT ?)",
+                (total - self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "model": self.model_key,
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": entries,
+            }
+
+
+embedding_function = CachedEmbeddingFunction()
 client = chromadb.PersistentClient(path=MEMORY_DIR)
-memory_collection = client.get_or_create_collection(name="memories")
+memory_collection = client.get_or_create_collection(name="memories", embedding_function=embedding_function)
+
+# --- Memory Write Buffer ---
+# รวม memory ที่รอบันทึกไว้แล้ว add ลง Chroma ทีเดียว (embedding + HNSW insert เป็น batch)
+MEMORY_BATCH_SIZE = int(os.getenv("MEMORY_BATCH_SIZE", "32"))
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "2"))
+
+def _memory_id(content: str) -> str:
+    """ID จาก hash ของเนื้อหา: ไม่ชนกันแม้บันทึกในวินาทีเดียวกัน และเนื้อหาซ้ำจะได้ ID เดิม (dedupe)"""
+    return "mem_" + hashlib.sha256(content.strip().encode("utf-8")).hexdigest()[:24]
+
+
+class MemoryWriteBuffer:
+    """
+    บัฟเฟอร์การเขียนความจำ: flush เมื่อครบ batch_size หรือเมื่อรอนานเกิน flush_interval วินาที
+    การอ่าน (search/list) ต้องเรียก flush() ก่อนเสมอ เพื่อให้เห็นสิ่งที่เพิ่งบันทึก
+    save() คือ add แล้วรอจนเขียนจริง (group commit): ระหว่างที่ flush หนึ่งกำลังเขียน รายการใหม่จะสะสมเป็น batch ถัดไป
+    แล้วเขียนพร้อมกันใน flush เดียว ผู้เรียกที่ batch ของตนถูกเขียนไปแล้วกลับได้ทันทีโดยไม่ต้องรอคิว flush
+    ถ้า flush ล้มเหลว รายการจะกลับเข้าคิวให้ flush รอบถัดไปลองใหม่ และ save() ของรายการนั้นจะ raise error
+    """
+
+    def __init__(self, collection, batch_size: int = MEMORY_BATCH_SIZE, flush_interval: float = MEMORY_FLUSH_INTERVAL,
+                 on_write=None):
+        self.collection = collection
+        self.on_write = on_write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: dict[str, tuple[str, dict]] = {}
+        self._batch = Future()  # เสร็จเมื่อรายการใน _pending ชุดปัจจุบันถูกเขียน (หรือเขียนไม่สำเร็จ)
+        self._oldest_pending_at: float | None = None
+        self._flushing = False
+        self._lock = threading.Condition()
+        self._stats = {"flushes": 0, "written": 0, "deduplicated": 0, "flush_seconds": 0.0}
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._flush_loop, name="memory-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _enqueue(self, content: str, metadata: dict | None) -> tuple[str, bool, Future, bool]:
+        doc_id = _memory_id(content)
+        # เพิ่ม timestamp เข้าไปโดยอัตโนมัติเสมอ เพื่อให้แน่ใจว่า metadata จะไม่ว่างเปล่า
+        final_metadata = {**(metadata or {}), "saved_at": datetime.now().isoformat()}
+        with self._lock:
+            queued = doc_id not in self._pending
+            if not queued:
+                self._stats["deduplicated"] += 1
+            self._pending[doc_id] = (content, final_metadata)
+            if self._oldest_pending_at is None:
+                self._oldest_pending_at = time.monotonic()
+            return doc_id, queued, self._batch, len(self._pending) >= self.batch_size
+
+    def add(self, content: str, metadata: dict = None) -> tuple[str, bool]:
+        """เพิ่มเข้าคิว คืน (doc_id, queued) โดย queued=False หมายถึงเนื้อหาซ้ำกับที่รออยู่แล้ว"""
+        doc_id, queued, _, full = self._enqueue(content, metadata)
+        if full:
+            self.flush()
+        return doc_id, queued
+
+    def save(self, content: str, metadata: dict = None) -> str:
+        """เพิ่มเข้าคิวแล้วรอจนเขียนลง collection คืน doc_id (raise ถ้าเขียนไม่สำเร็จ โดยรายการยังอยู่ในคิว)"""
+        doc_id, _, batch, _ = self._enqueue(content, metadata)
+        self._flush(until=batch)
+        batch.result()
+        return doc_id
+
+    def flush(self) -> int:
+        """เขียนทุกรายการที่รออยู่ด้วย add ครั้งเดียว (ข้ามรายการที่มีอยู่ใน collection แล้ว) คืนจำนวนที่เขียนจริง"""
+        return self._flush()
+
+    def _flush(self, until: Future | None = None) -> int:
+        with self._lock:
+            # flush ทีละครั้ง ระหว่างรอถ้า batch ของผู้เรียกถูก flush อื่นเขียนไปแล้วก็ไม่ต้อง flush เอง
+            while self._flushing and not (until and until.done()):
+                self._lock.wait()
+            if (until and until.done()) or not self._pending:
+                return 0
+            self._flushing = True
+            pending, batch = self._pending, self._batch
+            self._pending, self._batch, self._oldest_pending_at = {}, Future(), None
+        try:
+            written = self._write(pending)
+        except Exception as e:
+            # เขียนไม่สำเร็จ: คืนรายการกลับเข้าคิวเพื่อลองใหม่ในรอบถัดไป
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+                self._oldest_pending_at = time.monotonic()
+            batch.set_exception(e)
+            raise
+        else:
+            batch.set_result(written)
+        finally:
+            with self._lock:
+                self._flushing = False
+                self._lock.notify_all()
+        return written
+
+    def _write(self, pending: dict[str, tuple[str, dict]]) -> int:
+        started = time.perf_counter()
+        ids = list(pending)
+        existing = set(self.collection.get(ids=ids, include=[])["ids"])
+        new_ids = [doc_id for doc_id in ids if doc_id not in existing]
+        if new_ids:
+            documents = [pending[doc_id][0] for doc_id in new_ids]
+            metadatas = [pending[doc_id][1] for doc_id in new_ids]
+            self.collection.add(ids=new_ids, documents=documents, metadatas=metadatas)
+            if self.on_write:
+                self.on_write(new_ids, documents, metadatas)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["written"] += len(new_ids)
+            self._stats["deduplicated"] += len(existing)
+            self._stats["flush_seconds"] += elapsed
+        print(f"--- Flushed {len(new_ids)} memories ({len(existing)} duplicates) in {elapsed * 1000:.1f} ms ---")
+        return len(new_ids)
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._lock:
+                due = self._oldest_pending_at is not None and time.monotonic() - self._oldest_pending_at >= self.flush_interval
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"!!! ERROR flushing memory buffer: {e} !!!")
+
+    def stats(self) -> dict:
+        with self._lock:
+            seconds = self._stats["flush_seconds"]
+            return {
+                **self._stats,
+                "pending": len(self._pending),
+                "docs_per_second": round(self._stats["written"] / seconds, 1) if seconds else 0.0,
+            }
+
+
+# --- Hybrid Memory Search (BM25 + Vector) ---
+MEMORY_QUERY_CACHE_ENTRIES = int(os.getenv("MEMORY_QUERY_CACHE_ENTRIES", "256"))
+_RRF_K = 60  # ค่ามาตรฐานของ reciprocal-rank fusion
+_KEYWORD_TOKEN_RE = re.compile(r"[\u0e00-\u0e7f]+|[^\W_\u0e00-\u0e7f]+")
+
+def _keyword_tokens(text: str) -> list[str]:
+    """ตัดคำสำหรับ BM25: คำ/ตัวเลขตามช่องว่าง ส่วนภาษาไทย (ไม่มีช่องว่างคั่นคำ) ใช้ bigram ของตัวอักษร"""
+    tokens = []
+    for word in _KEYWORD_TOKEN_RE.findall(text.lower()):
+        if "\u0e00" <= word[0] <= "\u0e7f" and len(word) > 2:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+class MemoryKeywordIndex:
+    """
+    inverted index + BM25 ในหน่วยความจำ สำหรับคำที่ต้องตรงตัว (ชื่อ, ticker, ID) ซึ่ง semantic search ทำได้ไม่ดี
+    โหลดจาก collection ครั้งแรกที่ใช้ แล้วอัปเดตตามการเขียน/ลบ โดย version จะเพิ่มทุกครั้งที่ข้อมูลเปลี่ยน
+    เอกสารแต่ละรายการมีเลขลำดับ (ordinal) ภายใน postings จึงเก็บเป็น {ordinal: tf} และให้คะแนนทั้ง postings
+    ด้วย numpy ทีเดียว คำที่พบบ่อย (อยู่ในเอกสารเกือบทุกรายการ) จึงไม่ต้องวนทีละเอกสารใน Python
+    """
+
+    def __init__(self, collection, k1: float = 1.5, b: float = 0.75):
+        self.collection = collection
+        self.k1 = k1
+        self.b = b
+        self.version = 0
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._postings: dict[str, dict[int, int]] = {}
+        self._doc_tokens: dict[str, dict[str, int]] = {}
+        self._ordinals: dict[str, int] = {}
+        self._ids: list[str | None] = []  # ordinal -> ID (None = ถูกลบแล้ว)
+        self._lengths: list[int] = []  # ordinal -> จำนวน token
+        self._length_array: np.ndarray | None = None
+        self._metadatas: dict[str, dict] = {}
+        self._total_length = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        data = self.collection.get(include=["documents", "metadatas"])
+        self._loaded = True
+        self._add_locked(data["ids"], data["documents"], data["metadatas"])
+
+    def _add_locked(self, ids, documents, metadatas):
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            self._remove_locked(doc_id)
+            counts: dict[str, int] = {}
+            for token in _keyword_tokens(document or ""):
+                counts[token] = counts.get(token, 0) + 1
+            ordinal = len(self._ids)
+            for token, tf in counts.items():
+                self._postings.setdefault(token, {})[ordinal] = tf
+            length = sum(counts.values())
+            self._doc_tokens[doc_id] = counts
+            self._ordinals[doc_id] = ordinal
+            self._ids.append(doc_id)
+            self._lengths.append(length)
+            self._metadatas[doc_id] = metadata or {}
+            self._total_length += length
+        self._length_array = None
+
+    def _remove_locked(self, doc_id: str):
+        counts = self._doc_tokens.pop(doc_id, None)
+        if counts is None:
+            return
+        ordinal = self._ordinals.pop(doc_id)
+        for token in counts:
+            postings = self._postings[token]
+            postings.pop(ordinal, None)
+            if not postings:
+                del self._postings[token]
+        self._metadatas.pop(doc_id, None)
+        self._total_length -= self._lengths[ordinal]
+        self._ids[ordinal] = None
+        self._lengths[ordinal] = 0
+        self._length_array = None
+        if len(self._ids) > 1024 and len(self._ordinals) < len(self._ids) // 2:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        """เรียงเลขลำดับใหม่เมื่อเอกสารที่ถูกลบมีมากกว่าครึ่ง เพื่อไม่ให้ array คะแนนโตตามประวัติการลบ"""
+        remap = {}
+        ids, lengths = [], []
+        for ordinal, doc_id in enumerate(self._ids):
+            if doc_id is not None:
+                remap[ordinal] = len(ids)
+                self._ordinals[doc_id] = len(ids)
+                ids.append(doc_id)
+                lengths.append(self._lengths[ordinal])
+        self._ids, self._lengths = ids, lengths
+        self._postings = {
+            token: {remap[ordinal]: tf for ordinal, tf in postings.items()}
+            for token, postings in self._postings.items()
+        }
+
+    def add(self, ids, documents, metadatas):
+        with self._lock:
+            self.version += 1
+            if self._loaded:
+                self._add_locked(ids, documents, metadatas)
+
+    def remove(self, ids):
+        with self._lock:
+            self.version += 1
+            for doc_id in ids:
+                self._remove_locked(doc_id)
+
+    def metadata(self, doc_id: str) -> dict:
+        with self._lock:
+            self._ensure_loaded()
+            return self._metadatas.get(doc_id, {})
+
+    def search(self, query: str, limit: int, allowed=None) -> list[str]:
+        """คืน ID ที่ได้คะแนน BM25 สูงสุด limit รายการ (allowed คือฟังก์ชันกรอง metadata)"""
+        with self._lock:
+            self._ensure_loaded()
+            total_docs = len(self._doc_tokens)
+            if not total_docs or limit <= 0:
+                return []
+            if self._length_array is None:
+                self._length_array = np.asarray(self._lengths, dtype=np.float64)
+            average_length = self._total_length / total_docs or 1.0
+            norm = self.k1 * (1 - self.b + self.b * self._length_array / average_length)
+            scores = np.zeros(len(self._ids))
+            for token in set(_keyword_tokens(query)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                ordinals = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+                tfs = np.fromiter(postings.values(), dtype=np.float64, count=len(postings))
+                scores[ordinals] += idf * tfs * (self.k1 + 1) / (tfs + norm[ordinals])
+
+            candidates = np.flatnonzero(scores)
+            if allowed is None and len(candidates) > limit:
+                # ไม่มีตัวกรอง: เลือกเฉพาะ limit อันดับแรกก่อนเรียง แทนการเรียงผู้สมัครทั้งหมด
+                candidates = np.sort(candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]])
+            ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+            results = []
+            for ordinal in ranked.tolist():
+                doc_id = self._ids[ordinal]
+                if allowed and not allowed(self._metadatas[doc_id]):
+                    continue
+                results.append(doc_id)
+                if len(results) >= limit:
+                    break
+            return results
+
+
+memory_index = MemoryKeywordIndex(memory_collection)
+memory_buffer = MemoryWriteBuffer(memory_collection, on_write=memory_index.add)
+
+# แคชผลค้นหาล่าสุด: ใช้ได้เฉพาะเมื่อ version ของ index ยังไม่เปลี่ยน (ไม่มีการเขียน/ลบหลังจากนั้น)
+_memory_query_cache: "OrderedDict[str, tuple[int, str]]" = OrderedDict()
+_memory_query_cache_lock = threading.Lock()
+
+def _memory_filter(source: str = None, saved_after: str = None, saved_before: str = None):
+    """สร้างฟังก์ชันกรอง metadata (saved_at เป็น ISO string จึงเทียบแบบ string ได้)"""
+    if not (source or saved_after or saved_before):
+        return None
+    def allowed(metadata: dict) -> bool:
+        saved_at = str((metadata or {}).get("saved_at", ""))
+        if source and (metadata or {}).get("source") != source:
+            return False
+        if saved_after and saved_at < saved_after:
+            return False
+        if saved_before and saved_at > saved_before:
+            return False
+        return True
+    return allowed
 
 # --- NEW MEMORY TOOLS ---
 
 @mcp.tool()
+@_in_thread
 def save_memory_chunk(content: str, metadata: dict = None) -> str:
     """
     บันทึก "ชิ้นส่วนของความทรงจำ" (content) ที่สำคัญลงในฐานข้อมูลความจำระยะยาว
     """
     print(f"--- Saving memory chunk: '{content[:50]}...' ---")
     try:
-        doc_id = f"mem_{int(datetime.now().timestamp())}"
-
-        # --- 💡 จุดแก้ไขที่สำคัญ ---
-        # สร้าง final_metadata ขึ้นมา
-        final_metadata = metadata or {}
-
-        # เพิ่ม timestamp เข้าไปโดยอัตโนมัติเสมอ
-        # เพื่อให้แน่ใจว่า metadata จะไม่ว่างเปล่า
-        final_metadata['saved_at'] = datetime.now().isoformat()
-
-        memory_collection.add(
-            documents=[content],
-            metadatas=[final_metadata], # <--- ใช้ final_metadata ที่มีข้อมูลเสมอ
-            ids=[doc_id]
-        )
+        # ตอบ success เมื่อเขียนลง Chroma แล้วเท่านั้น (การบันทึกที่มาพร้อมกันจะถูกเขียนรวมใน flush เดียว)
+        doc_id = memory_buffer.save(content, metadata)
         return json.dumps({"status": "success", "message": f"Memory chunk saved with ID {doc_id}."})
     except Exception as e:
-        return json.dumps({"error": f"Failed to save memory: {str(e)}"})
+        return json.dumps({"error": f"Failed to save memory: {str(e)}. It stays queued and will be retried."})
 
 @mcp.tool()
-def search_relevant_memories(query: str, n_results: int = 5) -> str:
+@_in_thread
+def save_memory_chunks(chunks: list[dict]) -> str:
     """
-    ค้นหา memories ที่เกี่ยวข้องจาก ChromaDB โดยใช้ semantic search
+    บันทึกความทรงจำ "หลายชิ้น" ในครั้งเดียว (เร็วกว่าเรียก save_memory_chunk ทีละชิ้น)
+    Args:
+        chunks (list[dict]): ลิสต์ของ {"content": str, "metadata": dict (ไม่บังคับ)}
+    เนื้อหาที่ซ้ำกับที่มีอยู่แล้วจะไม่ถูกบันทึกซ้ำ
+    """
+    print(f"--- Saving {len(chunks)} memory chunks ---")
+    try:
+        ids = []
+        for chunk in chunks:
+            if not isinstance(chunk, dict) or not str(chunk.get("content", "")).strip():
+                return json.dumps({"error": "Every chunk must be a dict with a non-empty 'content'."})
+        for chunk in chunks:
+            doc_id, _ = memory_buffer.add(str(chunk["content"]), chunk.get("metadata"))
+            ids.append(doc_id)
+    except Exception as e:
+        return json.dumps({"error": f"Failed to save memories: {str(e)}"})
+    try:
+        memory_buffer.flush()
+    except Exception as e:
+        return json.dumps({"error": f"{len(ids)} memories are queued but could not be written yet ({e}); they will be retried.",
+                           "ids": ids})
+    return json.dumps({"status": "success", "ids": ids, "ingest": memory_buffer.stats()})
+
+@mcp.tool()
+@_in_thread
+def search_relevant_memories(query: str, n_results: int = 5, mode: str = "hybrid", source: str = None,
+                             saved_after: str = None, saved_before: str = None) -> str:
+    """
+    ค้นหา memories ที่เกี่ยวข้อง โดยรวมผล semantic search (ChromaDB) กับ keyword search (BM25)
+    ด้วย reciprocal-rank fusion จึงหาทั้งความหมายใกล้เคียงและคำที่ตรงตัว เช่น ชื่อ, ticker, ID ได้ดี
     Args:
         query (str): คำค้นหา
         n_results (int): จำนวนผลลัพธ์สูงสุดที่ต้องการ (default=5)
+        mode (str): "hybrid" (default), "vector" หรือ "keyword"
+        source (str): กรองเฉพาะ memory ที่ metadata.source ตรงกับค่านี้ (ไม่บังคับ)
+        saved_after / saved_before (str): กรองช่วงวันที่บันทึก รูปแบบ ISO เช่น "2025-01-31" (ไม่บังคับ)
     """
+    if mode not in ("hybrid", "vector", "keyword"):
+        return json.dumps({"error": "mode must be 'hybrid', 'vector' or 'keyword'."})
     try:
-        results = memory_collection.query(query_texts=[query], n_results=n_results)
-        memories = []
-        if results['documents']:
-            for doc, meta, id in zip(results['documents'][0], results['metadatas'][0], results['ids'][0]):
-                memories.append({"id": id, "content": doc, "metadata": meta})
-        return json.dumps({"memories": memories}, ensure_ascii=False)
+        memory_buffer.flush()
+        cache_key = json.dumps([query, n_results, mode, source, saved_after, saved_before], ensure_ascii=False)
+        version = memory_index.version
+        with _memory_query_cache_lock:
+            cached = _memory_query_cache.get(cache_key)
+            if cached and cached[0] == version:
+                _memory_query_cache.move_to_end(cache_key)
+                return cached[1]
+
+        allowed = _memory_filter(source, saved_after, saved_before)
+        # ดึงผู้สมัครมากกว่าที่ต้องการ เพื่อให้ fusion และการกรองวันที่ยังเหลือผลพอ
+        candidates = max(n_results * 3, 20)
+        documents: dict[str, str] = {}
+        metadatas: dict[str, dict] = {}
+        rankings: dict[str, list[str]] = {}
+
+        total = memory_collection.count()
+        if mode != "keyword" and total:
+            results = memory_collection.query(
+                query_texts=[query], n_results=min(candidates, total),
+                where={"source": source} if source else None,
+            )
+            ranked = []
+            for doc_id, doc, meta in zip(results['ids'][0], results['documents'][0], results['metadatas'][0]):
+                if allowed and not allowed(meta):
+                    continue
+                documents[doc_id], metadatas[doc_id] = doc, meta
+                ranked.append(doc_id)
+            rankings["vector"] = ranked
+        if mode != "vector":
+            rankings["keyword"] = memory_index.search(query, candidates, allowed)
+
+        scores: dict[str, float] = {}
+        matched_by: dict[str, list[str]] = {}
+        for name, ranked in rankings.items():
+            for rank, doc_id in enumerate(ranked, start=1):
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (_RRF_K + rank)
+                matched_by.setdefault(doc_id, []).append(name)
+        top_ids = heapq.nlargest(n_results, scores, key=scores.get)
+
+        missing = [doc_id for doc_id in top_ids if doc_id not in documents]
+        if missing:
+            fetched = memory_collection.get(ids=missing, include=["documents", "metadatas"])
+            for doc_id, doc, meta in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+                documents[doc_id], metadatas[doc_id] = doc, meta
+
+        memories = [
+            {"id": doc_id, "content": documents[doc_id], "metadata": metadatas[doc_id],
+             "score": round(scores[doc_id], 5), "matched_by": matched_by[doc_id]}
+            for doc_id in top_ids if doc_id in documents
+        ]
+        result = json.dumps({"memories": memories}, ensure_ascii=False)
+        with _memory_query_cache_lock:
+            _memory_query_cache[cache_key] = (version, result)
+            _memory_query_cache.move_to_end(cache_key)
+            while len(_memory_query_cache) > MEMORY_QUERY_CACHE_ENTRIES:
+                _memory_query_cache.popitem(last=False)
+        return result
     except Exception as e:
         return json.dumps({"error": str(e)}, ensure_ascii=False)
 
+@mcp.tool()
+@_in_thread
+def embedding_cache_stats() -> str:
+    """แสดงสถิติของแคช embedding (hit/miss, เวลาที่ใช้รันโมเดล, จำนวน vector ที่เก็บไว้)"""
+    try:
+        return json.dumps(embedding_function.stats(), ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+# ------------------- MEMORY MAINTENANCE -------------------
+
+# ค่า default ของงานบำรุงรักษา: TTL เป็น 0 = ไม่ลบตามอายุ
+MEMORY_TTL_DAYS = float(os.getenv("MEMORY_TTL_DAYS", "0"))
+MEMORY_MERGE_THRESHOLD = float(os.getenv("MEMORY_MERGE_THRESHOLD", "0.97"))
+_MAINTENANCE_BATCH = 256
+
+_maintenance_lock = threading.Lock()
+_maintenance_state: dict = {"running": False, "last_report": None}
+
+
+def _memory_index_footprint() -> dict:
+    """ขนาดของ memory_db บนดิสก์ และ latency ของ query (median) จากตัวอย่าง embedding ที่มีอยู่แล้ว"""
+    size = 0
+    for root, _, files in os.walk(MEMORY_DIR):
+        size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    total = memory_collection.count()
+    latencies = []
+    if total:
+        sample = memory_collection.get(limit=20, include=["embeddings"])["embeddings"]
+        for embedding in sample:
+            started = time.perf_counter()
+            memory_collection.query(query_embeddings=[embedding], n_results=min(5, total), include=["distances"])
+            latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "memories": total,
+        "size_mb": round(size / (1024 * 1024), 2),
+        "query_ms_median": round(float(np.median(latencies)), 2) if latencies else None,
+    }
+
+
+def _delete_memories(ids: list[str]):
+    for i in range(0, len(ids), _MAINTENANCE_BATCH):
+        batch = ids[i:i + _MAINTENANCE_BATCH]
+        memory_collection.delete(ids=batch)
+        memory_index.remove(batch)
+
+
+def _find_expired_and_orphaned(cutoff: str | None) -> tuple[list[str], list[str]]:
+    """
+    expired: saved_at เก่ากว่า cutoff
+    orphaned: เนื้อหาว่าง หรืออ้างถึงไฟล์ใน workspace (metadata.workspace_file) ที่ถูกลบไปแล้ว
+    """
+    expired, orphaned = [], []
+    total = memory_collection.count()
+    for offset in range(0, total, _MAINTENANCE_BATCH):
+        page = memory_collection.get(limit=_MAINTENANCE_BATCH, offset=offset, include=["documents", "metadatas"])
+        for doc_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            metadata = metadata or {}
+            workspace_file = metadata.get("workspace_file")
+            if cutoff and str(metadata.get("saved_at", "")) < cutoff:
+                expired.append(doc_id)
+            elif not (document or "").strip() or (
+                workspace_file and not os.path.exists(os.path.join(WORKSPACE_DIR, workspace_file))
+            ):
+                orphaned.append(doc_id)
+    return expired, orphaned
+
+
+def _find_near_duplicates(threshold: float, neighbours: int = 10,
+                          exclude: set[str] = frozenset()) -> list[tuple[str, list[str]]]:
+    """
+    หา memory ที่ embedding ใกล้กันเกิน threshold (cosine) โดยเทียบกับ "ตัวแทน" ของกลุ่มเท่านั้น ไม่ใช่แบบต่อกันเป็นทอด
+    (A~B และ B~C ไม่ได้แปลว่า C ซ้ำกับ A) ไล่จากตัวที่บันทึกล่าสุด: ถ้ามีตัวแทนใน neighbours (HNSW) ที่ใกล้พอ
+    จะถูกรวมเข้ากลุ่มของตัวแทนที่ใกล้ที่สุด ไม่เช่นนั้นเป็นตัวแทนของกลุ่มใหม่เอง
+    exclude คือ id ที่กำลังจะถูกลบ (หมดอายุ/orphan) จึงไม่นับเป็นทั้งตัวแทนและสมาชิก
+    คืน [(id ที่เก็บไว้, [id ที่จะรวมเข้าไป])] เฉพาะกลุ่มที่มีสมาชิก
+    """
+    saved_at: dict[str, str] = {}
+    total = memory_collection.count()
+    for offset in range(0, total, _MAINTENANCE_BATCH):
+        page = memory_collection.get(limit=_MAINTENANCE_BATCH, offset=offset, include=["metadatas"])
+        for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+            if doc_id not in exclude:
+                saved_at[doc_id] = str((metadata or {}).get("saved_at", ""))
+    order = sorted(saved_at, key=saved_at.get, reverse=True)
+
+    representatives: set[str] = set()
+    members: dict[str, list[str]] = {}
+    for i in range(0, len(order), _MAINTENANCE_BATCH):
+        batch = order[i:i + _MAINTENANCE_BATCH]
+        page = memory_collection.get(ids=batch, include=["embeddings"])
+        vectors = dict(zip(page["ids"], np.asarray(page["embeddings"], dtype=np.float32)))
+        found = memory_collection.query(
+            query_embeddings=[vectors[doc_id] for doc_id in batch], n_results=min(neighbours, total),
+            include=["embeddings"],
+        )
+        for doc_id, neighbour_ids, neighbour_vectors in zip(batch, found["ids"], found["embeddings"]):
+            vector = vectors[doc_id] / (np.linalg.norm(vectors[doc_id]) + 1e-12)
+            neighbour_vectors = np.asarray(neighbour_vectors, dtype=np.float32)
+            similarities = neighbour_vectors @ vector / (np.linalg.norm(neighbour_vectors, axis=1) + 1e-12)
+            best, best_similarity = None, threshold
+            for neighbour_id, similarity in zip(neighbour_ids, similarities):
+                if neighbour_id in representatives and similarity >= best_similarity:
+                    best, best_similarity = neighbour_id, similarity
+            if best is None:
+                representatives.add(doc_id)
+            else:
+                members.setdefault(best, []).append(doc_id)
+    return list(members.items())
+
+
+def run_memory_maintenance(ttl_days: float = MEMORY_TTL_DAYS, older_than: str = None,
+                           merge_threshold: float = MEMORY_MERGE_THRESHOLD, dry_run: bool = False) -> dict:
+    """
+    บำรุงรักษา memory_db: ลบตามอายุ (ttl_days หรือ older_than), ลบ orphan, รวม near-duplicate
+    ทำทีละ batch โดยไม่ล็อก collection ทั้งก้อน ระหว่างนี้ search/list ยังทำงานได้ตามปกติ
+    """
+    with _maintenance_lock:
+        if _maintenance_state["running"]:
+            raise RuntimeError("Memory maintenance is already running.")
+        _maintenance_state["running"] = True
+    try:
+        started = time.perf_counter()
+        memory_buffer.flush()
+        before = _memory_index_footprint()
+
+        cutoffs = [older_than] if older_than else []
+        if ttl_days and ttl_days > 0:
+            cutoffs.append((datetime.now() - timedelta(days=ttl_days)).isoformat())
+        # ระบุทั้งสองแบบ: ใช้ cutoff ที่เก่ากว่า (ลบน้อยกว่า) เพื่อไม่ลบเกินกว่าที่เงื่อนไขใดเงื่อนไขหนึ่งอนุญาต
+        expired, orphaned = _find_expired_and_orphaned(min(cutoffs) if cutoffs else None)
+        if not dry_run:
+            _delete_memories(expired + orphaned)
+
+        merges = []
+        if merge_threshold and merge_threshold < 1:
+            merges = _find_near_duplicates(merge_threshold, exclude=set(expired + orphaned))
+        merged_ids = [doc_id for _, duplicates in merges for doc_id in duplicates]
+        if merges and not dry_run:
+            duplicates_of = dict(merges)
+            kept = memory_collection.get(ids=list(duplicates_of), include=["documents", "metadatas"])
+            metadatas = []
+            for keep, metadata in zip(kept["ids"], kept["metadatas"]):
+                metadata = dict(metadata or {})
+                metadata["merged_count"] = int(metadata.get("merged_count", 0)) + len(duplicates_of[keep])
+                metadatas.append(metadata)
+            if kept["ids"]:
+                memory_collection.update(ids=kept["ids"], metadatas=metadatas)
+                memory_index.add(kept["ids"], kept["documents"], metadatas)
+            _delete_memories(merged_ids)
+
+        report = {
+            "dry_run": dry_run,
+            "expired": len(expired),
+            "orphaned": len(orphaned),
+            "merged_groups": len(merges),
+            "merged_memories": len(merged_ids),
+            "before": before,
+            "after": _memory_index_footprint(),
+            "elapsed_seconds": round(time.perf_counter() - started, 2),
+            "finished_at": datetime.now().isoformat(),
+        }
+        print(f"--- Memory maintenance: {json.dumps(report)} ---")
+        _maintenance_state["last_report"] = report
+        return report
+    finally:
+        _maintenance_state["running"] = False
+
+
+@mcp.tool()
+@_in_thread
+def maintain_memories(ttl_days: float = MEMORY_TTL_DAYS, older_than: str = None,
+                      merge_threshold: float = MEMORY_MERGE_THRESHOLD, dry_run: bool = False,
+                      wait: bool = False) -> str:
+    """
+    บำรุงรักษาฐานความจำ: ลบความทรงจำที่เก่าเกิน ttl_days วัน หรือบันทึกก่อน older_than (ISO เช่น "2025-01-31"),
+    ลบรายการที่ไม่มีเนื้อหา/อ้างถึงไฟล์ที่ถูกลบแล้ว และรวมความทรงจำที่เกือบซ้ำกัน (cosine >= merge_threshold)
+    dry_run=True จะรายงานอย่างเดียวโดยไม่ลบ, wait=False จะทำงานเบื้องหลังแล้วดูผลด้วย memory_maintenance_report
+    """
+    if _maintenance_state["running"]:
+        return json.dumps({"status": "running", "message": "Memory maintenance is already running."})
+    if wait:
+        try:
+            return json.dumps(run_memory_maintenance(ttl_days, older_than, merge_threshold, dry_run))
+        except Exception as e:
+            return json.dumps({"error": f"Memory maintenance failed: {str(e)}"})
+
+    def _background():
+        try:
+            run_memory_maintenance(ttl_days, older_than, merge_threshold, dry_run)
+        except Exception as e:
+            _maintenance_state["last_report"] = {"error": str(e), "finished_at": datetime.now().isoformat()}
+            print(f"!!! ERROR in memory maintenance: {e} !!!")
+
+    threading.Thread(target=_background, name="memory-maintenance", daemon=True).start()
+    return json.dumps({"status": "started", "message": "Use memory_maintenance_report to see the result."})
+
+
+@mcp.tool()
+@_in_thread
+def memory_maintenance_report() -> str:
+    """แสดงสถานะและรายงานผลการบำรุงรักษาฐานความจำครั้งล่าสุด (ขนาด index และ latency ก่อน/หลัง)"""
+    return json.dumps(
+        {"running": _maintenance_state["running"], "last_report": _maintenance_state["last_report"]},
+        ensure_ascii=False,
+    )
+
+
+def _memory_maintenance_cli(argv: list[str]):
+    """CLI: python server.py maintain-memory [--ttl-days N] [--older-than ISO] [--merge-threshold X] [--dry-run]"""
+    parser = argparse.ArgumentParser(prog="server.py maintain-memory", description="Compact the memory_db store.")
+    parser.add_argument("--ttl-days", type=float, default=MEMORY_TTL_DAYS)
+    parser.add_argument("--older-than", default=None)
+    parser.add_argument("--merge-threshold", type=float, default=MEMORY_MERGE_THRESHOLD)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+    report = run_memory_maintenance(args.ttl_days, args.older_than, args.merge_threshold, args.dry_run)
+    print(json.dumps(report, indent=2))
+
 # ------------------- NEW COMMAND CENTER TOOLS -------------------
 
+MEMORY_LIST_MAX_LIMIT = int(os.getenv("MEMORY_LIST_MAX_LIMIT", "500"))
+
+def _encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str) -> int:
+    return int(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))["offset"])
+
 @mcp.tool()
-def list_all_memories() -> str:
+@_in_thread
+def list_all_memories(offset: int = 0, limit: int = 50, cursor: str = None, mode: str = "full") -> str:
     """
-    ดึงข้อมูล "ความทรงจำ" ทั้งหมดที่ถูกบันทึกไว้ในฐานข้อมูล Vector DB
-    คืนค่าเป็นลิสต์ของความทรงจำทั้งหมด
+    ดึงข้อมูล "ความทรงจำ" ที่ถูกบันทึกไว้ในฐานข้อมูล Vector DB ทีละหน้า (เรียงตามลำดับที่บันทึก)
+    Args:
+        offset (int): ตำแหน่งเริ่มต้น (default=0)
+        limit (int): จำนวนต่อหน้า (default=50)
+        cursor (str): ค่า next_cursor จากหน้าก่อนหน้า (ถ้าระบุจะใช้แทน offset)
+        mode (str): "full" (default), "metadata" (ไม่ส่งเนื้อหา) หรือ "count" (นับจำนวนอย่างเดียว)
+    ถ้า next_cursor ไม่เป็น null แปลว่ายังมีหน้าถัดไป
     """
-    print("--- Listing all memories... ---")
+    print(f"--- Listing memories (mode={mode}, offset={offset}, limit={limit}) ---")
+    if mode not in ("full", "metadata", "count"):
+        return json.dumps({"error": "mode must be 'full', 'metadata' or 'count'."})
     try:
-        # .get() โดยไม่ใส่พารามิเตอร์ จะดึงข้อมูลทั้งหมดใน collection
-        all_memories = memory_collection.get()
+        memory_buffer.flush()
+        total = memory_collection.count()
+        if mode == "count":
+            return json.dumps({"total": total})
+        if cursor:
+            try:
+                offset = _decode_cursor(cursor)
+            except Exception:
+                return json.dumps({"error": "Invalid cursor."})
+        offset = max(0, int(offset))
+        limit = max(1, min(int(limit), MEMORY_LIST_MAX_LIMIT))
+
+        include = ["metadatas"] if mode == "metadata" else ["documents", "metadatas"]
+        page = memory_collection.get(limit=limit, offset=offset, include=include)
         # จัดรูปแบบให้อยู่ในโครงสร้างที่ชัดเจน
-        formatted_memories = [
-            {"id": mem_id, "content": content, "metadata": meta}
-            for mem_id, content, meta in zip(all_memories['ids'], all_memories['documents'], all_memories['metadatas'])
-        ]
-        return json.dumps({"memories": formatted_memories}, ensure_ascii=False)
+        formatted_memories = []
+        for i, mem_id in enumerate(page['ids']):
+            memory = {"id": mem_id, "metadata": page['metadatas'][i]}
+            if mode == "full":
+                memory["content"] = page['documents'][i]
+            formatted_memories.append(memory)
+        next_offset = offset + len(formatted_memories)
+        has_more = next_offset < total and bool(formatted_memories)
+        return json.dumps({
+            "memories": formatted_memories,
+            "total": total,
+            "offset": offset,
+            "next_offset": next_offset if has_more else None,
+            "next_cursor": _encode_cursor(next_offset) if has_more else None,
+        }, ensure_ascii=False)
     except Exception as e:
         return json.dumps({"error": f"Failed to list memories: {str(e)}"})
 
+# --- Workspace File Index ---
+# ถ้าไม่มี watchdog จะตรวจความสดด้วย mtime ของโฟลเดอร์ (มีไฟล์เพิ่ม/ลบ/เปลี่ยนชื่อ) + สแกนใหม่อย่างน้อยทุก TTL วินาที
+WORKSPACE_INDEX_TTL = float(os.getenv("WORKSPACE_INDEX_TTL", "5"))
+
+
+def _is_hidden_path(path: str, root: str) -> bool:
+    relative = os.path.relpath(path, root)
+    return any(part.startswith(".") and part not in (".", "..") for part in relative.split(os.sep))
+
+
+class WorkspaceIndex:
+    """
+    index ของไฟล์ทั้งหมดใน workspace (รวมโฟลเดอร์ย่อย) พร้อม metadata ที่แคชไว้
+    สแกนใหม่ด้วย os.scandir เฉพาะเมื่อมีการเปลี่ยนแปลง (แจ้งจาก watchdog/inotify, mtime ของโฟลเดอร์เปลี่ยน,
+    server เขียนไฟล์เอง หรือเกิน TTL) การเรียก list/snapshot ปกติจึงไม่ต้อง stat ไฟล์ซ้ำทุกครั้ง
+    โฟลเดอร์ที่ขึ้นต้นด้วย "." (เช่น .git/) จะถูกข้ามทั้งโฟลเดอร์
+    """
+
+    def __init__(self, root: str = WORKSPACE_DIR, ttl: float = WORKSPACE_INDEX_TTL):
+        self.root = root
+        self.ttl = ttl
+        self._files: dict[str, dict] = {}
+        self._dir_mtimes: dict[str, int] = {}
+        self._scanned_at = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._observer = None
+        if WATCHDOG_AVAILABLE:
+            try:
+                index = self
+
+                class _Handler(FileSystemEventHandler):
+                    def on_any_event(self, event):
+                        # การเปลี่ยนแปลงในโฟลเดอร์/ไฟล์ซ่อน (เช่น .git/) ไม่กระทบ index
+                        paths = [event.src_path, getattr(event, "dest_path", "")]
+                        if any(path and not _is_hidden_path(path, root) for path in paths):
+                            index.invalidate()
+
+                self._observer = Observer()
+                self._observer.daemon = True
+                self._observer.schedule(_Handler(), root, recursive=True)
+                self._observer.start()
+            except Exception as e:
+                print(f"WARNING: workspace watcher unavailable ({e}); falling back to mtime checks.")
+                self._observer = None
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _is_stale(self) -> bool:
+        if self._dirty:
+            return True
+        if self._observer is not None:
+            return False
+        if time.monotonic() - self._scanned_at > self.ttl:
+            return True
+        try:
+            return any(os.stat(path).st_mtime_ns != mtime for path, mtime in self._dir_mtimes.items())
+        except OSError:
+            return True
+
+    def _scan(self):
+        files: dict[str, dict] = {}
+        dir_mtimes: dict[str, int] = {}
+        pending = [self.root]
+        while pending:
+            directory = pending.pop()
+            dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    # ไฟล์ที่ขึ้นต้นด้วย "." คือไฟล์ชั่วคราว (เช่น ระหว่าง write_chunk) ยังไม่ถือเป็นไฟล์ใน workspace
+                    # ส่วนโฟลเดอร์ซ่อน (.git/, .venv/) ไม่ต้องลงไปสแกนเลย
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file() and not entry.name.startswith("."):
+                        # ไฟล์ที่ขึ้นต้นด้วย "." คือไฟล์ชั่วคราว (เช่น ระหว่าง write_chunk) ยังไม่ถือเป็นไฟล์ใน workspace
+                        file_stat = entry.stat()
+                        name = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+                        files[name] = {"filename": name, "size": file_stat.st_size, "mtime": file_stat.st_mtime}
+        self._files, self._dir_mtimes = files, dir_mtimes
+        self._scanned_at = time.monotonic()
+
+    def _current(self) -> dict[str, dict]:
+        with self._lock:
+            if self._is_stale():
+                # ล้าง flag ก่อนสแกน: ถ้ามีการเปลี่ยนแปลงระหว่างสแกน จะถูกสแกนใหม่ในครั้งถัดไป
+                self._dirty = False
+                self._scan()
+            return self._files
+
+    def snapshot(self) -> dict[str, dict]:
+        """{ชื่อไฟล์: {"filename", "size", "mtime"}} ของไฟล์ทั้งหมด ณ ตอนนี้"""
+        return dict(self._current())
+
+    def list(self, pattern: str = None, extensions: list[str] = None, names: list[str] = None,
+             sort_by: str = "name", descending: bool = False, offset: int = 0, limit: int = 200) -> dict:
+        files = list(self._current().values())
+        if names is not None:
+            wanted = set(names)
+            files = [f for f in files if f["filename"] in wanted]
+        if pattern:
+            files = [f for f in files if fnmatch.fnmatch(f["filename"], pattern)]
+        if extensions:
+            suffixes = tuple("." + ext.lower().lstrip(".") for ext in extensions)
+            files = [f for f in files if f["filename"].lower().endswith(suffixes)]
+        sort_keys = {"name": "filename", "size": "size", "modified": "mtime"}
+        files.sort(key=lambda f: f[sort_keys.get(sort_by, "filename")], reverse=descending)
+        page = files[offset:offset + limit]
+        next_offset = offset + len(page)
+        return {
+            "files": [
+                {
+                    "filename": f["filename"],
+                    "size_kb": f"{f['size'] / 1024:.2f} KB",
+                    "last_modified": datetime.fromtimestamp(f["mtime"]).isoformat(),
+                }
+                for f in page
+            ],
+            "total": len(files),
+            "total_size_kb": round(sum(f["size"] for f in files) / 1024, 2),
+            "next_offset": next_offset if next_offset < len(files) else None,
+        }
+
+
+workspace_index = WorkspaceIndex()
+
 @mcp.tool()
-def list_workspace_files() -> str:
+@_in_thread
+def list_workspace_files(pattern: str = None, extensions: list[str] = None, names: list[str] = None,
+                         sort_by: str = "name", descending: bool = False, offset: int = 0, limit: int = 200) -> str:
     """
-    แสดงรายการไฟล์ทั้งหมดที่อยู่ในโฟลเดอร์ 'workspace'
-    คืนค่าเป็นลิสต์ของไฟล์พร้อมรายละเอียด
+    แสดงรายการไฟล์ที่อยู่ในโฟลเดอร์ 'workspace' (รวมโฟลเดอร์ย่อย) พร้อมรายละเอียดและขนาดรวม
+    Args:
+        pattern (str): glob เช่น "*.csv" หรือ "reports/*" (ไม่บังคับ)
+        extensions (list[str]): กรองตามนามสกุล เช่น ["csv", "md"] (ไม่บังคับ)
+        names (list[str]): ตรวจเฉพาะไฟล์ตามชื่อที่ระบุ (ไม่บังคับ)
+        sort_by (str): "name" (default), "size" หรือ "modified"
+        offset / limit (int): แบ่งหน้า ถ้า next_offset ไม่เป็น null แปลว่ายังมีไฟล์เหลือ
     """
     print("--- Listing workspace files... ---")
+    if sort_by not in ("name", "size", "modified"):
+        return json.dumps({"error": "sort_by must be 'name', 'size' or 'modified'."})
     try:
-        files_details = []
-        for filename in os.listdir(WORKSPACE_DIR):
-            path = os.path.join(WORKSPACE_DIR, filename)
-            if os.path.isfile(path):
-                file_stat = os.stat(path)
-                files_details.append({
-                    "filename": filename,
-                    "size_kb": f"{file_stat.st_size / 1024:.2f} KB",
-                    "last_modified": datetime.fromtimestamp(file_stat.st_mtime).isoformat()
-                })
-        return json.dumps({"files": files_details}, ensure_ascii=False)
+        result = workspace_index.list(pattern, extensions, names, sort_by, descending,
+                                      max(0, offset), max(1, min(limit, 1000)))
+        return json.dumps(result, ensure_ascii=False)
     except Exception as e:
         return json.dumps({"error": f"Failed to list workspace files: {str(e)}"})
 
+# ------------------- PAGE CACHE -------------------
+
+# แคชเนื้อหาที่ดึงจาก URL ลงดิสก์ (SQLite) ใช้ร่วมกันได้ทุก server process ใน pool
+PAGE_CACHE_PATH = os.path.join(CACHE_DIR, "pages.sqlite3")
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "3600"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_MB", "200")) * 1024 * 1024
+
+# query params ที่ใช้ติดตามผู้ใช้เท่านั้น ไม่ได้เปลี่ยนเนื้อหาของหน้า
+_TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref_src"}
+
+def _normalize_url(url: str) -> str:
+    """ทำให้ URL ที่ชี้ไปหน้าเดียวกันได้ cache key เดียวกัน (ตัด fragment, tracking params, port default)"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "http"
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class PageCache:
+    """
+    แคชหน้าเว็บที่ extract เป็นข้อความแล้ว พร้อม ETag/Last-Modified สำหรับ conditional request
+    ทุกครั้งที่บันทึกหน้าใหม่จะลบรายการที่ดึงมานานเกิน ttl ทิ้ง แล้วลบรายการที่ไม่ได้ใช้นานที่สุดออกก่อน (LRU)
+    เมื่อขนาดรวมยังเกิน max_bytes
+    """
+
+    def __init__(self, path: str = PAGE_CACHE_PATH, max_bytes: int = PAGE_CACHE_MAX_BYTES,
+                 ttl: float = PAGE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY, url TEXT, content TEXT, etag TEXT, last_modified TEXT,
+                fetched_at REAL, accessed_at REAL, size INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages(accessed_at);
+            CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages(fetched_at);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER);
+        """)
+        self._conn.commit()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, content, etag, last_modified, fetched_at FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return dict(zip(("url", "content", "etag", "last_modified", "fetched_at"), row))
+
+    def put(self, key: str, url: str, content: str, etag: str | None, last_modified: str | None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, content, etag, last_modified, now, now, len(content.encode("utf-8"))),
+            )
+            self._purge_expired(now)
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, key: str):
+        """หน้าเดิมยังใช้ได้ (ได้ 304) เริ่มนับ TTL ใหม่"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+            self._conn.commit()
+
+    def _purge_expired(self, now: float):
+        expired = self._conn.execute("DELETE FROM pages WHERE fetched_at < ?", (now - self.ttl,)).rowcount
+        if expired:
+            self._conn.execute(
+                "INSERT INTO stats VALUES ('expired', ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                (expired, expired),
+            )
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM pages ORDER BY accessed_at").fetchall():
+            self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self._record_locked("evictions")
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _record_locked(self, name: str):
+        self._conn.execute(
+            "INSERT INTO stats VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,)
+        )
+
+    def record(self, name: str):
+        with self._lock:
+            self._record_locked(name)
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        lookups = counters.get("hits", 0) + counters.get("revalidated", 0) + counters.get("misses", 0)
+        return {
+            "hits": counters.get("hits", 0),
+            "revalidated": counters.get("revalidated", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "expired": counters.get("expired", 0),
+            "hit_rate": round((lookups - counters.get("misses", 0)) / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "size_mb": round(total / (1024 * 1024), 2),
+        }
+
+
+page_cache = PageCache()
+
+@mcp.tool()
+@_in_thread
+def page_cache_stats() -> str:
+    """แสดงสถิติของแคชหน้าเว็บ (hit/miss, จำนวนหน้า, ขนาดรวม)"""
+    try:
+        return json.dumps(page_cache.stats(), ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+# ------------------- STREAMING HTML TEXT EXTRACTION -------------------
+
+# งบจำนวนตัวอักษรที่ extract ต่อหน้า (เก็บลงแคช) หยุด parse และหยุดดาวน์โหลดทันทีเมื่อครบ
+EXTRACT_MAX_CHARS = int(os.getenv("EXTRACT_MAX_CHARS", "200000"))
+
+# subtree ที่เป็น boilerplate จะถูกข้ามทั้งก้อนโดยไม่สร้าง element ใดๆ
+_BOILERPLATE_TAGS = {"script", "style", "nav", "footer", "header", "aside", "form",
+                     "noscript", "svg", "template", "iframe", "button", "select"}
+_HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+_BLOCK_TAGS = _HEADING_TAGS | {"p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd",
+                               "table", "tr", "td", "th", "pre", "blockquote", "figcaption", "hr", "body"}
+# ต้องได้ byte อย่างน้อยเท่านี้ก่อนเดา encoding จาก BOM/<meta charset> (ถ้า header ไม่ได้บอกมา)
+_ENCODING_SNIFF_BYTES = 4096
+_META_CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_:.-]+)""", re.IGNORECASE)
+_BOM_ENCODINGS = ((codecs.BOM_UTF8, "utf-8"), (codecs.BOM_UTF16_LE, "utf-16-le"), (codecs.BOM_UTF16_BE, "utf-16-be"))
+
+
+def _sniff_html_encoding(head: bytes) -> str:
+    """เดา encoding จาก BOM หรือ <meta charset>/<meta http-equiv> ในส่วนต้นของหน้า ถ้าไม่พบใช้ utf-8"""
+    for bom, encoding in _BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    match = _META_CHARSET_PATTERN.search(head[:_ENCODING_SNIFF_BYTES * 4])
+    # ส่งชื่อตามที่หน้าเว็บประกาศให้ lxml (libxml2 รู้จักชื่ออย่าง windows-874 ที่ codecs ของ Python ไม่รู้จัก)
+    return match.group(1).decode("ascii") if match else "utf-8"
+
+
+class HtmlTextExtractor:
+    """
+    แปลง HTML เป็นข้อความแบบ streaming ด้วย parser target ของ lxml (ไม่สร้าง tree ของเอกสาร)
+    ข้อความถูกรวมเป็นบรรทัดตาม block element และหยุดเมื่อได้ตัวอักษรครบ max_chars
+
+    main_content_only=True จะให้คะแนนแต่ละ block แบบ readability อย่างง่าย:
+    เก็บเฉพาะหัวข้อ และ block ที่ยาวพอและมีสัดส่วนข้อความที่เป็นลิงก์ต่ำ (ตัดเมนู/ลิงก์รวมทิ้ง)
+
+    encoding=None (header ไม่ได้ระบุ charset) จะเดาจาก BOM/<meta charset> ของ chunk แรกๆ ก่อนเริ่ม parse
+    """
+
+    def __init__(self, encoding: str | None = None, max_chars: int = EXTRACT_MAX_CHARS,
+                 main_content_only: bool = False):
+        self.max_chars = max_chars
+        self.main_content_only = main_content_only
+        self.done = False
+        self._lines: list[str] = []
+        self._size = 0
+        self._skip_depth = 0
+        self._link_depth = 0
+        self._block: list[str] = []
+        self._block_link_chars = 0
+        self._encoding = encoding
+        self._head: list[bytes] = []
+        self._head_size = 0
+        self._parser = None
+
+    def _start_parser(self):
+        head = b"".join(self._head)
+        self._head, self._head_size = [], 0
+        encoding = self._encoding or _sniff_html_encoding(head)
+        try:
+            self._parser = etree.HTMLParser(target=self, encoding=encoding, remove_comments=True)
+        except LookupError:
+            self._parser = etree.HTMLParser(target=self, encoding="utf-8", remove_comments=True)
+        if head:
+            self._parser.feed(head)
+
+    # --- lxml parser target callbacks ---
+    def start(self, tag, attrib):
+        if self._skip_depth:
+            self._skip_depth += 1
+            return
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in _BOILERPLATE_TAGS:
+            self._skip_depth = 1
+            return
+        if tag == "br":
+            # ขึ้นบรรทัดใหม่ภายใน block เดิม (ย่อหน้าที่แบ่งด้วย <br> ยังถูกให้คะแนนเป็นก้อนเดียว)
+            self._block.append("\n")
+        elif tag in _BLOCK_TAGS:
+            self._flush_block(tag)
+        elif tag == "a":
+            self._link_depth += 1
+
+    def end(self, tag):
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in _BLOCK_TAGS:
+            self._flush_block(tag)
+        elif tag == "a":
+            self._link_depth = max(0, self._link_depth - 1)
+
+    def data(self, text):
+        if self._skip_depth or self.done:
+            return
+        self._block.append(text)
+        if self._link_depth:
+            self._block_link_chars += len(text)
+
+    def close(self):
+        # lxml เรียกเมื่อ parser ถูกปิด (ผลลัพธ์จริงอ่านผ่าน finish())
+        return None
+
+    # --- helpers ---
+    def _flush_block(self, tag: str):
+        lines = (" ".join(line.split()) for line in "".join(self._block).split("\n"))
+        text = "\n".join(line for line in lines if line)
+        link_chars = self._block_link_chars
+        self._block, self._block_link_chars = [], 0
+        if not text or self.done:
+            return
+        if self.main_content_only and tag not in _HEADING_TAGS:
+            if len(text) < 40 or link_chars / len(text) > 0.5:
+                return
+        self._lines.append(text)
+        self._size += len(text) + 1
+        if self._size >= self.max_chars:
+            self.done = True
+
+    def feed(self, chunk: bytes):
+        if self.done:
+            return
+        if self._parser is None:
+            self._head.append(chunk)
+            self._head_size += len(chunk)
+            if self._encoding is None and self._head_size < _ENCODING_SNIFF_BYTES:
+                return
+            self._start_parser()
+            return
+        self._parser.feed(chunk)
+
+    def finish(self) -> str:
+        """ปิด parser (flush ข้อมูลที่ค้างอยู่) แล้วคืนข้อความที่ extract ได้"""
+        try:
+            if self._parser is None:
+                self._start_parser()
+            self._parser.close()
+        except etree.LxmlError:
+            pass  # เอกสารว่างหรือเสียหาย: ใช้ข้อความเท่าที่ได้มา
+        self._flush_block("body")
+        return "\n".join(self._lines)[:self.max_chars]
+
+
+# ------------------- POOLED HTTP FETCHER -------------------
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "4"))
+HTTP_ENABLE_HTTP2 = os.getenv("HTTP_ENABLE_HTTP2", "true").lower() == "true"
+HTTP_MAX_DOWNLOAD_BYTES = int(os.getenv("HTTP_MAX_DOWNLOAD_MB", "5")) * 1024 * 1024
+BROWSE_MAX_CONCURRENCY = int(os.getenv("BROWSE_MAX_CONCURRENCY", "8"))
+
+
+class PooledFetcher:
+    """
+    HTTP client ตัวเดียวต่อ server process: ใช้ keep-alive/connection pool ร่วมกัน (และ HTTP/2 ถ้ามี h2)
+    จำกัดจำนวน connection พร้อมกันต่อ host และหยุดดาวน์โหลดเมื่อเกิน max_bytes
+    """
+
+    def __init__(self, max_connections: int = HTTP_MAX_CONNECTIONS, max_per_host: int = HTTP_MAX_PER_HOST,
+                 max_bytes: int = HTTP_MAX_DOWNLOAD_BYTES, http2: bool = HTTP_ENABLE_HTTP2):
+        self.max_per_host = max_per_host
+        self.max_bytes = max_bytes
+        self._client = httpx.Client(
+            http2=http2 and H2_AVAILABLE,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=15,
+            follow_redirects=True,
+        )
+        self._host_slots: dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def fetch(self, url: str, headers: dict, extractor_factory=None) -> dict:
+        """
+        ดาวน์โหลดแบบ streaming แล้วคืน dict ของ status_code, headers, content (bytes), encoding, truncated
+        ถ้าให้ extractor_factory มา แต่ละ chunk จะถูกส่งเข้า extractor ทันที (ไม่เก็บ bytes ทั้งหน้า)
+        และหยุดดาวน์โหลดเมื่อ extractor ได้ข้อความครบงบแล้ว ผลลัพธ์อยู่ใน key "text"
+        """
+        with self._host_slot(url):
+            with self._client.stream("GET", url, headers=headers) as response:
+                if response.status_code >= 400:
+                    raise httpx.HTTPStatusError(
+                        f"{response.status_code} error for url: {response.url}",
+                        request=response.request, response=response,
+                    )
+                chunks, size, truncated = [], 0, False
+                extractor = extractor_factory(response.charset_encoding) if extractor_factory else None
+                if response.status_code < 300:
+                    for chunk in response.iter_bytes():
+                        size += len(chunk)
+                        if extractor is not None:
+                            extractor.feed(chunk)
+                            if extractor.done:
+                                truncated = True
+                                break
+                        else:
+                            chunks.append(chunk)
+                        if size >= self.max_bytes:
+                            truncated = True
+                            break
+                result = {
+                    "status_code": response.status_code,
+                    "headers": response.headers,
+                    "content": b"".join(chunks)[:self.max_bytes],
+                    "encoding": response.charset_encoding or "utf-8",
+                    "truncated": truncated,
+                }
+                if extractor is not None:
+                    result["text"] = extractor.finish()
+                return result
+
+
+fetcher = PooledFetcher()
+
+# ------------------- CHUNKED READS -------------------
+
+# ขนาด chunk ที่คืนให้ LLM ต่อครั้ง (ตัวอักษร) ส่วนที่เหลืออ่านต่อได้ด้วย read_chunk(handle, next_offset)
+CHUNK_DEFAULT_LENGTH = int(os.getenv("CHUNK_DEFAULT_LENGTH", "8000"))
+CHUNK_MAX_LENGTH = int(os.getenv("CHUNK_MAX_LENGTH", "20000"))
+
+def _chunk_response(handle: str, text: str, offset: int, length: int, **extra) -> dict:
+    """ตัดข้อความเป็น chunk พร้อม handle และ next_offset (None เมื่ออ่านครบแล้ว)"""
+    offset = max(0, offset)
+    length = max(1, min(length, CHUNK_MAX_LENGTH))
+    chunk = text[offset:offset + length]
+    next_offset = offset + len(chunk)
+    return {
+        **extra,
+        "handle": handle,
+        "content": chunk,
+        "offset": offset,
+        "total_length": len(text),
+        "next_offset": next_offset if next_offset < len(text) else None,
+    }
+
+@mcp.tool()
+@_in_thread
+def read_chunk(handle: str, offset: int = 0, length: int = CHUNK_DEFAULT_LENGTH) -> str:
+    """
+    อ่านเนื้อหา "ส่วนถัดไป" จาก handle ที่ได้จาก browse_url หรือ read_from_file โดยไม่ต้องดาวน์โหลด/อ่านใหม่
+    Args:
+        handle (str): ค่า handle จากผลลัพธ์ก่อนหน้า
+        offset (int): ตำแหน่งตัวอักษรที่จะเริ่มอ่าน (ใช้ next_offset จากผลลัพธ์ก่อนหน้า)
+        length (int): จำนวนตัวอักษรที่ต้องการ
+    """
+    try:
+        kind, _, ref = handle.partition(":")
+        if kind == "page":
+            cached = page_cache.get(ref)
+            if not cached:
+                return json.dumps({"error": "Handle expired. Call browse_url again."}, ensure_ascii=False)
+            return json.dumps(_chunk_response(handle, cached["content"], offset, length, url=cached["url"]), ensure_ascii=False)
+        if kind == "file":
+            return _read_file_chunk(ref, offset, length)
+        return json.dumps({"error": f"Unknown handle '{handle}'."}, ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+
 # ------------------- EXISTING TOOLS -------------------
 
 @mcp.tool()
-def browse_url(url: str) -> str:
+@_in_thread
+def browse_url(url: str, main_content_only: bool = False, offset: int = 0,
+               length: int = CHUNK_DEFAULT_LENGTH) -> str:
     """
-    เข้าไปอ่านและดึง "เนื้อหาหลักที่สะอาด" ทั้งหมดจาก URL ที่ให้มาโดยตรง
+    เข้าไปอ่านและดึง "เนื้อหาหลักที่สะอาด" จาก URL ที่ให้มาโดยตรง
     เครื่องมือนี้คือหัวใจของการค้นคว้าเชิงลึก
+    main_content_only=True จะตัดเมนู/ลิงก์รวม/ข้อความสั้นๆ ออก เหลือเฉพาะเนื้อหาหลักของบทความ
+    คืนค่าเป็น chunk (offset/length) พร้อม handle: ถ้า next_offset ไม่เป็น null ให้อ่านต่อด้วย read_chunk
+    """
+    return json.dumps(_browse_page(url, offset, length, main_content_only), ensure_ascii=False)
+
+@mcp.tool()
+@_in_thread
+def browse_urls(urls: list[str], max_length: int = 8000, main_content_only: bool = False) -> str:
     """
+    อ่านเนื้อหาจากหลาย URL "พร้อมกัน" ในครั้งเดียว เร็วกว่าเรียก browse_url ทีละตัว
+    Args:
+        urls (list[str]): ลิสต์ของ URL ที่ต้องการอ่าน
+        max_length (int): จำนวนตัวอักษรสูงสุดต่อ URL (default=8000)
+        main_content_only (bool): เก็บเฉพาะเนื้อหาหลักของแต่ละหน้า (default=False)
+    คืนค่าผลลัพธ์ของแต่ละ URL ตามลำดับเดิม (มี content หรือ error แยกกันต่อ URL)
+    """
+    print(f"--- Server browsing {len(urls)} URLs concurrently ---")
+    if not urls:
+        return json.dumps({"results": []})
+
+    def _browse_one(target: str) -> dict:
+        return {"requested_url": target, **_browse_page(target, 0, max_length, main_content_only)}
+
+    with ThreadPoolExecutor(max_workers=min(BROWSE_MAX_CONCURRENCY, len(urls))) as pool:
+        results = list(pool.map(_browse_one, urls))
+    return json.dumps({"results": results}, ensure_ascii=False)
+
+def _browse_page(url: str, offset: int = 0, length: int = CHUNK_DEFAULT_LENGTH,
+                 main_content_only: bool = False) -> dict:
+    """ดึงและ extract เนื้อหาของหน้าเดียว คืน chunk ของ url/content/handle หรือ error"""
     print(f"--- Server browsing URL with Simple Method: {url} ---")
     try:
         # สำหรับ GitHub raw content URL หรือ GitHub blob URL
-        if 'raw.githubusercontent.com' in url or ('github.com' in url and '/blob/' in url):
+        is_raw = 'raw.githubusercontent.com' in url or ('github.com' in url and '/blob/' in url)
+        if is_raw:
             if 'github.com' in url:
                 url = url.replace('github.com', 'raw.githubusercontent.com').replace('/blob/', '/')
-
             headers = {'User-Agent': 'Mozilla/5.0'}
-            response = requests.get(url, timeout=15, headers=headers)
-            response.raise_for_status()
-            text = response.text
-
         else: # สำหรับเว็บทั่วไป
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
-            response = requests.get(url, timeout=15, headers=headers)
-            response.raise_for_status()
 
-            soup = BeautifulSoup(response.content, 'lxml')
-            for element in soup(["script", "style", "nav", "footer", "header", "aside", "form"]):
-                element.decompose()
-            text = soup.get_text(separator='\n', strip=True)
+        # --- 💡 ใช้แคชก่อน: ยังไม่หมด TTL ตอบจากแคชเลย, หมดแล้วถามเซิร์ฟเวอร์ด้วย ETag/Last-Modified ---
+        cache_key = _normalize_url(url) + ("#main" if main_content_only and not is_raw else "")
+        cached = page_cache.get(cache_key)
+        if cached and time.time() - cached["fetched_at"] < PAGE_CACHE_TTL:
+            page_cache.record("hits")
+            text = cached["content"]
+        else:
+            if cached and cached["etag"]:
+                headers['If-None-Match'] = cached["etag"]
+            if cached and cached["last_modified"]:
+                headers['If-Modified-Since'] = cached["last_modified"]
+
+            # --- 💡 HTML ถูก extract ระหว่างดาวน์โหลด และหยุดทันทีเมื่อได้ข้อความครบ EXTRACT_MAX_CHARS ---
+            extractor_factory = None if is_raw else (
+                lambda encoding: HtmlTextExtractor(encoding=encoding, main_content_only=main_content_only)
+            )
+            response = fetcher.fetch(url, headers, extractor_factory=extractor_factory)
+            if response["status_code"] == 304 and cached:
+                page_cache.touch(cache_key)
+                page_cache.record("revalidated")
+                text = cached["content"]
+            else:
+                page_cache.record("misses")
+                if is_raw:
+                    text = response["content"].decode(response["encoding"], errors='replace')[:EXTRACT_MAX_CHARS]
+                else:
+                    text = response["text"]
+                if text:
+                    page_cache.put(cache_key, url, text, response["headers"].get('ETag'), response["headers"].get('Last-Modified'))
 
         if not text:
-            return json.dumps({"error": "Could not extract text content from the URL."}, ensure_ascii=False)
-
-        max_length = 20000 # เพิ่มความยาวสำหรับงานวิจัยเชิงลึก
-        truncated_text = text[:max_length]
+            return {"error": "Could not extract text content from the URL."}
 
-        print(f"--- Extracted text length: {len(truncated_text)} characters. ---")
-        return json.dumps({"url": url, "content": truncated_text}, ensure_ascii=False)
+        # ข้อความทั้งหน้าอยู่ในแคชแล้ว handle จึงเป็น cache key ให้ read_chunk อ่านส่วนถัดไปได้ทันที
+        print(f"--- Extracted text length: {len(text)} characters. ---")
+        return _chunk_response(f"page:{cache_key}", text, offset, length, url=url)
 
     except Exception as e:
         print(f"!!! ERROR in browse_url tool: {e} !!!")
-        return json.dumps({"error": f"An exception occurred while browsing the URL: {str(e)}"}, ensure_ascii=False)
+        return {"error": f"An exception occurred while browsing the URL: {str(e)}"}
+
+
+# ------------------- MARKET DATA STORE -------------------
+
+MARKET_DATA_PATH = os.path.join(CACHE_DIR, "market_data.sqlite3")
+MARKET_DATA_CONCURRENCY = int(os.getenv("MARKET_DATA_CONCURRENCY", "8"))
+# ระหว่างตลาดเปิด ข้อมูลแท่งล่าสุดยังเปลี่ยนได้ จึงถือว่าสดอยู่ได้แค่ช่วงสั้นๆ
+STOCK_INTRADAY_TTL = float(os.getenv("STOCK_INTRADAY_TTL", "900"))
+MARKET_TZ = ZoneInfo("America/New_York")
+MARKET_OPEN = (9, 30)
+MARKET_CLOSE = (16, 15)  # เผื่อเวลาให้แท่งปิดตลาดนิ่งก่อน
+
+
+class YahooMarketDataClient:
+    """ดึงแท่งราคารายวันจาก Yahoo Finance (สลับเป็น client ปลอมที่มี fetch_bars เดียวกันได้ เพื่อทดสอบแบบ offline)"""
+
+    def fetch_bars(self, ticker: str, start: date, end: date) -> pd.DataFrame:
+        # --- 💡 จุดที่แก้ไข: เราจะเพิ่ม `timeout=15` เข้าไป ---
+        # เพื่อป้องกันไม่ให้ yfinance ค้างนานเกินไปเมื่อเจอ Ticker ที่ไม่มีอยู่จริง
+        return yf.Ticker(ticker).history(start=start.isoformat(), end=end.isoformat(), interval="1d", timeout=15)
+
 
+def _period_start(period: str, today: date) -> tuple[date, int | None]:
+    """แปลง period แบบ yfinance เป็นวันเริ่มต้น และจำนวนแท่งล่าสุดที่ต้องคืน (เฉพาะหน่วย 'd' ซึ่งนับเป็นวันทำการ)"""
+    period = period.strip().lower()
+    if period == "ytd":
+        return date(today.year, 1, 1), None
+    if period == "max":
+        return date(1970, 1, 1), None
+    match = re.fullmatch(r"(\d+)(d|wk|mo|y)", period)
+    if not match:
+        raise ValueError(f"Unsupported period '{period}'. Use e.g. '10d', '1wk', '3mo', '1y', 'ytd' or 'max'.")
+    count, unit = int(match[1]), match[2]
+    if unit == "d":
+        # เผื่อวันหยุดเสาร์-อาทิตย์/วันหยุดตลาด แล้วค่อยตัดเหลือ count แท่งล่าสุด
+        return today - timedelta(days=count * 2 + 5), count
+    return today - timedelta(days={"wk": 7, "mo": 31, "y": 366}[unit] * count), None
+
+
+def _market_data_is_fresh(fetched_at: float, now: datetime | None = None) -> bool:
+    """ตลาดเปิด: สดถ้าอายุไม่เกิน STOCK_INTRADAY_TTL, ตลาดปิด: สดถ้าดึงมาหลังการปิดตลาดครั้งล่าสุด"""
+    now = now or datetime.now(MARKET_TZ)
+    fetched = datetime.fromtimestamp(fetched_at, MARKET_TZ)
+    market_open = now.replace(hour=MARKET_OPEN[0], minute=MARKET_OPEN[1], second=0, microsecond=0)
+    market_close = now.replace(hour=MARKET_CLOSE[0], minute=MARKET_CLOSE[1], second=0, microsecond=0)
+    if now.weekday() < 5 and market_open <= now < market_close:
+        return (now - fetched).total_seconds() < STOCK_INTRADAY_TTL
+    last_close = market_close if now >= market_close else market_close - timedelta(days=1)
+    while last_close.weekday() >= 5:
+        last_close -= timedelta(days=1)
+    return fetched >= last_close
+
+
+class MarketDataStore:
+    """
+    เก็บแท่งราคารายวันต่อ ticker ใน SQLite และดึงจาก client เฉพาะช่วงวันที่ยังไม่มี (incremental)
+    ticker เดียวกันที่ถูกขอพร้อมกันจะรอการดึงครั้งเดียวกัน (single-flight) แทนที่จะดาวน์โหลดซ้ำ
+    ส่วนคำขอหลาย ticker จะดึงช่วงที่ขาดของแต่ละ ticker พร้อมกัน (สูงสุด max_workers request)
+    """
+
+    def __init__(self, client=None, path: str = MARKET_DATA_PATH, max_workers: int = MARKET_DATA_CONCURRENCY):
+        self.client = client or YahooMarketDataClient()
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._ticker_locks: dict[str, threading.Lock] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bars (
+                ticker TEXT, date TEXT, open REAL, high REAL, low REAL, close REAL, volume REAL,
+                PRIMARY KEY (ticker, date)
+            );
+            CREATE TABLE IF NOT EXISTS coverage (ticker TEXT PRIMARY KEY, start TEXT, end TEXT, fetched_at REAL);
+        """)
+        self._conn.commit()
+
+    def _ticker_lock(self, ticker: str) -> threading.Lock:
+        with self._lock:
+            return self._ticker_locks.setdefault(ticker, threading.Lock())
+
+    def _missing_ranges(self, ticker: str, start: date, end: date) -> list[tuple[date, date]]:
+        with self._lock:
+            coverage = self._conn.execute(
+                "SELECT start, end, fetched_at FROM coverage WHERE ticker = ?", (ticker,)
+            ).fetchone()
+            last_bar = self._conn.execute("SELECT MAX(date) FROM bars WHERE ticker = ?", (ticker,)).fetchone()[0]
+        if coverage is None:
+            return [(start, end)]
+        covered_start, covered_end = date.fromisoformat(coverage[0]), date.fromisoformat(coverage[1])
+        ranges = []
+        if start < covered_start:
+            ranges.append((start, covered_start))
+        if covered_end < end or not _market_data_is_fresh(coverage[2]):
+            # ดึงแท่งล่าสุดที่มีอยู่ซ้ำด้วย เพราะอาจเป็นแท่งที่ยังไม่ปิด (intraday)
+            # และต้องต่อจากช่วงที่มีอยู่เสมอ แม้ start จะอยู่หลัง covered_end (coverage เก็บเป็นช่วงเดียวที่ต่อเนื่อง)
+            tail_start = date.fromisoformat(last_bar) if last_bar else covered_end
+            ranges.append((min(tail_start, covered_end), end))
+        return ranges
+
+    def _store(self, ticker: str, frame: pd.DataFrame, start: date, end: date, fetched_at: float):
+        rows = []
+        if frame is not None and not frame.empty:
+            index = frame.index.tz_localize(None) if getattr(frame.index, "tz", None) is not None else frame.index
+            dates = pd.DatetimeIndex(index).strftime("%Y-%m-%d")
+            columns = frame[["Open", "High", "Low", "Close", "Volume"]].to_numpy()
+            rows = [(ticker, day, *map(float, values)) for day, values in zip(dates, columns)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("""
+                INSERT INTO coverage VALUES (?, ?, ?, ?)
+                ON CONFLICT(ticker) DO UPDATE SET
+                    start = MIN(start, excluded.start), end = MAX(end, excluded.end),
+                    fetched_at = MAX(fetched_at, excluded.fetched_at)
+            """, (ticker, start.isoformat(), end.isoformat(), fetched_at))
+            self._conn.commit()
+
+    def _ensure(self, ticker: str, start: date, end: date):
+        with self._ticker_lock(ticker):
+            ranges = self._missing_ranges(ticker, start, end)
+            for fetch_start, fetch_end in ranges:
+                print(f"--- Fetching {ticker} bars {fetch_start} -> {fetch_end} ---")
+            if len(ranges) > 1:
+                # ช่วงหัวและท้ายที่ขาดไม่ทับกัน จึงดึงพร้อมกันได้
+                with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                    frames = list(pool.map(lambda window: self.client.fetch_bars(ticker, *window), ranges))
+            else:
+                frames = [self.client.fetch_bars(ticker, *window) for window in ranges]
+            for (fetch_start, fetch_end), frame in zip(ranges, frames):
+                # นับเป็นข้อมูลสดเฉพาะเมื่อดึงช่วงท้ายสุด (ถึงวันนี้) เท่านั้น ไม่ใช่แค่ช่วงย้อนหลังที่เติม
+                self._store(ticker, frame, fetch_start, fetch_end, time.time() if fetch_end >= end else 0.0)
+
+    def _ensure_all(self, tickers: list[str], start: date, end: date) -> dict[str, Exception]:
+        """_ensure ทุก ticker พร้อมกัน คืน {ticker: error} ของตัวที่ดึงไม่สำเร็จ (ตัวอื่นไม่ล้มตาม)"""
+        def _try(ticker: str) -> Exception | None:
+            try:
+                self._ensure(ticker, start, end)
+            except Exception as e:
+                print(f"!!! WARNING: cannot fetch bars for {ticker}: {e} !!!")
+                return e
+            return None
+
+        if len(tickers) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tickers))) as pool:
+                errors = list(pool.map(_try, tickers))
+        else:
+            errors = [_try(ticker) for ticker in tickers]
+        return {ticker: error for ticker, error in zip(tickers, errors) if error is not None}
+
+    @staticmethod
+    def _window(period: str) -> tuple[date, date, int | None]:
+        today = datetime.now(MARKET_TZ).date()
+        start, last_n = _period_start(period, today)
+        return start, today + timedelta(days=1), last_n
+
+    def get_bars(self, ticker: str, period: str) -> list[dict]:
+        ticker = ticker.strip().upper()
+        start, end, last_n = self._window(period)
+        self._ensure(ticker, start, end)
+        return self._read_bars(ticker, start, last_n)
+
+    def get_bars_many(self, tickers: list[str], period: str) -> dict[str, list[dict] | Exception]:
+        """get_bars ของหลาย ticker โดยดึงช่วงที่ขาดพร้อมกัน คืน {ticker ตามที่ส่งมา: bars หรือ error ของ ticker นั้น}"""
+        start, end, last_n = self._window(period)
+        normalized = {ticker: ticker.strip().upper() for ticker in tickers}
+        errors = self._ensure_all(list(dict.fromkeys(normalized.values())), start, end)
+        return {
+            ticker: errors.get(name) or self._read_bars(name, start, last_n)
+            for ticker, name in normalized.items()
+        }
+
+    def _read_bars(self, ticker: str, start: date, last_n: int | None) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, open, high, low, close, volume FROM bars WHERE ticker = ? AND date >= ? ORDER BY date",
+                (ticker, start.isoformat()),
+            ).fetchall()
+        if last_n is not None:
+            rows = rows[-last_n:]
+        return [dict(zip(("Date", "Open", "High", "Low", "Close", "Volume"), row)) for row in rows]
+
+    def get_panel(self, tickers: list[str], period: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """คืน DataFrame แบบกว้าง (แถว = วันที่, คอลัมน์ = ticker) ของราคาปิดและ volume ด้วย query เดียว"""
+        tickers = list(dict.fromkeys(t.strip().upper() for t in tickers))
+        start, end, last_n = self._window(period)
+        # ticker ที่ดึงไม่สำเร็จจะไม่อยู่ในผลลัพธ์ (ผู้เรียกรายงานเป็น missing_tickers) แทนที่จะทำให้ทั้งชุดล้มเหลว
+        errors = self._ensure_all(tickers, start, end)
+        tickers = [ticker for ticker in tickers if ticker not in errors]
+        placeholders = ",".join("?" * len(tickers))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT date, ticker, close, volume FROM bars WHERE ticker IN ({placeholders}) AND date >= ?",
+                (*tickers, start.isoformat()),
+            ).fetchall()
+        frame = pd.DataFrame(rows, columns=["Date", "Ticker", "Close", "Volume"])
+        frame["Date"] = pd.to_datetime(frame["Date"])
+        close = frame.pivot(index="Date", columns="Ticker", values="Close").sort_index()
+        volume = frame.pivot(index="Date", columns="Ticker", values="Volume").sort_index()
+        if last_n is not None:
+            close, volume = close.iloc[-last_n:], volume.iloc[-last_n:]
+        return close, volume
+
+
+market_data = MarketDataStore()
+
+# ------------------- COMPACT TABLE OUTPUT -------------------
+
+TABLE_OUTPUT_FORMATS = ("records", "columnar", "csv", "arrow")
+
+def _format_table_result(tables: dict, columns: list[str], output_format: str = "records",
+                         precision: int = 4, file_stem: str = "table") -> dict:
+    """
+    แปลงผลลัพธ์แบบตาราง ({ชื่อ: list ของ dict แถว}) ให้อยู่ในรูปแบบที่เลือก
+    - records:  แบบเดิม (dict ต่อแถว ชื่อคอลัมน์ซ้ำทุกแถว)
+    - columnar: ชื่อคอลัมน์ครั้งเดียว แล้วเป็น array ของค่าแต่ละคอลัมน์ ปัดทศนิยมตาม precision
+    - csv/arrow: เขียนไฟล์ลง workspace แล้วคืนแค่ชื่อไฟล์และสรุปสั้นๆ
+    ค่าที่ไม่ใช่ list (เช่น {"error": ...}) จะถูกส่งต่อไปตามเดิม
+    """
+    if output_format not in TABLE_OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output_format '{output_format}'. Use one of {', '.join(TABLE_OUTPUT_FORMATS)}.")
+    if output_format == "records":
+        return tables
+
+    frames = {name: pd.DataFrame(rows, columns=columns).round(precision)
+              for name, rows in tables.items() if isinstance(rows, list)}
+    passthrough = {name: value for name, value in tables.items() if not isinstance(value, list)}
+
+    if output_format == "columnar":
+        data = {name: [frame[column].tolist() for column in columns] for name, frame in frames.items()}
+        return {"format": "columnar", "columns": columns, "data": data, **passthrough}
+
+    combined = pd.concat(
+        [frame.assign(Name=name) for name, frame in frames.items()], ignore_index=True
+    )[["Name", *columns]] if frames else pd.DataFrame(columns=["Name", *columns])
+    filename = f"{file_stem}.{'csv' if output_format == 'csv' else 'arrow'}"
+    safe_path = _get_safe_path(filename)
+    if not safe_path:
+        raise ValueError(f"Invalid output filename '{filename}'.")
+    if output_format == "csv":
+        combined.to_csv(safe_path, index=False)
+    else:
+        combined.to_feather(safe_path)  # Arrow IPC (ต้องมี pyarrow)
+    workspace_index.invalidate()
+    summary = {
+        name: {"rows": len(frame), "first": frame.iloc[0].to_dict(), "last": frame.iloc[-1].to_dict()}
+        for name, frame in frames.items() if not frame.empty
+    }
+    return {"format": output_format, "file": filename, "rows": len(combined), "summary": summary, **passthrough}
+
+def _safe_file_stem(*parts: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", "_".join(parts))[:80]
 
 @mcp.tool()
-def get_stock_price(tickers: list[str], period: str = "10d") -> str:
+@_in_thread
+def get_stock_price(tickers: list[str], period: str = "10d", output_format: str = "records",
+                    precision: int = 4) -> str:
     """
     ดึงข้อมูลราคาย้อนหลังของหุ้นจาก Yahoo Finance สำหรับ Ticker "หลายตัว" พร้อมกัน
     Args:
         tickers (list[str]): ลิสต์ของสัญลักษณ์หุ้น เช่น ['NVDA', 'AAPL'].
         period (str): ช่วงเวลาที่ต้องการข้อมูลย้อนหลัง (e.g., '10d', '1mo').
+        output_format (str): 'records' (dict ต่อแถว), 'columnar' (กระชับ: ชื่อคอลัมน์ครั้งเดียว + array ของค่า),
+            'csv' หรือ 'arrow' (เขียนไฟล์ลง workspace แล้วคืนแค่สรุป)
+        precision (int): จำนวนทศนิยมของราคาในโหมด columnar/csv/arrow (default=4)
     """
     try:
-        # --- 💡 จุดที่แก้ไข: เราจะเพิ่ม `timeout=15` เข้าไป ---
-        # เพื่อป้องกันไม่ให้ yfinance ค้างนานเกินไปเมื่อเจอ Ticker ที่ไม่มีอยู่จริง
-        data = yf.download(tickers, period=period, timeout=15)
+        # --- 💡 อ่านจากแคชในเครื่องก่อน และดาวน์โหลดเฉพาะช่วงวันที่ยังขาดอยู่ ---
+        ticker_list = tickers if isinstance(tickers, list) else [tickers]
+        results = {}
+        for ticker, records in market_data.get_bars_many(ticker_list, period).items():
+            if isinstance(records, Exception):
+                results[ticker] = {"error": str(records)}
+                continue
+            results[ticker] = records or {"error": "No data found for this specific ticker."}
 
-        if data.empty:
-            return json.dumps({"error": f"ไม่พบข้อมูลสำหรับ tickers ที่ระบุ"})
+        if all(isinstance(value, dict) for value in results.values()):
+            return json.dumps({"error": f"ไม่พบข้อมูลสำหรับ tickers ที่ระบุ"}, ensure_ascii=False)
 
-        results = {}
-        # ตรวจสอบว่า tickers ที่รับมาเป็น list หรือไม่ (กรณี yf.download ได้ ticker เดียว)
-        ticker_list = tickers if isinstance(tickers, list) else [tickers]
+        formatted = _format_table_result(
+            results, ["Date", "Open", "High", "Low", "Close", "Volume"], output_format, precision,
+            file_stem=_safe_file_stem("stocks", *ticker_list, period),
+        )
+        payload = json.dumps(formatted, default=str, ensure_ascii=False)
+        print(f"--- get_stock_price payload: {len(payload.encode('utf-8'))} bytes ({output_format}) ---")
+        return payload
+    except Exception as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
 
-        # จัดการกรณีที่ data มี column level เดียว (เมื่อได้ ticker เดียว)
-        if not isinstance(data.columns, pd.MultiIndex):
-            data.columns.name = 'Date'
-            data = data.reset_index()
-            records = data[['Date', 'Open', 'High', 'Low', 'Close', 'Volume']].to_dict('records')
-            results[ticker_list[0]] = records
-        else: # กรณีได้หลาย tickers
-            for ticker in ticker_list:
-                ticker_data = data.loc[:, (slice(None), ticker)]
-                ticker_data.columns = ticker_data.columns.droplevel(1)
-
-                if ticker_data.empty:
-                    results[ticker] = {"error": "No data found for this specific ticker."}
-                    continue
+# ------------------- STOCK ANALYTICS -------------------
+
+TRADING_DAYS_PER_YEAR = 252
+# เกินจำนวนนี้จะคืนเฉพาะคู่ที่ correlation สูงสุด แทนเมทริกซ์เต็ม (เพื่อไม่ให้ผลลัพธ์ใหญ่เกินไป)
+CORRELATION_MATRIX_MAX_TICKERS = 10
+
+def _compute_stock_analytics(close: pd.DataFrame, volume: pd.DataFrame, ma_windows: list[int],
+                             rsi_period: int = 14) -> dict:
+    """คำนวณตัวชี้วัดของทุก ticker พร้อมกันแบบ vectorized (แต่ละคอลัมน์คือหนึ่ง ticker)"""
+    returns = close.pct_change(fill_method=None)
+    log_returns = np.log(close).diff()
+
+    summary = pd.DataFrame(index=close.columns)
+    summary["last_close"] = close.ffill().iloc[-1]
+    summary["total_return_pct"] = (close.ffill().iloc[-1] / close.bfill().iloc[0] - 1) * 100
+    summary["ann_volatility_pct"] = log_returns.std() * np.sqrt(TRADING_DAYS_PER_YEAR) * 100
+    summary["max_drawdown_pct"] = (close / close.cummax() - 1).min() * 100
+    summary["best_day_pct"] = returns.max() * 100
+    summary["worst_day_pct"] = returns.min() * 100
+    summary["avg_volume"] = volume.mean()
 
-                df = ticker_data.reset_index()
-                records = df[['Date', 'Open', 'High', 'Low', 'Close', 'Volume']].to_dict('records')
-                results[ticker] = records
+    for window in ma_windows:
+        sma = close.rolling(window, min_periods=window).mean().iloc[-1]
+        summary[f"sma_{window}"] = sma
+        summary[f"pct_vs_sma_{window}"] = (summary["last_close"] / sma - 1) * 100
 
-        return json.dumps(results, default=str, ensure_ascii=False)
+    # RSI แบบ Wilder (EMA ของกำไร/ขาดทุนรายวัน)
+    delta = close.diff()
+    avg_gain = delta.clip(lower=0).ewm(alpha=1 / rsi_period, adjust=False).mean()
+    avg_loss = (-delta.clip(upper=0)).ewm(alpha=1 / rsi_period, adjust=False).mean()
+    summary[f"rsi_{rsi_period}"] = (100 - 100 / (1 + avg_gain / avg_loss)).iloc[-1]
+
+    result = {
+        "start": close.index[0].strftime("%Y-%m-%d"),
+        "end": close.index[-1].strftime("%Y-%m-%d"),
+        "bars": len(close),
+        "summary": summary.round(2).replace({np.nan: None}).to_dict("index"),
+    }
+
+    correlation = returns.corr()
+    if len(close.columns) <= CORRELATION_MATRIX_MAX_TICKERS:
+        result["correlation"] = correlation.round(3).replace({np.nan: None}).to_dict("index")
+    elif len(close.columns) > 1:
+        upper = correlation.where(np.triu(np.ones(correlation.shape, dtype=bool), k=1)).stack()
+        top = upper.sort_values(ascending=False).head(CORRELATION_MATRIX_MAX_TICKERS)
+        result["top_correlated_pairs"] = [
+            {"pair": [a, b], "correlation": round(float(value), 3)} for (a, b), value in top.items()
+        ]
+    return result
+
+@mcp.tool()
+@_in_thread
+def analyze_stocks(tickers: list[str], period: str = "6mo", ma_windows: list[int] = None) -> str:
+    """
+    วิเคราะห์หุ้นหลายตัวพร้อมกันในครั้งเดียว และคืน "สรุปตัวเลข" แทนข้อมูลดิบรายวัน
+    ได้แก่ ผลตอบแทน, ความผันผวนรายปี, max drawdown, เส้นค่าเฉลี่ย (SMA), RSI และ correlation ระหว่างหุ้น
+    Args:
+        tickers (list[str]): ลิสต์ของสัญลักษณ์หุ้น เช่น ['NVDA', 'AAPL', 'MSFT'].
+        period (str): ช่วงเวลาที่ใช้วิเคราะห์ (e.g., '3mo', '6mo', '1y').
+        ma_windows (list[int]): ความยาวของเส้นค่าเฉลี่ย (default=[20, 50]).
+    """
+    print(f"--- Analyzing {len(tickers)} tickers over {period} ---")
+    try:
+        close, volume = market_data.get_panel(tickers, period)
+        if close.empty:
+            return json.dumps({"error": "ไม่พบข้อมูลสำหรับ tickers ที่ระบุ"}, ensure_ascii=False)
+        result = _compute_stock_analytics(close, volume, ma_windows or [20, 50])
+        missing = sorted({t.strip().upper() for t in tickers} - set(close.columns))
+        if missing:
+            result["missing_tickers"] = missing
+        return json.dumps(result, ensure_ascii=False)
     except Exception as e:
         return json.dumps({"error": str(e)}, ensure_ascii=False)
 
@@ -254,41 +1955,648 @@ def get_current_date() -> str:
 # ------------------- FILE TOOLS -------------------
 
 def _get_safe_path(filename: str) -> str | None:
-    # ป้องกันการเข้าถึงไฟล์นอก workspace (e.g., "../secret.txt")
-    if ".." in filename or "/" in filename or "\\" in filename:
+    # รับชื่อไฟล์แบบ path ย่อยใน workspace ได้ (เช่น "reports/q3.csv" ตามที่ workspace_index คืนมา)
+    # แต่ป้องกันการเข้าถึงไฟล์นอก workspace (e.g., "../secret.txt", "/etc/passwd" หรือ symlink ที่ชี้ออกไปข้างนอก)
+    if not filename:
+        return None
+    relative = os.path.normpath(filename.replace("\\", "/"))
+    if os.path.isabs(relative) or os.path.splitdrive(relative)[0] or relative == "." or relative.split(os.sep)[0] == "..":
         return None
-    return os.path.join(WORKSPACE_DIR, filename)
+    path = os.path.join(WORKSPACE_DIR, relative)
+    root = os.path.realpath(WORKSPACE_DIR)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        return None
+    return path
+
+def _open_for_write(path: str, mode: str, compress: bool):
+    """เปิดไฟล์แบบ text (utf-8) ถ้า compress จะเขียนเป็น gzip (append ได้เพราะ gzip ต่อหลาย member ได้)"""
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _temp_path_for(safe_path: str) -> str:
+    """ไฟล์ชั่วคราวในโฟลเดอร์เดียวกัน (os.replace จึง atomic) ชื่อขึ้นต้นด้วย "." เพื่อไม่ให้โผล่ใน workspace index"""
+    directory, name = os.path.split(safe_path)
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.part")
+
 
 @mcp.tool()
-def write_to_file(filename: str, content: str) -> str:
-    """เขียนเนื้อหาลงไฟล์ใน workspace ที่ปลอดภัย. Args: filename (str), content (str)"""
+@_in_thread
+def write_to_file(filename: str, content: str, mode: str = "overwrite", compress: bool = False) -> str:
+    """
+    เขียนเนื้อหาลงไฟล์ใน workspace ที่ปลอดภัย. Args: filename (str, ใส่โฟลเดอร์ย่อยได้ เช่น "reports/q3.md"), content (str)
+    mode: "overwrite" (default, เขียนลงไฟล์ชั่วคราวแล้วสลับแทนที่แบบ atomic) หรือ "append" (ต่อท้ายไฟล์เดิม)
+    compress=True จะเขียนเป็น gzip และเติม .gz ให้ชื่อไฟล์ถ้ายังไม่มี
+    """
+    if mode not in ("overwrite", "append"):
+        return json.dumps({"error": "mode must be 'overwrite' or 'append'."})
+    if compress and not filename.endswith(".gz"):
+        filename += ".gz"
     safe_path = _get_safe_path(filename)
     if not safe_path:
         return json.dumps({"error": "Invalid filename. Path traversal not allowed."})
     
     try:
-        with open(safe_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        return json.dumps({"success": f"File '{filename}' written successfully."})
+        os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+        if mode == "append":
+            with _open_for_write(safe_path, "a", compress) as f:
+                f.write(content)
+        else:
+            temp_path = _temp_path_for(safe_path)
+            try:
+                with _open_for_write(temp_path, "w", compress) as f:
+                    f.write(content)
+                os.replace(temp_path, safe_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        workspace_index.invalidate()
+        return json.dumps({"success": f"File '{filename}' written successfully.", "bytes": os.path.getsize(safe_path)})
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+
+# --- Chunked Writes ---
+# สถานะของการเขียนทีละ chunk อยู่ใน process นี้ (agent ส่ง tool นี้ไปที่ worker เดียวกันเสมอ)
+WRITE_HANDLE_TTL = float(os.getenv("WRITE_HANDLE_TTL", "1800"))
+_write_sessions: dict[str, dict] = {}
+_write_sessions_lock = threading.Lock()
+
+
+def _discard_write_session(session: dict):
+    """ทิ้งสิ่งที่เขียนไปแล้วของ handle: ลบไฟล์ชั่วคราว หรือถ้าเป็น append ก็ตัดไฟล์เดิมกลับเป็นขนาดก่อนเริ่ม"""
+    session["file"].close()
+    if session["temp_path"] != session["safe_path"]:
+        if os.path.exists(session["temp_path"]):
+            os.remove(session["temp_path"])
+    elif os.path.exists(session["safe_path"]):
+        os.truncate(session["safe_path"], session["original_size"])
+
+
+def _expire_write_sessions():
+    """ทิ้ง handle ที่ไม่ถูกใช้นานเกิน WRITE_HANDLE_TTL (ต้องถือ lock อยู่)"""
+    now = time.monotonic()
+    for handle, session in list(_write_sessions.items()):
+        if now - session["touched_at"] > WRITE_HANDLE_TTL:
+            _discard_write_session(session)
+            del _write_sessions[handle]
+
+
+@mcp.tool()
+@_in_thread
+def write_chunk(content: str, handle: str = None, filename: str = None, final: bool = False,
+                append: bool = False, compress: bool = False, abort: bool = False) -> str:
+    """
+    เขียนไฟล์ขนาดใหญ่ทีละส่วน โดยส่งเฉพาะข้อมูลใหม่ในแต่ละครั้ง
+    ครั้งแรก: ระบุ filename (ไม่ต้องมี handle) จะได้ handle กลับมา
+    ครั้งถัดไป: ส่ง handle เดิมพร้อม content ส่วนต่อไป และใส่ final=True ในส่วนสุดท้าย
+    ไฟล์จะปรากฏใน workspace เมื่อ final=True เท่านั้น (สลับแทนที่แบบ atomic)
+    append=True จะต่อท้ายไฟล์เดิมแทนการเขียนทับ, compress=True เขียนเป็น gzip
+    abort=True (พร้อม handle) ยกเลิกการเขียน ทิ้งทุกส่วนที่ส่งมาและไฟล์เดิมไม่เปลี่ยน
+    """
+    try:
+        with _write_sessions_lock:
+            _expire_write_sessions()
+            if handle:
+                session = _write_sessions.get(handle)
+                if not session:
+                    return json.dumps({"error": f"Unknown or expired handle '{handle}'."})
+                if abort:
+                    del _write_sessions[handle]
+                    _discard_write_session(session)
+                    return json.dumps({"success": f"Write to '{session['filename']}' aborted.", "handle": handle})
+            elif abort:
+                return json.dumps({"error": "Provide the handle of the write to abort."})
+            else:
+                if not filename:
+                    return json.dumps({"error": "Provide a filename to start a new write, or a handle to continue one."})
+                if compress and not filename.endswith(".gz"):
+                    filename += ".gz"
+                safe_path = _get_safe_path(filename)
+                if not safe_path:
+                    return json.dumps({"error": "Invalid filename. Path traversal not allowed."})
+                os.makedirs(os.path.dirname(safe_path), exist_ok=True)
+                if append and os.path.exists(safe_path):
+                    # append: เขียนต่อท้ายไฟล์ตรงๆ (O(ข้อมูลใหม่)) ไม่ต้องคัดลอกไฟล์เดิม
+                    temp_path, write_mode = safe_path, "a"
+                else:
+                    temp_path, write_mode = _temp_path_for(safe_path), "w"
+                handle = f"write:{uuid.uuid4().hex}"
+                session = {
+                    "filename": filename,
+                    "safe_path": safe_path,
+                    "temp_path": temp_path,
+                    "original_size": os.path.getsize(safe_path) if write_mode == "a" else 0,
+                    "file": _open_for_write(temp_path, write_mode, compress),
+                    "written": 0,
+                }
+                _write_sessions[handle] = session
+            session["touched_at"] = time.monotonic()
+
+            session["file"].write(content)
+            session["written"] += len(content)
+            if not final:
+                session["file"].flush()
+                return json.dumps({"handle": handle, "filename": session["filename"], "chars_written": session["written"]})
+
+            del _write_sessions[handle]
+        session["file"].close()
+        if session["temp_path"] != session["safe_path"]:
+            os.replace(session["temp_path"], session["safe_path"])
+        workspace_index.invalidate()
+        return json.dumps({
+            "success": f"File '{session['filename']}' written successfully.",
+            "chars_written": session["written"],
+            "bytes": os.path.getsize(session["safe_path"]),
+        })
     except Exception as e:
         return json.dumps({"error": str(e)})
 
+# แคชเนื้อหาไฟล์ในหน่วยความจำ (ตรวจความสดด้วย mtime + size) เพื่อให้การอ่านทีละ chunk ไม่ต้องอ่านไฟล์ใหม่ทุกครั้ง
+FILE_TEXT_CACHE_ENTRIES = 32
+_file_text_cache: "OrderedDict[str, tuple[int, int, str]]" = OrderedDict()
+_file_text_cache_lock = threading.Lock()
+
+def _read_workspace_text(safe_path: str) -> str:
+    file_stat = os.stat(safe_path)
+    with _file_text_cache_lock:
+        cached = _file_text_cache.get(safe_path)
+        if cached and cached[0] == file_stat.st_mtime_ns and cached[1] == file_stat.st_size:
+            _file_text_cache.move_to_end(safe_path)
+            return cached[2]
+    opener = gzip.open if safe_path.endswith(".gz") else open
+    with opener(safe_path, 'rt', encoding='utf-8') as f:
+        content = f.read()
+    with _file_text_cache_lock:
+        _file_text_cache[safe_path] = (file_stat.st_mtime_ns, file_stat.st_size, content)
+        _file_text_cache.move_to_end(safe_path)
+        while len(_file_text_cache) > FILE_TEXT_CACHE_ENTRIES:
+            _file_text_cache.popitem(last=False)
+    return content
+
 @mcp.tool()
-def read_from_file(filename: str) -> str:
-    """อ่านเนื้อหาจากไฟล์ใน workspace ที่ปลอดภัย. Args: filename (str)"""
+@_in_thread
+def read_from_file(filename: str, offset: int = 0, length: int = CHUNK_DEFAULT_LENGTH) -> str:
+    """
+    อ่านเนื้อหาจากไฟล์ใน workspace ที่ปลอดภัยทีละ chunk. Args: filename (str), offset (int), length (int)
+    ถ้า next_offset ไม่เป็น null ให้อ่านส่วนถัดไปด้วย read_chunk(handle, next_offset)
+    """
+    return _read_file_chunk(filename, offset, length)
+
+def _read_file_chunk(filename: str, offset: int, length: int) -> str:
     safe_path = _get_safe_path(filename)
     if not safe_path:
         return json.dumps({"error": "Invalid filename. Path traversal not allowed."})
     
     try:
-        with open(safe_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return json.dumps({"content": content})
+        if os.path.splitext(filename)[1].lower() in _PAGED_DOCUMENT_TYPES:
+            return json.dumps(_read_document_chunk(safe_path, filename, offset, length), ensure_ascii=False)
+        content = _read_workspace_text(safe_path)
+        return json.dumps(_chunk_response(f"file:{filename}", content, offset, length, filename=filename), ensure_ascii=False)
     except FileNotFoundError:
         return json.dumps({"error": f"File '{filename}' not found."})
     except Exception as e:
         return json.dumps({"error": str(e)})
 
+# ------------------- DOCUMENT PIPELINE -------------------
+
+# ข้อความที่ extract แล้วเก็บเป็นรายหน้าใน SQLite โดยใช้ hash ของไฟล์เป็น key (path + mtime ใช้ข้ามการ hash ซ้ำ)
+DOCUMENT_CACHE_PATH = os.path.join(CACHE_DIR, "documents.sqlite3")
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", "4"))
+DOCUMENT_PROCESSES = os.getenv("DOCUMENT_PROCESSES", "true").lower() == "true"
+DOCUMENT_PAGE_CHARS = int(os.getenv("DOCUMENT_PAGE_CHARS", "4000"))  # ขนาด "หน้า" ของไฟล์ที่ไม่มีหน้า (docx/csv/md)
+_DOCUMENT_TYPES = {".pdf", ".docx", ".csv", ".md", ".markdown", ".txt"}
+_PAGED_DOCUMENT_TYPES = {".pdf", ".docx"}  # ไฟล์ที่ไม่ใช่ข้อความธรรมดา read_from_file ต้องผ่าน pipeline
+
+
+def _iter_text_pages(path: str, start_page: int):
+    """แบ่งไฟล์ข้อความ (csv/md/txt) เป็นหน้าตามบรรทัด โดยไม่ตัดกลางบรรทัด/แถว"""
+    page_no, lines, size = 0, [], 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= DOCUMENT_PAGE_CHARS:
+                if page_no >= start_page:
+                    yield page_no, "".join(lines)
+                page_no, lines, size = page_no + 1, [], 0
+    if lines and page_no >= start_page:
+        yield page_no, "".join(lines)
+
+
+def _iter_docx_pages(path: str, start_page: int):
+    document = docx.Document(path)
+    blocks = [p.text for p in document.paragraphs if p.text.strip()]
+    for table in document.tables:
+        blocks.extend(" | ".join(cell.text.strip() for cell in row.cells) for row in table.rows)
+    page_no, current, size = 0, [], 0
+    for block in blocks:
+        current.append(block)
+        size += len(block) + 1
+        if size >= DOCUMENT_PAGE_CHARS:
+            if page_no >= start_page:
+                yield page_no, "\n".join(current) + "\n"
+            page_no, current, size = page_no + 1, [], 0
+    if current and page_no >= start_page:
+        yield page_no, "\n".join(current) + "\n"
+
+
+def _iter_pdf_pages(path: str, start_page: int):
+    reader = pypdf.PdfReader(path)
+    for page_no in range(start_page, len(reader.pages)):
+        yield page_no, (reader.pages[page_no].extract_text() or "") + "\n"
+
+
+def _extract_pages(path: str, start_page: int = 0):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        return _iter_pdf_pages(path, start_page)
+    if extension == ".docx":
+        return _iter_docx_pages(path, start_page)
+    return _iter_text_pages(path, start_page)
+
+
+def _extract_document(path: str) -> list[str]:
+    """extract ทุกหน้าของเอกสาร (รันใน worker process ของ ingest_documents)"""
+    return [text for _, text in _extract_pages(path)]
+
+
+# pypdf/python-docx เป็น pure Python ถือ GIL ตลอด การ extract หลายไฟล์ด้วย thread จึงใช้ได้แค่ CPU เดียว
+# ใช้ fork เพราะ spawn จะรัน server.py ใหม่ทั้งไฟล์ (Chroma, MCP) ในทุก worker ระบบที่ไม่มี fork (Windows) ใช้ thread ตามเดิม
+_document_process_pool: ProcessPoolExecutor | None = None
+_document_process_pool_lock = threading.Lock()
+
+
+def _document_pool() -> ProcessPoolExecutor | None:
+    global _document_process_pool
+    if not DOCUMENT_PROCESSES or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    with _document_process_pool_lock:
+        if _document_process_pool is None:
+            _document_process_pool = ProcessPoolExecutor(max_workers=DOCUMENT_WORKERS,
+                                                         mp_context=multiprocessing.get_context("fork"))
+            atexit.register(_document_process_pool.shutdown, cancel_futures=True)
+        return _document_process_pool
+
+
+def _extract_document_in_pool(path: str) -> list[str]:
+    global _document_process_pool
+    pool = _document_pool()
+    if pool is None:
+        return _extract_document(path)
+    try:
+        return pool.submit(_extract_document, path).result()
+    except BrokenProcessPool:
+        # worker ตาย (เช่น ไฟล์เสียจนกินหน่วยความจำ) ทิ้ง pool นี้ ครั้งถัดไปจะสร้างใหม่
+        with _document_process_pool_lock:
+            if _document_process_pool is pool:
+                _document_process_pool = None
+        raise
+
+
+class DocumentTextCache:
+    """
+    แคชข้อความที่ extract จากเอกสารเป็นรายหน้า: pages() จะคืนหน้าที่มีในแคชก่อน แล้ว extract ต่อจากหน้าที่ค้างไว้
+    ผู้เรียกหยุดอ่านกลางทางได้ (เช่น อ่านแค่ chunk แรกของ PDF ขนาดใหญ่) หน้าที่ extract แล้วยังถูกเก็บไว้
+    """
+
+    def __init__(self, path: str = DOCUMENT_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, hash TEXT);
+            CREATE TABLE IF NOT EXISTS documents (hash TEXT PRIMARY KEY, page_count INTEGER, extracted_at REAL);
+            CREATE TABLE IF NOT EXISTS pages (hash TEXT, page INTEGER, text TEXT, PRIMARY KEY (hash, page));
+        """)
+
+    def file_hash(self, path: str) -> str:
+        file_stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash FROM files WHERE path = ? AND mtime_ns = ? AND size = ?",
+                (path, file_stat.st_mtime_ns, file_stat.st_size),
+            ).fetchone()
+        if row:
+            return row[0]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        file_hash = digest.hexdigest()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path, file_stat.st_mtime_ns, file_stat.st_size, file_hash),
+            )
+            self._conn.commit()
+        return file_hash
+
+    def page_count(self, file_hash: str) -> int | None:
+        """จำนวนหน้าทั้งหมด (None ถ้ายัง extract ไม่ครบ)"""
+        with self._lock:
+            row = self._conn.execute("SELECT page_count FROM documents WHERE hash = ?", (file_hash,)).fetchone()
+        return row[0] if row else None
+
+    def store(self, file_hash: str, texts: list[str]):
+        """เก็บเอกสารที่ extract ครบทุกหน้าแล้วใน transaction เดียว"""
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                                   [(file_hash, page_no, text) for page_no, text in enumerate(texts)])
+            self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?)", (file_hash, len(texts), time.time()))
+            self._conn.commit()
+
+    def pages(self, path: str):
+        """yield (page_no, text) ทีละหน้า"""
+        file_hash = self.file_hash(path)
+        next_page = 0
+        while True:
+            with self._lock:
+                cached = self._conn.execute(
+                    "SELECT page, text FROM pages WHERE hash = ? AND page >= ? ORDER BY page LIMIT 64",
+                    (file_hash, next_page),
+                ).fetchall()
+            if not cached or cached[0][0] != next_page:
+                break
+            for page_no, text in cached:
+                if page_no != next_page:
+                    break
+                yield page_no, text
+                next_page += 1
+        if self.page_count(file_hash) is not None:
+            return
+        for page_no, text in _extract_pages(path, next_page):
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (file_hash, page_no, text))
+                self._conn.commit()
+            yield page_no, text
+            next_page = page_no + 1
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?)", (file_hash, next_page, time.time()))
+            self._conn.commit()
+
+
+document_cache = DocumentTextCache()
+
+
+def _read_document_chunk(safe_path: str, filename: str, offset: int, length: int) -> dict:
+    """
+    อ่าน chunk ของเอกสาร (PDF/DOCX) โดย extract เฉพาะหน้าที่จำเป็นต้องใช้ถึง offset + length
+    total_length จะเป็น None ถ้ายังไม่ได้ extract ทั้งเอกสาร
+    """
+    offset = max(0, offset)
+    length = max(1, min(length, CHUNK_MAX_LENGTH))
+    parts, size, last_page = [], 0, -1
+    pages = document_cache.pages(safe_path)
+    for page_no, text in pages:
+        parts.append(text)
+        size += len(text)
+        last_page = page_no
+        if size > offset + length:
+            pages.close()
+            break
+    text = "".join(parts)
+    page_count = document_cache.page_count(document_cache.file_hash(safe_path))
+    complete = page_count is not None and last_page + 1 >= page_count
+    chunk = text[offset:offset + length]
+    next_offset = offset + len(chunk)
+    return {
+        "filename": filename,
+        "handle": f"file:{filename}",
+        "content": chunk,
+        "offset": offset,
+        "total_length": len(text) if complete else None,
+        "page_count": page_count,
+        "next_offset": None if complete and next_offset >= len(text) else next_offset,
+    }
+
+
+def _chunk_for_memory(text: str, chunk_chars: int, overlap: int) -> list[str]:
+    """ตัดข้อความเป็นชิ้นสำหรับบันทึกเป็น memory โดยพยายามตัดที่ขึ้นบรรทัดใหม่/ช่องว่าง"""
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            cut = max(text.rfind("\n", start + chunk_chars // 2, end), text.rfind(" ", start + chunk_chars // 2, end))
+            if cut > start:
+                end = cut
+        piece = text[start:end].strip()
+        if piece:
+            chunks.append(piece)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def _ingest_document(name: str, index_to_memory: bool, chunk_chars: int) -> dict:
+    path = os.path.join(WORKSPACE_DIR, name)
+    started = time.perf_counter()
+    file_hash = document_cache.file_hash(path)
+    cached_before = document_cache.page_count(file_hash) is not None
+    if cached_before or os.path.splitext(name)[1].lower() not in _PAGED_DOCUMENT_TYPES:
+        extracted = document_cache.pages(path)
+    else:
+        # PDF/DOCX ที่ยังไม่อยู่ในแคช: extract ทั้งไฟล์ใน worker process แล้วเก็บลงแคชทีเดียว
+        texts = _extract_document_in_pool(path)
+        document_cache.store(file_hash, texts)
+        extracted = enumerate(texts)
+    pages = chars = memories = 0
+    for page_no, text in extracted:
+        pages += 1
+        chars += len(text)
+        if index_to_memory:
+            for piece in _chunk_for_memory(text, chunk_chars, chunk_chars // 10):
+                memory_buffer.add(piece, {"source": name, "workspace_file": name, "page": page_no + 1})
+                memories += 1
+    return {
+        "filename": name,
+        "pages": pages,
+        "chars": chars,
+        "memory_chunks": memories,
+        "cached": cached_before,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+@mcp.tool()
+@_in_thread
+def ingest_documents(filenames: list[str] = None, pattern: str = None, index_to_memory: bool = False,
+                     chunk_chars: int = 1500) -> str:
+    """
+    extract ข้อความจากเอกสารใน workspace (PDF, DOCX, CSV, Markdown, TXT) แบบขนานหลาย process และเก็บผลไว้ในแคช
+    Args:
+        filenames (list[str]): ชื่อไฟล์ที่ต้องการ (ไม่บังคับ)
+        pattern (str): glob เช่น "*.pdf" หรือ "reports/*" (ถ้าไม่ระบุทั้งสองอย่าง จะทำทุกเอกสารใน workspace)
+        index_to_memory (bool): True = ตัดเป็นชิ้นขนาด chunk_chars แล้วบันทึกลงความจำระยะยาวด้วย
+    """
+    print(f"--- Ingesting documents (pattern={pattern}, files={filenames}) ---")
+    try:
+        listing = workspace_index.list(pattern=pattern, names=filenames,
+                                       extensions=[ext.lstrip(".") for ext in _DOCUMENT_TYPES], limit=100000)
+        names = [f["filename"] for f in listing["files"]]
+        missing = sorted(set(filenames or []) - set(names))
+        started = time.perf_counter()
+        results, errors = [], [{"filename": name, "error": "Not found or unsupported type."} for name in missing]
+        with ThreadPoolExecutor(max_workers=DOCUMENT_WORKERS) as pool:
+            futures = {pool.submit(_ingest_document, name, index_to_memory, max(200, chunk_chars)): name for name in names}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    errors.append({"filename": futures[future], "error": str(e)})
+        if index_to_memory:
+            memory_buffer.flush()
+        elapsed = time.perf_counter() - started
+        total_chars = sum(r["chars"] for r in results)
+        return json.dumps({
+            "documents": sorted(results, key=lambda r: r["filename"]),
+            "errors": errors,
+            "total_pages": sum(r["pages"] for r in results),
+            "total_memory_chunks": sum(r["memory_chunks"] for r in results),
+            "elapsed_seconds": round(elapsed, 3),
+            "docs_per_second": round(len(results) / elapsed, 2) if elapsed else None,
+            "chars_per_second": round(total_chars / elapsed) if elapsed else None,
+        }, ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({"error": f"Failed to ingest documents: {str(e)}"})
+
+# ------------------- WORKSPACE SEARCH -------------------
+
+# full-text index (SQLite FTS5) ของทุกบรรทัดในไฟล์ workspace รวมข้อความที่ extract จาก PDF/DOCX
+# ใช้ tokenizer แบบ trigram จึงค้นภาษาไทย (ไม่มีช่องว่างคั่นคำ) และคำบางส่วนได้ แต่คำค้นต้องยาวอย่างน้อย 3 ตัวอักษร
+WORKSPACE_SEARCH_PATH = os.path.join(CACHE_DIR, "workspace_fts.sqlite3")
+WORKSPACE_SEARCH_MAX_FILE_MB = float(os.getenv("WORKSPACE_SEARCH_MAX_FILE_MB", "20"))
+
+
+class WorkspaceSearchIndex:
+    """
+    index แบบ incremental: ก่อนค้นหาทุกครั้งจะเทียบ size/mtime กับ WorkspaceIndex
+    แล้ว index ใหม่เฉพาะไฟล์ที่เพิ่ม/แก้ไข และลบไฟล์ที่หายไปออก
+    """
+
+    def __init__(self, path: str = WORKSPACE_SEARCH_PATH, max_file_bytes: int = int(WORKSPACE_SEARCH_MAX_FILE_MB * 1024 * 1024)):
+        self.max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER, mtime REAL, first_row INTEGER, last_row INTEGER);
+            CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5(name UNINDEXED, line UNINDEXED, text, tokenize='trigram');
+        """)
+
+    def _file_lines(self, name: str):
+        path = os.path.join(WORKSPACE_DIR, name)
+        if os.path.splitext(name)[1].lower() in _PAGED_DOCUMENT_TYPES:
+            text = "".join(page for _, page in document_cache.pages(path))
+            return text.splitlines()
+        with open(path, "rb") as f:
+            if b"\0" in f.read(8192):
+                return []  # ไฟล์ binary (รูปภาพ, gzip ฯลฯ) ไม่ต้อง index
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read().splitlines()
+
+    def _delete_locked(self, name: str):
+        row = self._conn.execute("SELECT first_row, last_row FROM files WHERE name = ?", (name,)).fetchone()
+        if row and row[1] >= row[0]:
+            self._conn.execute("DELETE FROM lines WHERE rowid BETWEEN ? AND ?", row)
+
+    def sync(self) -> int:
+        """อัปเดต index ให้ตรงกับ workspace คืนจำนวนไฟล์ที่ index ใหม่"""
+        current = workspace_index.snapshot()
+        with self._lock:
+            indexed = {name: (size, mtime) for name, size, mtime in self._conn.execute("SELECT name, size, mtime FROM files")}
+        removed = [name for name in indexed if name not in current]
+        changed = [
+            info for name, info in current.items()
+            if indexed.get(name) != (info["size"], info["mtime"])
+        ]
+        # commit เป็นชุดละหลายไฟล์ (การ index ครั้งแรกของ workspace ใหญ่จะเร็วกว่าการ commit ทีละไฟล์มาก)
+        for i in range(0, len(changed), 200):
+            batch = []
+            for info in changed[i:i + 200]:
+                try:
+                    lines = self._file_lines(info["filename"]) if info["size"] <= self.max_file_bytes else []
+                except Exception as e:
+                    print(f"!!! WARNING: cannot index '{info['filename']}': {e} !!!")
+                    lines = []
+                batch.append((info, lines))
+            with self._lock:
+                with self._conn:
+                    # จอง write lock ของไฟล์ DB ก่อนอ่าน rowid ล่าสุด (หลาย process อาจ sync DB เดียวกันพร้อมกัน)
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    for info, lines in batch:
+                        name = info["filename"]
+                        self._delete_locked(name)
+                        # บรรทัดของไฟล์เดียวกันได้ rowid ติดกัน จึงลบทั้งไฟล์ด้วยช่วง rowid ได้เร็ว (name เป็น UNINDEXED)
+                        first_row = (self._conn.execute("SELECT rowid FROM lines ORDER BY rowid DESC LIMIT 1").fetchone() or (0,))[0] + 1
+                        rows = [(first_row + i, name, number, text) for i, (number, text) in
+                                enumerate((n, t) for n, t in enumerate(lines, start=1) if t.strip())]
+                        self._conn.executemany("INSERT INTO lines (rowid, name, line, text) VALUES (?, ?, ?, ?)", rows)
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                            (name, info["size"], info["mtime"], first_row, first_row + len(rows) - 1),
+                        )
+        if removed:
+            with self._lock:
+                with self._conn:
+                    for name in removed:
+                        self._delete_locked(name)
+                        self._conn.execute("DELETE FROM files WHERE name = ?", (name,))
+        return len(changed)
+
+    def search(self, query: str, pattern: str = None, limit: int = 20, match_all: bool = True) -> list[dict]:
+        terms = [term for term in query.split() if len(term) >= 3]
+        if not terms:
+            return []
+        # ครอบทุกคำด้วย "..." เพื่อไม่ให้อักขระพิเศษถูกตีความเป็น syntax ของ FTS5
+        fts_query = (" AND " if match_all else " OR ").join('"' + term.replace('"', '""') + '"' for term in terms)
+        sql = ("SELECT name, line, snippet(lines, 2, '**', '**', '…', 16), bm25(lines) FROM lines "
+               "WHERE lines MATCH ?")
+        params: list = [fts_query]
+        if pattern:
+            # "+name" บังคับให้ SQLite กรองเองทีละแถว (ถ้าไม่มี FTS5 trigram จะรับ GLOB ไปตีความเองและไม่ตรง)
+            sql += " AND +name GLOB ?"
+            params.append(pattern)
+        sql += " ORDER BY bm25(lines) LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {"filename": name, "line": line, "snippet": snippet, "score": round(-score, 3)}
+            for name, line, snippet, score in rows
+        ]
+
+
+workspace_search_index = WorkspaceSearchIndex()
+
+@mcp.tool()
+@_in_thread
+def search_workspace(query: str, pattern: str = None, limit: int = 20, match_all: bool = True) -> str:
+    """
+    ค้นหาข้อความในทุกไฟล์ของ workspace (รวม PDF/DOCX) แล้วคืนชื่อไฟล์ เลขบรรทัด และ snippet เรียงตามความเกี่ยวข้อง
+    Args:
+        query (str): คำค้นหา (แต่ละคำต้องยาวอย่างน้อย 3 ตัวอักษร)
+        pattern (str): จำกัดเฉพาะไฟล์ที่ตรงกับ glob เช่น "*.md" (ไม่บังคับ)
+        limit (int): จำนวนผลลัพธ์สูงสุด (default=20)
+        match_all (bool): True = ต้องมีทุกคำ, False = มีคำใดคำหนึ่ง
+    """
+    print(f"--- Searching workspace for: '{query}' ---")
+    if not any(len(term) >= 3 for term in query.split()):
+        return json.dumps({"error": "Query terms must be at least 3 characters long."})
+    try:
+        started = time.perf_counter()
+        reindexed = workspace_search_index.sync()
+        results = workspace_search_index.search(query, pattern, max(1, min(limit, 200)), match_all)
+        return json.dumps({
+            "results": results,
+            "reindexed_files": reindexed,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }, ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({"error": f"Failed to search workspace: {str(e)}"})
+
 # ------------------- REAL GUI CONTROL TOOLS (EXTREME CAUTION REQUIRED) -------------------
 
 # Safety flag - GUI control is DISABLED by default for security
@@ -298,6 +2606,7 @@ if not GUI_CONTROL_ENABLED:
     print("WARNING: GUI control tools are DISABLED. Set ENABLE_GUI_CONTROL=true to enable (HIGH RISK)")
 
 @mcp.tool()
+@_in_thread
 def see_screen() -> str:
     """
     วิเคราะห์หน้าจอปัจจุบันและอธิบายองค์ประกอบที่เห็น
@@ -332,6 +2641,7 @@ def see_screen() -> str:
         return json.dumps({"error": f"Failed to analyze screen: {str(e)}"}, ensure_ascii=False)
 
 @mcp.tool()
+@_in_thread
 def mouse_move(x: int, y: int) -> str:
     """ย้ายเคอร์เซอร์เมาส์ไปยังพิกัด (x, y) บนหน้าจอ"""
     if not GUI_CONTROL_ENABLED:
@@ -347,6 +2657,7 @@ def mouse_move(x: int, y: int) -> str:
         return json.dumps({"error": str(e)})
 
 @mcp.tool()
+@_in_thread
 def mouse_click(x: int, y: int, button: str = 'left') -> str:
     """คลิกเมาส์ที่พิกัด (x, y) บนหน้าจอ"""
     if not GUI_CONTROL_ENABLED:
@@ -362,6 +2673,7 @@ def mouse_click(x: int, y: int, button: str = 'left') -> str:
         return json.dumps({"error": str(e)})
 
 @mcp.tool()
+@_in_thread
 def keyboard_type(text: str) -> str:
     """พิมพ์ข้อความด้วยคีย์บอร์ด"""
     if not GUI_CONTROL_ENABLED:
@@ -377,6 +2689,7 @@ def keyboard_type(text: str) -> str:
         return json.dumps({"error": str(e)})
 
 @mcp.tool()
+@_in_thread
 def execute_shell_command(command: str) -> str:
     """รันคำสั่งใน command line / terminal"""
     if not GUI_CONTROL_ENABLED:
@@ -401,4 +2714,8 @@ def execute_shell_command(command: str) -> str:
 # ------------------- MAIN EXECUTION BLOCK -------------------
 
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
\ No newline at end of file
+    # ไม่ควรรัน maintain-memory ขณะที่แอปเปิดอยู่ (Chroma ไม่รองรับหลาย process เขียนพร้อมกัน) ให้ใช้ tool maintain_memories แทน
+    if len(sys.argv) > 1 and sys.argv[1] == "maintain-memory":
+        _memory_maintenance_cli(sys.argv[2:])
+    else:
+        mcp.run(transport="stdio")
\ No newline at end of file
@@ -0,0 +1,207 @@
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+from contextlib import asynccontextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# server.py และ agent.py สร้าง workspace/, cache/ และ memory_db/ ใน cwd ตอน import
+# จึงให้ทั้ง test session รันในโฟลเดอร์ชั่วคราว ไม่แตะข้อมูลจริงของ repo
+os.chdir(tempfile.mkdtemp(prefix="cipher-tests-"))
+os.environ.setdefault("OPENROUTER_API_KEY", "test-key")
+os.environ.setdefault("TAVILY_API_KEY", "test-key")
+# test ยิง HTTP ไปที่ server จำลองบนเครื่องเท่านั้น ห้ามผ่าน proxy
+os.environ["NO_PROXY"] = "127.0.0.1,localhost"
+
+
+# ------------------- LOCAL HTTP SITE -------------------
+
+class LocalSite:
+    """
+    HTTP server จำลองบน 127.0.0.1 สำหรับ test แบบ offline
+    routes: {path: handler(request) -> (status, headers, body)} และบันทึก request ทุกตัวไว้ใน requests
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        site = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                site.requests.append({"method": method, "path": self.path, "headers": dict(self.headers), "body": body,
+                                      "client": self.client_address})
+                route = site.routes.get(self.path.split("?")[0])
+                status, headers, payload = route(self) if route else (404, {}, b"not found")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if isinstance(payload, (bytes, str)):
+                    payload = payload.encode("utf-8") if isinstance(payload, str) else payload
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                # payload เป็น iterable ของ bytes: ส่งแบบ chunked (ใช้จำลอง stream เช่น SSE)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for part in payload:
+                        self.wfile.write(f"{len(part):x}\r\n".encode() + part + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # client ตัด stream ทิ้งกลางทาง (ตั้งใจ) ไม่ใช่ error ของ server
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def local_site():
+    site = LocalSite()
+    yield site
+    site.close()
+
+
+# ------------------- FAKE MCP SERVER -------------------
+
+MCP_SPAWN_SECONDS = 0.1
+
+
+class FakeMCPSession:
+    """
+    แทน ClientSession ของ MCP (ไม่ต้อง spawn server.py จริง)
+    call_tool หน่วงเวลาตาม arguments["delay"] แล้วคืนชื่อ tool, arguments และ session ที่รัน
+    arguments["crash"] ทำให้ session "ตาย" หนึ่งครั้ง (เหมือน server process ล่ม)
+    """
+
+    def __init__(self, spawn_id: int, crashes: set):
+        self.spawn_id = spawn_id
+        self.crashes = crashes
+
+    async def call_tool(self, name, arguments=None, read_timeout_seconds=None):
+        arguments = arguments or {}
+        if arguments.get("crash") and not self.crashes:
+            self.crashes.add(self.spawn_id)
+            raise RuntimeError("server process died")
+        await asyncio.sleep(arguments.get("delay", 0))
+        payload = {"tool": name, "arguments": arguments, "spawn": self.spawn_id}
+        return SimpleNamespace(content=[SimpleNamespace(text=json.dumps(payload))])
+
+    async def send_ping(self):
+        return None
+
+
+@pytest.fixture
+def fake_mcp(monkeypatch):
+    """แทน agent._setup_mcp ด้วย session ปลอมที่ใช้เวลา spawn MCP_SPAWN_SECONDS และนับจำนวนครั้งที่ spawn"""
+    import agent
+
+    counter = itertools.count(1)
+    spawns = []
+    crashes = set()
+
+    @asynccontextmanager
+    async def _fake_setup_mcp():
+        spawn_id = next(counter)
+        spawns.append(spawn_id)
+        await asyncio.sleep(MCP_SPAWN_SECONDS)
+        yield FakeMCPSession(spawn_id, crashes)
+
+    monkeypatch.setattr(agent, "_setup_mcp", _fake_setup_mcp)
+    monkeypatch.setattr(agent, "MCP_RESPAWN_BACKOFF", 0.01)
+    return SimpleNamespace(setup=_fake_setup_mcp, spawns=spawns)
+
+
+@pytest.fixture
+def mcp_pool(fake_mcp, monkeypatch):
+    """MCPSessionPool ขนาด 2 บน session ปลอม และใช้แทน pool กลางของ agent ระหว่าง test"""
+    import agent
+
+    pool = agent.MCPSessionPool(size=2, call_timeout=5, health_interval=30)
+    monkeypatch.setattr(agent, "mcp_pool", pool)
+    yield pool
+    pool.close()
+
+
+# ------------------- MEMORY STORE -------------------
+
+class HashingEmbeddings:
+    """
+    embedding model ปลอมสำหรับ test (โมเดลจริงต้องดาวน์โหลด): vector จาก hash ของ token ตาม _keyword_tokens
+    ข้อความที่มีคำร่วมกันจึงใกล้กันจริง และนับจำนวนครั้ง/จำนวนข้อความที่ถูก embed
+    """
+
+    def __init__(self, dimensions: int = 64, delay: float = 0.0):
+        self.dimensions = dimensions
+        self.delay = delay
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, texts):
+        import time
+
+        import numpy as np
+        import server
+
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.delay)
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for token in server._keyword_tokens(text):
+                vector[int(server.hashlib.md5(token.encode("utf-8")).hexdigest(), 16) % self.dimensions] += 1.0
+            norm = np.linalg.norm(vector)
+            vectors.append(vector / norm if norm else vector)
+        return vectors
+
+
+@pytest.fixture
+def memory_store(tmp_path, monkeypatch):
+    """collection ความจำใหม่ของแต่ละ test (embedding ปลอม) ใช้แทน collection/index/buffer กลางของ server"""
+    from collections import OrderedDict
+
+    import chromadb
+    import server
+
+    model = HashingEmbeddings()
+    embeddings = server.CachedEmbeddingFunction(backend=model, path=os.fspath(tmp_path / "embeddings.sqlite3"))
+    client = chromadb.PersistentClient(path=os.fspath(tmp_path / "memory_db"))
+    collection = client.get_or_create_collection(name="memories", embedding_function=embeddings)
+    index = server.MemoryKeywordIndex(collection)
+    buffer = server.MemoryWriteBuffer(collection, flush_interval=3600, on_write=index.add)
+    monkeypatch.setattr(server, "embedding_function", embeddings)
+    monkeypatch.setattr(server, "memory_collection", collection)
+    monkeypatch.setattr(server, "memory_index", index)
+    monkeypatch.setattr(server, "memory_buffer", buffer)
+    monkeypatch.setattr(server, "_memory_query_cache", OrderedDict())
+    return SimpleNamespace(collection=collection, index=index, buffer=buffer, embeddings=embeddings, model=model)
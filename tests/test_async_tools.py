@@ -0,0 +1,73 @@
+import asyncio
+import json
+import time
+
+import agent
+
+
+def _run_chats(chats: int, make_call):
+    """รันหลายแชทพร้อมกันบน loop เดียว (แบบ Chainlit) พร้อมนับว่า loop ยังว่างทำงานอื่นได้แค่ไหน"""
+
+    async def _main():
+        ticks = 0
+        stop = asyncio.Event()
+
+        async def _ticker():
+            nonlocal ticks
+            while not stop.is_set():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(_ticker())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(make_call(chat) for chat in range(chats)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+        return results, elapsed, ticks
+
+    return asyncio.run(_main())
+
+
+def test_simulated_chats_await_tools_concurrently(mcp_pool):
+    chats, delay = 20, 0.2
+    mcp_pool.call("get_current_date", {})  # warm-up: ไม่นับเวลา spawn
+
+    results, elapsed, ticks = _run_chats(
+        chats, lambda chat: agent._arun_mcp_tool("browse_url", {"url": f"https://example.com/{chat}", "delay": delay})
+    )
+
+    assert [json.loads(result)["arguments"]["url"] for result in results] == [
+        f"https://example.com/{chat}" for chat in range(chats)
+    ]
+    # รันทีละตัวจะใช้ chats * delay = 4 วินาที
+    assert elapsed < chats * delay / 4
+    # loop ของแชทไม่ถูก block ระหว่างรอ tool
+    assert ticks >= elapsed / 0.01 / 3
+
+
+def test_langchain_tools_use_the_native_async_path(mcp_pool):
+    mcp_pool.call("get_current_date", {})
+
+    results, _, _ = _run_chats(
+        5, lambda chat: agent.browse_url.ainvoke({"url": f"https://example.com/{chat}", "main_content_only": True})
+    )
+
+    for chat, result in enumerate(results):
+        payload = json.loads(result)
+        assert payload["tool"] == "browse_url"
+        assert payload["arguments"] == {"url": f"https://example.com/{chat}", "main_content_only": True}
+    assert mcp_pool.stats()["calls"] == 6
+
+
+def test_sync_tool_wrappers_still_work_for_sync_callers(mcp_pool):
+    payload = json.loads(agent.browse_url.invoke({"url": "https://example.com/sync"}))
+    assert payload["arguments"]["url"] == "https://example.com/sync"
+
+
+def test_mcp_tools_are_built_from_both_paths():
+    assert agent.browse_url.func is agent.sync_browse_url
+    assert agent.browse_url.coroutine.__name__ == "browse_url"
+    assert agent.browse_url.name == "browse_url"
+    assert set(agent.browse_url.args) == {"url", "main_content_only"}
+    assert agent.browse_url.description.startswith("ใช้เครื่องมือนี้เมื่อต้องการเข้าไป")
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import agent
+
+
+class FakeSummarizer:
+    """llm ปลอมสำหรับสรุป: ตอบสรุปจากจำนวนครั้งที่ถูกเรียก หน่วงเวลาได้ และบันทึก prompt ที่ได้รับ"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.requests = []
+
+    def invoke(self, messages):
+        self.requests.append(messages)
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("summarizer is down")
+        return AIMessage(content=f"summary #{len(self.requests)}")
+
+
+def _turn(i: int, words: int = 3) -> list:
+    return [HumanMessage(content=f"question {i} " + "word " * words), AIMessage(content=f"answer {i}")]
+
+
+def _history(llm, **options) -> agent.SummarizingChatMessageHistory:
+    options = {"token_budget": 100_000, "keep_turns": 4, "offload_to_memory": False, **options}
+    return agent.SummarizingChatMessageHistory(llm, session_id="s1", **options)
+
+
+def test_turns_beyond_keep_turns_are_folded_into_the_summary():
+    llm = FakeSummarizer()
+    history = _history(llm, keep_turns=4)
+
+    for i in range(5):
+        history.add_messages(_turn(i))
+    history.wait_for_summary(timeout=5)
+
+    # เกิน 4 turns: พับลงเหลือครึ่งหนึ่ง (2 turns ล่าสุด)
+    assert history.metrics["summaries"] == 1
+    assert [turn[0].content.split()[1] for turn in history.turns] == ["3", "4"]
+    transcript = llm.requests[0][1].content
+    assert "question 0" in transcript and "question 2" in transcript and "question 3" not in transcript
+
+    messages = history.messages
+    assert isinstance(messages[0], SystemMessage)
+    assert messages[0].content == "สรุปบทสนทนาก่อนหน้า:\nsummary #1"
+    assert messages[1:] == history.turns[0] + history.turns[1]
+
+
+def test_turns_over_the_token_budget_are_folded():
+    llm = FakeSummarizer()
+    budget = agent.count_tokens(_turn(0, words=60)) * 5 // 2  # พอสำหรับ 2 turns แต่ไม่พอ 3
+    history = _history(llm, keep_turns=50, token_budget=budget)
+
+    for i in range(3):
+        history.add_messages(_turn(i, words=60))
+        history.wait_for_summary(timeout=5)
+
+    assert history.metrics["summaries"] == 1
+    assert [turn[0].content.split()[1] for turn in history.turns] == ["1", "2"]
+    assert agent.count_tokens(history.turns[0] + history.turns[1]) <= budget
+
+
+def test_summary_is_updated_incrementally_with_the_previous_summary():
+    llm = FakeSummarizer()
+    history = _history(llm, keep_turns=2)
+
+    for i in range(5):
+        history.add_messages(_turn(i))
+        history.wait_for_summary(timeout=5)
+
+    assert history.metrics["summaries"] == 2
+    assert "summary #1" in llm.requests[1][1].content
+    assert history.summary == "summary #2"
+
+
+def test_reply_is_not_blocked_by_a_slow_summarizer():
+    llm = FakeSummarizer(delay=0.5)
+    history = _history(llm, keep_turns=2)
+    for i in range(2):
+        history.add_messages(_turn(i))
+
+    started = time.perf_counter()
+    asyncio.run(history.aadd_messages(_turn(2)))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.2
+    # ระหว่างสรุป turns เก่ายังอยู่ครบใน prompt
+    assert len(history.turns) == 3 and not history.summary
+    history.wait_for_summary(timeout=5)
+    assert history.metrics["summaries"] == 1
+    assert len(history.turns) == 1
+
+
+def test_summary_runs_outside_the_calling_thread():
+    threads = []
+
+    class RecordingSummarizer(FakeSummarizer):
+        def invoke(self, messages):
+            threads.append(threading.current_thread())
+            return super().invoke(messages)
+
+    history = _history(RecordingSummarizer(), keep_turns=1)
+    history.add_messages(_turn(0))
+    history.add_messages(_turn(1))
+    history.wait_for_summary(timeout=5)
+
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_folded_turns_are_offloaded_to_memory(monkeypatch):
+    saved = []
+    monkeypatch.setattr(agent, "sync_save_memory_chunk", lambda content, metadata=None: saved.append((content, metadata)))
+    history = _history(FakeSummarizer(), keep_turns=2, offload_to_memory=True)
+
+    for i in range(3):
+        history.add_messages(_turn(i))
+    history.wait_for_summary(timeout=5)
+
+    assert len(saved) == 1
+    content, metadata = saved[0]
+    assert "human: question 0" in content and "ai: answer 0" in content
+    assert metadata == {"source": "chat_history", "session_id": "s1"}
+    assert history.metrics["offloaded_turns"] == 2
+
+
+def test_turns_are_not_offloaded_when_disabled(monkeypatch):
+    saved = []
+    monkeypatch.setattr(agent, "sync_save_memory_chunk", lambda content, metadata=None: saved.append(content))
+    history = _history(FakeSummarizer(), keep_turns=2, offload_to_memory=False)
+
+    for i in range(3):
+        history.add_messages(_turn(i))
+    history.wait_for_summary(timeout=5)
+
+    assert saved == []
+    assert history.metrics["offloaded_turns"] == 0
+
+
+def test_failed_summary_still_drops_the_stale_turns():
+    history = _history(FakeSummarizer(fail=True), keep_turns=2)
+
+    for i in range(3):
+        history.add_messages(_turn(i))
+    history.wait_for_summary(timeout=5)
+
+    assert history.metrics["summaries"] == 0
+    assert len(history.turns) == 1
+    assert not history.summary
+
+
+def test_clear_resets_history():
+    history = _history(FakeSummarizer(), keep_turns=2)
+    for i in range(3):
+        history.add_messages(_turn(i))
+    history.wait_for_summary(timeout=5)
+
+    history.clear()
+
+    assert history.messages == []
+    assert history.summary == "" and history.turns == []
+
+
+def test_clear_during_a_summary_discards_it():
+    history = _history(FakeSummarizer(delay=0.3), keep_turns=2)
+    for i in range(3):
+        history.add_messages(_turn(i))
+
+    history.clear()
+    history.add_messages(_turn(9))
+    history.wait_for_summary(timeout=5)
+
+    assert history.summary == ""
+    assert [turn[0].content.split()[1] for turn in history.turns] == ["9"]
+    assert history.metrics["summaries"] == 0
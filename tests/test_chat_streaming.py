@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+import agent
+import app
+
+ANSWER_TOKENS = ["2 + 2 ", "เท่ากับ ", "4 ครับ"]
+TOKEN_DELAY_SECONDS = 0.2
+
+
+def _sse_chunk(delta: dict, finish_reason=None) -> bytes:
+    chunk = {
+        "id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "test-model",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _tool_call_stream():
+    arguments = json.dumps({"expression": "2 + 2"})
+    yield _sse_chunk({"role": "assistant", "content": None, "tool_calls": [{
+        "index": 0, "id": "call_calc", "type": "function",
+        "function": {"name": "calculator", "arguments": arguments},
+    }]})
+    yield _sse_chunk({}, "tool_calls")
+    yield b"data: [DONE]\n\n"
+
+
+def _answer_stream():
+    yield _sse_chunk({"role": "assistant", "content": ""})
+    for token in ANSWER_TOKENS:
+        time.sleep(TOKEN_DELAY_SECONDS)
+        yield _sse_chunk({"content": token})
+    yield _sse_chunk({}, "stop")
+    yield b"data: [DONE]\n\n"
+
+
+@pytest.fixture
+def fake_llm_endpoint(local_site):
+    """endpoint แบบ OpenAI: รอบแรกสั่งเรียก calculator, เมื่อได้ผลของ tool แล้วค่อย stream คำตอบทีละ token"""
+
+    def _chat_completions(request):
+        body = json.loads(local_site.requests[-1]["body"])
+        if not body.get("stream"):
+            raise AssertionError("agent must request a streamed completion")
+        has_tool_result = any(message["role"] == "tool" for message in body["messages"])
+        stream = _answer_stream() if has_tool_result else _tool_call_stream()
+        return 200, {"Content-Type": "text/event-stream"}, stream
+
+    local_site.routes["/v1/chat/completions"] = _chat_completions
+    return local_site
+
+
+class FakeChainlit:
+    """แทนโมดูล chainlit เท่าที่ app.main ใช้ และบันทึกทุกอย่างที่ถูกส่งไปหน้าจอพร้อมเวลา"""
+
+    def __init__(self):
+        self.events = []
+        self.session = {}
+        self.user_session = SimpleNamespace(get=self.session.get, set=self.session.__setitem__)
+        ui = self
+
+        class Message:
+            def __init__(self, content="", actions=None, elements=None):
+                self.id = f"message-{len(ui.events)}"
+                self.content, self.actions, self.elements = content, actions or [], elements or []
+
+            async def stream_token(self, token):
+                ui.events.append(("token", token, time.perf_counter()))
+
+            async def send(self):
+                ui.events.append(("send", self.content, time.perf_counter()))
+                return self
+
+            async def update(self):
+                ui.events.append(("update", self.content, time.perf_counter()))
+
+        class Step:
+            def __init__(self, name, type):
+                self.name, self.type, self.input, self.output = name, type, None, None
+
+            async def send(self):
+                ui.events.append(("step_start", self.name, time.perf_counter()))
+
+            async def update(self):
+                ui.events.append(("step_end", self.output, time.perf_counter()))
+
+        self.Message, self.Step = Message, Step
+        self.File = lambda **kwargs: SimpleNamespace(**kwargs)
+
+    def of(self, kind):
+        return [(value, at) for event, value, at in self.events if event == kind]
+
+
+@pytest.fixture
+def chat(fake_llm_endpoint, mcp_pool, tmp_path, monkeypatch):
+    llm_cache = agent.LLMResponseCache(path=os.fspath(tmp_path / "llm.sqlite3"))
+    monkeypatch.setattr(agent, "llm_cache", llm_cache)
+    monkeypatch.setattr(app, "llm_cache", llm_cache)
+    monkeypatch.setattr(agent, "CHEAP_MODEL", "")
+
+    engine = agent.AdvancedWebAgent()
+    engine.llm = agent.CachedChatOpenAI(model="test-model", api_key="test-key",
+                                        base_url=fake_llm_endpoint.base_url + "/v1", temperature=0)
+    ui = FakeChainlit()
+    ui.session.update({
+        "id": "chat-1",
+        "main_actions": [],
+        "chat_history": agent.SummarizingChatMessageHistory(llm=engine.llm, session_id="chat-1"),
+    })
+    monkeypatch.setattr(app, "cl", ui)
+    monkeypatch.setattr(app, "get_shared_agent", lambda: engine)
+    monkeypatch.setattr(app, "agent_with_memory", RunnableWithMessageHistory(
+        engine.agent_executor,
+        lambda session_id: ui.session["chat_history"],
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    ))
+    return ui
+
+
+def test_tool_steps_and_answer_tokens_stream_as_they_happen(chat):
+    started = time.perf_counter()
+    asyncio.run(asyncio.wait_for(app.main(SimpleNamespace(content="2 + 2 เท่ากับเท่าไร")), 30))
+
+    steps = chat.of("step_start")
+    assert [name for name, _ in steps] == ["calculator"]
+    tool_output = json.loads(chat.of("step_end")[0][0])
+    assert tool_output == {"tool": "calculator", "arguments": {"expression": "2 + 2"}, "spawn": tool_output["spawn"]}
+
+    tokens = chat.of("token")
+    assert [token for token, _ in tokens] == ANSWER_TOKENS
+    assert steps[0][1] < tokens[0][1]
+    # token แรกต้องถึงหน้าจอก่อนที่ LLM จะ stream จบ ไม่ใช่ส่งทีเดียวตอนท้าย
+    assert tokens[-1][1] - tokens[0][1] >= TOKEN_DELAY_SECONDS * (len(ANSWER_TOKENS) - 1) * 0.8
+    assert tokens[0][1] - started < tokens[-1][1] - started - TOKEN_DELAY_SECONDS
+
+    final = chat.of("update")
+    assert [content for content, _ in final] == ["".join(ANSWER_TOKENS)]
+    assert final[0][1] >= tokens[-1][1]
+
+
+def test_turn_is_saved_to_chat_history(chat):
+    asyncio.run(asyncio.wait_for(app.main(SimpleNamespace(content="2 + 2 เท่ากับเท่าไร")), 30))
+
+    history = chat.session["chat_history"].messages
+    assert [message.type for message in history] == ["human", "ai"]
+    assert history[-1].content == "".join(ANSWER_TOKENS)
+
+
+def test_turn_metrics_go_to_debug_log_not_stdout(chat, caplog, capsys):
+    with caplog.at_level(logging.DEBUG, logger="app"):
+        asyncio.run(asyncio.wait_for(app.main(SimpleNamespace(content="2 + 2 เท่ากับเท่าไร")), 30))
+
+    assert "Time to first token" not in capsys.readouterr().out
+    assert any(record.getMessage().startswith("Time to first token") for record in caplog.records)
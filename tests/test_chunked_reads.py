@@ -0,0 +1,83 @@
+import asyncio
+import json
+import uuid
+
+import docx
+import pytest
+
+import server
+
+
+def _call(tool, **arguments) -> dict:
+    return json.loads(asyncio.run(tool.fn(**arguments)))
+
+
+def _read_all(first: dict, length: int) -> tuple[str, list[dict]]:
+    """อ่านต่อด้วย read_chunk(handle, next_offset) จนครบ เหมือนที่ agent ทำ"""
+    chunks = [first]
+    while chunks[-1]["next_offset"] is not None:
+        chunks.append(_call(server.read_chunk, handle=first["handle"],
+                            offset=chunks[-1]["next_offset"], length=length))
+    return "".join(chunk["content"] for chunk in chunks), chunks
+
+
+@pytest.fixture
+def long_page(local_site):
+    path = f"/long-{uuid.uuid4().hex}"
+    paragraphs = [f"Paragraph {i:03d} " + "lorem ipsum " * 8 for i in range(60)]
+    body = "<html><body>" + "".join(f"<p>{p}</p>" for p in paragraphs) + "</body></html>"
+    local_site.routes[path] = lambda request: (200, {"Content-Type": "text/html; charset=utf-8"}, body)
+    return {"url": local_site.base_url + path, "path": path, "site": local_site}
+
+
+def test_page_handle_reads_the_rest_without_fetching_again(long_page):
+    whole = _call(server.browse_url, url=long_page["url"], length=server.CHUNK_MAX_LENGTH)
+    assert whole["next_offset"] is None
+
+    first = _call(server.browse_url, url=long_page["url"], length=1000)
+    assert first["handle"].startswith("page:")
+    assert (first["offset"], first["next_offset"]) == (0, 1000)
+    text, chunks = _read_all(first, 1000)
+
+    assert text == whole["content"]
+    assert len(chunks) == -(-whole["total_length"] // 1000)
+    assert [chunk["offset"] for chunk in chunks] == list(range(0, whole["total_length"], 1000))
+    assert len([r for r in long_page["site"].requests if r["path"] == long_page["path"]]) == 1
+
+
+def test_file_handle_round_trips_through_read_chunk():
+    name = f"chunks-{uuid.uuid4().hex[:8]}.txt"
+    content = "".join(f"line {i}\n" for i in range(2000))
+    _call(server.write_to_file, filename=name, content=content)
+
+    first = _call(server.read_from_file, filename=name, length=3000)
+    assert first["handle"] == f"file:{name}"
+    assert first["total_length"] == len(content)
+    text, chunks = _read_all(first, 3000)
+
+    assert text == content
+    assert chunks[-1]["next_offset"] is None
+    assert _call(server.read_chunk, handle=first["handle"], offset=len(content))["content"] == ""
+
+
+def test_document_length_is_known_only_once_every_page_is_read(monkeypatch):
+    monkeypatch.setattr(server, "DOCUMENT_PAGE_CHARS", 500)
+    name = f"report-{uuid.uuid4().hex[:8]}.docx"
+    document = docx.Document()
+    for i in range(40):
+        document.add_paragraph(f"Section {i:02d}: " + "quarterly revenue grew " * 3)
+    document.save(f"{server.WORKSPACE_DIR}/{name}")
+
+    first = _call(server.read_from_file, filename=name, length=800)
+    assert first["total_length"] is None
+    text, chunks = _read_all(first, 800)
+
+    assert all(chunk["total_length"] is None for chunk in chunks[:-2])
+    assert chunks[-1]["total_length"] == len(text)
+    assert chunks[-1]["page_count"] > 1
+    assert text.count("Section") == 40
+
+
+def test_unknown_and_expired_handles_are_errors():
+    assert "error" in _call(server.read_chunk, handle="nope:123")
+    assert "error" in _call(server.read_chunk, handle="page:http://never-fetched.test/")
@@ -0,0 +1,124 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+import uuid
+
+import server
+
+
+def _call(**arguments) -> dict:
+    return json.loads(asyncio.run(server.write_chunk.fn(**arguments)))
+
+
+def _name(suffix: str = ".txt") -> str:
+    return f"chunked-{uuid.uuid4().hex[:8]}{suffix}"
+
+
+def _path(filename: str) -> str:
+    return os.path.join(server.WORKSPACE_DIR, filename)
+
+
+def _temp_files(filename: str) -> list[str]:
+    return [name for name in os.listdir(server.WORKSPACE_DIR) if name.startswith(f".{filename}.")]
+
+
+def _write(filename: str, parts: list[str], **options) -> dict:
+    handle = _call(content=parts[0], filename=filename, **options)["handle"]
+    for part in parts[1:-1]:
+        _call(content=part, handle=handle)
+    return _call(content=parts[-1], handle=handle, final=True)
+
+
+def test_file_appears_only_after_the_final_chunk():
+    filename = _name()
+    first = _call(content="part 1\n", filename=filename)
+    _call(content="part 2\n", handle=first["handle"])
+
+    assert not os.path.exists(_path(filename))
+    assert len(_temp_files(filename)) == 1
+
+    done = _call(content="part 3\n", handle=first["handle"], final=True)
+
+    assert done["chars_written"] == len("part 1\npart 2\npart 3\n")
+    with open(_path(filename), encoding="utf-8") as f:
+        assert f.read() == "part 1\npart 2\npart 3\n"
+    assert _temp_files(filename) == []
+    assert "error" in _call(content="late", handle=first["handle"])
+
+
+def test_append_continues_the_existing_file():
+    filename = _name()
+    _write(filename, ["header\n", "row 1\n"])
+
+    _write(filename, ["row 2\n", "row 3\n"], append=True)
+
+    with open(_path(filename), encoding="utf-8") as f:
+        assert f.read() == "header\nrow 1\nrow 2\nrow 3\n"
+
+
+def test_compressed_writes_are_gzip_and_append_as_new_members():
+    filename = _name()
+    done = _write(filename, ["ก" * 1000, "ข" * 1000], compress=True)
+    assert done["success"].startswith(f"File '{filename}.gz'")
+
+    _write(f"{filename}.gz", ["ค" * 10, "ง" * 10], append=True, compress=True)
+
+    with gzip.open(_path(f"{filename}.gz"), "rt", encoding="utf-8") as f:
+        assert f.read() == "ก" * 1000 + "ข" * 1000 + "ค" * 10 + "ง" * 10
+    assert done["bytes"] < len(("ก" * 2000).encode("utf-8"))
+
+
+def test_abort_discards_the_temp_file_and_keeps_the_original():
+    filename = _name()
+    _write(filename, ["original\n", "content\n"])
+    handle = _call(content="replacement\n", filename=filename)["handle"]
+
+    aborted = _call(content="", handle=handle, abort=True)
+
+    assert "aborted" in aborted["success"]
+    assert _temp_files(filename) == []
+    with open(_path(filename), encoding="utf-8") as f:
+        assert f.read() == "original\ncontent\n"
+    assert "error" in _call(content="more", handle=handle)
+
+
+def test_abort_of_an_append_restores_the_original_length():
+    filename = _name()
+    _write(filename, ["kept\n", "lines\n"])
+    handle = _call(content="appended\n", filename=filename, append=True)["handle"]
+    _call(content="more\n", handle=handle)
+
+    _call(content="", handle=handle, abort=True)
+
+    with open(_path(filename), encoding="utf-8") as f:
+        assert f.read() == "kept\nlines\n"
+
+
+def test_idle_handles_expire_and_their_temp_files_are_removed(monkeypatch):
+    monkeypatch.setattr(server, "WRITE_HANDLE_TTL", 0.05)
+    filename = _name()
+    handle = _call(content="never finished", filename=filename)["handle"]
+    assert len(_temp_files(filename)) == 1
+
+    time.sleep(0.1)
+    # handle ที่หมดอายุจะถูกเก็บกวาดเมื่อมีการเรียก write_chunk ครั้งถัดไป
+    result = _call(content="too late", handle=handle, final=True)
+
+    assert "expired" in result["error"]
+    assert _temp_files(filename) == []
+    assert not os.path.exists(_path(filename))
+
+
+def test_expired_append_keeps_the_original_file(monkeypatch):
+    filename = _name()
+    _write(filename, ["kept\n", "lines\n"])
+    monkeypatch.setattr(server, "WRITE_HANDLE_TTL", 0.05)
+    handle = _call(content="half-written\n", filename=filename, append=True)["handle"]
+
+    time.sleep(0.1)
+    assert "error" in _call(content="", handle=handle)
+
+    with open(_path(filename), encoding="utf-8") as f:
+        assert f.read() == "kept\nlines\n"
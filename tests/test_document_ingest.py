@@ -0,0 +1,67 @@
+import asyncio
+import json
+import os
+import uuid
+
+import docx
+import pytest
+
+import server
+
+
+def _call(tool, **arguments) -> dict:
+    return json.loads(asyncio.run(tool.fn(**arguments)))
+
+
+@pytest.fixture
+def documents(monkeypatch):
+    """โฟลเดอร์เอกสารใหม่ใน workspace (docx 2 ไฟล์ + csv) และบันทึกว่า process นี้ extract ไฟล์ไหนเอง"""
+    folder = f"docs-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(server.WORKSPACE_DIR, folder))
+    for i in range(2):
+        document = docx.Document()
+        for paragraph in range(30):
+            document.add_paragraph(f"{folder} memo {i} paragraph {paragraph}: quarterly revenue grew")
+        document.save(os.path.join(server.WORKSPACE_DIR, folder, f"memo-{i}.docx"))
+    with open(os.path.join(server.WORKSPACE_DIR, folder, "prices.csv"), "w", encoding="utf-8") as f:
+        f.write(f"ticker,price,{folder}\n" + "".join(f"T{i},{i}.5\n" for i in range(100)))
+    server.workspace_index.invalidate()
+
+    extracted_here = []
+    extract_pages = server._extract_pages
+
+    def _recording_extract_pages(path, start_page=0):
+        extracted_here.append(os.path.basename(path))
+        return extract_pages(path, start_page)
+
+    monkeypatch.setattr(server, "_extract_pages", _recording_extract_pages)
+    return {"pattern": f"{folder}/*", "extracted_here": extracted_here}
+
+
+def test_documents_are_extracted_in_worker_processes_and_cached(documents):
+    first = _call(server.ingest_documents, pattern=documents["pattern"])
+
+    assert first["errors"] == []
+    assert [d["filename"].split("/")[-1] for d in first["documents"]] == ["memo-0.docx", "memo-1.docx", "prices.csv"]
+    assert not any(d["cached"] for d in first["documents"])
+    # docx ถูก extract ใน worker process ส่วน csv (อ่านเป็นข้อความธรรมดา) ทำใน process นี้
+    assert documents["extracted_here"] == ["prices.csv"]
+
+    second = _call(server.ingest_documents, pattern=documents["pattern"])
+    assert all(d["cached"] for d in second["documents"])
+    assert [d["chars"] for d in second["documents"]] == [d["chars"] for d in first["documents"]]
+
+    memo = first["documents"][0]["filename"]
+    chunk = _call(server.read_from_file, filename=memo, length=100000)
+    assert chunk["total_length"] == first["documents"][0]["chars"]
+    assert chunk["content"].count("paragraph") == 30
+    assert documents["extracted_here"] == ["prices.csv"]
+
+
+def test_documents_are_extracted_in_threads_when_processes_are_disabled(documents, monkeypatch):
+    monkeypatch.setattr(server, "DOCUMENT_PROCESSES", False)
+
+    report = _call(server.ingest_documents, pattern=documents["pattern"])
+
+    assert report["errors"] == []
+    assert sorted(documents["extracted_here"]) == ["memo-0.docx", "memo-1.docx", "prices.csv"]
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import numpy as np
+
+import server
+
+
+class RecordingModel:
+    """backend ปลอมที่บันทึกทุก batch ที่ถูกส่งมา embed"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return [np.full(4, len(text), dtype=np.float32) for text in texts]
+
+    @property
+    def texts(self) -> list[str]:
+        return [text for batch in self.batches for text in batch]
+
+
+def _cache(tmp_path, model, **options) -> server.CachedEmbeddingFunction:
+    return server.CachedEmbeddingFunction(backend=model, path=str(tmp_path / "embeddings.sqlite3"), **options)
+
+
+def test_cache_hits_skip_the_model(tmp_path):
+    model = RecordingModel()
+    cache = _cache(tmp_path, model)
+
+    first = cache(["alpha", "beta"])
+    second = cache(["beta", "alpha"])
+
+    assert model.batches == [["alpha", "beta"]]
+    assert [v.tolist() for v in second] == [first[1].tolist(), first[0].tolist()]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+
+
+def test_only_missing_texts_are_embedded_once(tmp_path):
+    model = RecordingModel()
+    cache = _cache(tmp_path, model)
+    cache(["alpha"])
+
+    vectors = cache(["alpha", "gamma", "gamma", "delta"])
+
+    assert model.batches == [["alpha"], ["gamma", "delta"]]
+    assert len(vectors) == 4 and vectors[1].tolist() == vectors[2].tolist()
+
+
+def test_vectors_persist_across_instances(tmp_path):
+    _cache(tmp_path, RecordingModel())(["alpha", "beta"])
+    model = RecordingModel()
+
+    _cache(tmp_path, model)(["alpha", "beta"])
+
+    assert model.batches == []
+
+
+def test_another_model_does_not_reuse_vectors(tmp_path):
+    _cache(tmp_path, RecordingModel())(["alpha"])
+    model = RecordingModel()
+    other = _cache(tmp_path, model)
+    other.model_key = "sentence-transformers:another-model"
+
+    other(["alpha"])
+
+    assert model.texts == ["alpha"]
+
+
+def test_misses_are_embedded_in_batches(tmp_path):
+    model = RecordingModel()
+
+    _cache(tmp_path, model, batch_size=2)([f"text {i}" for i in range(5)])
+
+    assert [len(batch) for batch in model.batches] == [2, 2, 1]
+
+
+def test_oldest_vectors_are_evicted_past_max_entries(tmp_path):
+    model = RecordingModel()
+    cache = _cache(tmp_path, model, max_entries=3)
+    for text in ["one", "two", "three", "four"]:
+        cache([text])
+
+    assert cache.stats()["entries"] == 3
+    cache(["four", "one"])
+    assert model.texts[-1] == "one"
+
+
+def test_repeated_memory_query_is_not_embedded_again(memory_store):
+    memory_store.buffer.add("ชอบกาแฟดำไม่ใส่น้ำตาล")
+    search = lambda: json.loads(asyncio.run(server.search_relevant_memories.fn(query="กาแฟ", mode="vector")))
+    search()
+    texts_after_first_search = memory_store.model.texts
+
+    # บันทึกความจำใหม่ทำให้แคชผลการค้นหาถูกล้าง: รอบนี้ต้องค้น Chroma ใหม่ แต่ vector ของคำค้นมาจากแคช
+    memory_store.buffer.add("นัดประชุมวันจันทร์")
+    results = search()
+
+    assert memory_store.model.texts == texts_after_first_search + 1
+    assert results["memories"]
@@ -0,0 +1,68 @@
+import codecs
+
+import server
+
+THAI = "ราคาหุ้นวันนี้ปรับตัวขึ้นต่อเนื่องจากแรงซื้อของนักลงทุนต่างชาติ"
+
+
+def _extract(raw: bytes, encoding=None, chunk_size=64, **kwargs) -> str:
+    extractor = server.HtmlTextExtractor(encoding=encoding, **kwargs)
+    for i in range(0, len(raw), chunk_size):
+        extractor.feed(raw[i:i + chunk_size])
+    return extractor.finish()
+
+
+def test_utf8_page_without_charset_is_decoded_as_utf8():
+    raw = f"<html><body><p>{THAI}</p></body></html>".encode("utf-8")
+    assert _extract(raw) == THAI
+
+
+def test_meta_charset_is_used_when_header_has_no_charset():
+    raw = (f'<html><head><meta charset="windows-874"></head>'
+           f"<body><p>{THAI}</p></body></html>").encode("cp874")
+    assert _extract(raw) == THAI
+
+
+def test_meta_http_equiv_charset():
+    raw = ('<html><head><meta http-equiv="Content-Type" content="text/html; charset=iso-8859-1"></head>'
+           "<body><p>Café crème</p></body></html>").encode("latin-1")
+    assert _extract(raw) == "Café crème"
+
+
+def test_bom_wins_over_default():
+    raw = codecs.BOM_UTF8 + f"<html><body><p>{THAI}</p></body></html>".encode("utf-8")
+    assert _extract(raw) == THAI
+
+
+def test_unknown_declared_encoding_falls_back_to_utf8():
+    raw = f'<html><head><meta charset="x-no-such-charset"></head><body><p>{THAI}</p></body></html>'.encode("utf-8")
+    assert _extract(raw) == THAI
+
+
+def test_header_encoding_skips_sniffing():
+    raw = f"<html><body><p>{THAI}</p></body></html>".encode("cp874")
+    assert _extract(raw, encoding="cp874") == THAI
+
+
+def test_br_splits_lines_inside_one_block():
+    raw = b"<html><body><p>first line<br>second line<br/>third   line</p><p>next</p></body></html>"
+    assert _extract(raw) == "first line\nsecond line\nthird line\nnext"
+
+
+def test_br_paragraph_is_kept_as_main_content():
+    # แต่ละบรรทัดสั้นกว่าเกณฑ์ 40 ตัวอักษร แต่ทั้งย่อหน้ายาวพอ จึงต้องไม่ถูกตัดทิ้ง
+    lines = ["Bangkok market opened higher", "Energy stocks led the gains", "Banks were flat"]
+    raw = ("<html><body><nav><a href='/'>Home</a></nav>"
+           f"<p>{'<br>'.join(lines)}</p>"
+           "<div><a href='/a'>Link one</a> <a href='/b'>Link two</a></div></body></html>").encode("utf-8")
+    assert _extract(raw, main_content_only=True) == "\n".join(lines)
+
+
+def test_browse_page_sniffs_charset_when_header_omits_it(local_site):
+    body = (f'<html><head><meta charset="windows-874"></head>'
+            f"<body><article><p>{THAI}</p></article></body></html>").encode("cp874")
+    local_site.routes["/thai-news"] = lambda request: (200, {"Content-Type": "text/html"}, body)
+
+    result = server._browse_page(local_site.base_url + "/thai-news")
+
+    assert result["content"] == THAI
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+import pytest
+
+import server
+
+PAGE = "<html><body><article><p>{text}</p></article></body></html>"
+
+
+def _call(tool, **arguments) -> dict:
+    return json.loads(asyncio.run(tool.fn(**arguments)))
+
+
+@pytest.fixture
+def slow_pages(local_site):
+    """หน้าเว็บที่ตอบช้า delay วินาที และนับจำนวน request ที่กำลังรันพร้อมกันสูงสุดของแต่ละ host"""
+    state = {"delay": 0.2, "in_flight": {}, "peak": {}, "lock": threading.Lock()}
+
+    def _route(request):
+        host = request.headers["Host"].split(":")[0]
+        with state["lock"]:
+            state["in_flight"][host] = state["in_flight"].get(host, 0) + 1
+            state["peak"][host] = max(state["peak"].get(host, 0), state["in_flight"][host])
+        time.sleep(state["delay"])
+        with state["lock"]:
+            state["in_flight"][host] -= 1
+        return 200, {"Content-Type": "text/html; charset=utf-8"}, PAGE.format(text=f"Page {request.path}")
+
+    def _urls(count: int, host: str = "127.0.0.1") -> list[str]:
+        base = local_site.base_url.replace("127.0.0.1", host)
+        urls = []
+        for _ in range(count):
+            path = f"/slow-{uuid.uuid4().hex}"
+            local_site.routes[path] = _route
+            urls.append(base + path)
+        return urls
+
+    state["urls"] = _urls
+    return state
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    """PooledFetcher ใหม่ (จำกัด 2 connection ต่อ host) แทนตัวกลางของ server ระหว่าง test"""
+    pooled = server.PooledFetcher(max_connections=20, max_per_host=2)
+    monkeypatch.setattr(server, "fetcher", pooled)
+    return pooled
+
+
+def test_browse_urls_keeps_order_and_reports_errors_per_url(local_site):
+    ok_path, missing_path = f"/ok-{uuid.uuid4().hex}", f"/missing-{uuid.uuid4().hex}"
+    local_site.routes[ok_path] = lambda request: (200, {"Content-Type": "text/html"}, PAGE.format(text="Hello there"))
+    urls = [local_site.base_url + missing_path, local_site.base_url + ok_path]
+
+    results = _call(server.browse_urls, urls=urls)["results"]
+
+    assert [result["requested_url"] for result in results] == urls
+    assert "error" in results[0] and "404" in results[0]["error"]
+    assert results[1]["content"] == "Hello there"
+
+
+def test_browse_urls_fetches_pages_concurrently(slow_pages, monkeypatch):
+    monkeypatch.setattr(server, "fetcher", server.PooledFetcher(max_per_host=8))
+    urls = slow_pages["urls"](6)
+
+    started = time.perf_counter()
+    results = _call(server.browse_urls, urls=urls)["results"]
+    elapsed = time.perf_counter() - started
+
+    assert all("error" not in result for result in results)
+    assert elapsed < slow_pages["delay"] * 3
+    assert slow_pages["peak"]["127.0.0.1"] > 1
+
+
+def test_requests_to_one_host_are_capped(slow_pages, fetcher):
+    results = _call(server.browse_urls, urls=slow_pages["urls"](6))["results"]
+
+    assert all("error" not in result for result in results)
+    assert slow_pages["peak"]["127.0.0.1"] == fetcher.max_per_host
+
+
+def test_host_cap_is_per_host(slow_pages, fetcher):
+    # 127.0.0.1 กับ localhost เป็น server เดียวกันแต่คนละ host สำหรับ fetcher
+    urls = slow_pages["urls"](4, "127.0.0.1") + slow_pages["urls"](4, "localhost")
+
+    started = time.perf_counter()
+    _call(server.browse_urls, urls=urls)
+    elapsed = time.perf_counter() - started
+
+    assert slow_pages["peak"] == {"127.0.0.1": 2, "localhost": 2}
+    # 4 URL ต่อ host ที่จำกัด 2: สองรอบ ไม่ใช่สี่รอบ
+    assert elapsed < slow_pages["delay"] * 3.5
+
+
+def test_connections_are_reused_across_fetches(local_site, fetcher):
+    path = f"/keepalive-{uuid.uuid4().hex}"
+    local_site.routes[path] = lambda request: (200, {"Content-Type": "text/plain"}, "pong")
+
+    for _ in range(5):
+        assert fetcher.fetch(local_site.base_url + path, headers={})["content"] == b"pong"
+
+    clients = {request["client"] for request in local_site.requests if request["path"] == path}
+    assert len(clients) == 1
+
+
+def test_download_stops_at_max_bytes(local_site, monkeypatch):
+    path = f"/huge-{uuid.uuid4().hex}"
+    local_site.routes[path] = lambda request: (200, {"Content-Type": "text/plain"}, (b"x" * 64 * 1024 for _ in range(64)))
+    pooled = server.PooledFetcher(max_bytes=100 * 1024)
+
+    result = pooled.fetch(local_site.base_url + path, headers={})
+
+    assert result["truncated"] is True
+    assert len(result["content"]) == 100 * 1024
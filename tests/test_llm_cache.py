@@ -0,0 +1,170 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import agent
+
+QUESTION = [HumanMessage(content="same question")]
+MODEL_LATENCY_SECONDS = 0.05
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    llm_cache = agent.LLMResponseCache(path=os.fspath(tmp_path / "llm.sqlite3"))
+    monkeypatch.setattr(agent, "llm_cache", llm_cache)
+    return llm_cache
+
+
+@pytest.fixture
+def fake_model(cache, monkeypatch):
+    """
+    แทนการเรียก API ของ ChatOpenAI (ทั้ง sync และ async) ด้วยโมเดลปลอมที่ใช้เวลาตอบ MODEL_LATENCY_SECONDS
+    ถ้า model["fail_first"] การเรียกครั้งแรกจะล้มเหลว (เหมือน provider ตอบ 502)
+    """
+    model = {"calls": 0, "fail_first": False}
+    lock = threading.Lock()
+
+    def _answer():
+        with lock:
+            model["calls"] += 1
+            call = model["calls"]
+        if model["fail_first"] and call == 1:
+            raise ConnectionError("provider returned 502")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"answer from call {call}"))])
+
+    def _fake_generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(MODEL_LATENCY_SECONDS)
+        return _answer()
+
+    async def _fake_agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(MODEL_LATENCY_SECONDS)
+        return _answer()
+
+    monkeypatch.setattr(agent.ChatOpenAI, "_generate", _fake_generate)
+    monkeypatch.setattr(agent.ChatOpenAI, "_agenerate", _fake_agenerate)
+    llm = agent.CachedChatOpenAI(model="test-model", api_key="test-key", temperature=0)
+    return llm, model
+
+
+def _ask_concurrently(llm, callers: int) -> list:
+    async def _scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(*(llm.ainvoke(QUESTION) for _ in range(callers)), return_exceptions=True), 5
+        )
+    return asyncio.run(_scenario())
+
+
+def _ask_from_threads(llm, callers: int) -> list:
+    results = []
+    barrier = threading.Barrier(callers)
+
+    def _caller():
+        barrier.wait()
+        try:
+            results.append(llm.invoke(QUESTION))
+        except Exception as e:
+            results.append(e)
+
+    workers = [threading.Thread(target=_caller) for _ in range(callers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(5)
+    return results
+
+
+@pytest.mark.parametrize("ask", [_ask_concurrently, _ask_from_threads])
+def test_concurrent_identical_requests_call_the_model_once(fake_model, cache, ask):
+    llm, model = fake_model
+
+    results = ask(llm, 10)
+
+    assert model["calls"] == 1
+    assert {result.content for result in results} == {"answer from call 1"}
+    assert cache.stats()["deduplicated"] >= 9
+    assert cache._inflight == {}
+
+
+@pytest.mark.parametrize("ask", [_ask_concurrently, _ask_from_threads])
+def test_failed_leader_hands_over_to_exactly_one_waiter(fake_model, cache, ask):
+    llm, model = fake_model
+    model["fail_first"] = True
+
+    results = ask(llm, 11)
+
+    assert model["calls"] == 2
+    assert sum(isinstance(result, ConnectionError) for result in results) == 1
+    assert sum(getattr(result, "content", None) == "answer from call 2" for result in results) == 10
+    assert cache._inflight == {}
+
+
+def test_waiter_on_another_event_loop_is_woken_by_the_leader(fake_model):
+    llm, model = fake_model
+    answers = []
+
+    def _chat_on_its_own_loop():
+        answers.append(asyncio.run(asyncio.wait_for(llm.ainvoke(QUESTION), 5)))
+
+    chats = [threading.Thread(target=_chat_on_its_own_loop) for _ in range(3)]
+    for chat in chats:
+        chat.start()
+    for chat in chats:
+        chat.join()
+
+    assert model["calls"] == 1
+    assert [answer.content for answer in answers] == ["answer from call 1"] * 3
+
+
+def test_sampling_temperature_bypasses_the_cache(fake_model, cache):
+    _, model = fake_model
+    llm = agent.CachedChatOpenAI(model="test-model", api_key="test-key", temperature=0.7)
+
+    llm.invoke(QUESTION)
+    llm.invoke(QUESTION)
+
+    assert model["calls"] == 2
+    assert cache.stats()["bypassed"] == 2
+
+
+@pytest.fixture
+def streaming_llm(cache, monkeypatch):
+    """CachedChatOpenAI ที่ stream จาก chunks ที่กำหนด แทนการเรียก API จริง"""
+    stream = {"chunks": [], "calls": 0}
+
+    async def _fake_astream(self, messages, stop=None, run_manager=None, **kwargs):
+        stream["calls"] += 1
+        for text in stream["chunks"]:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+
+    monkeypatch.setattr(agent.ChatOpenAI, "_astream", _fake_astream)
+    llm = agent.CachedChatOpenAI(model="test-model", api_key="test-key", temperature=0)
+    return llm, stream
+
+
+async def _collect(llm) -> str:
+    return "".join([chunk.message.content async for chunk in llm._astream([HumanMessage(content="hi")])])
+
+
+def test_streamed_answer_is_cached_for_the_next_request(streaming_llm):
+    llm, stream = streaming_llm
+    stream["chunks"] = ["Hel", "lo"]
+
+    assert asyncio.run(_collect(llm)) == "Hello"
+    assert asyncio.run(_collect(llm)) == "Hello"
+    assert stream["calls"] == 1
+
+
+def test_empty_stream_is_not_cached_and_releases_the_key(streaming_llm, cache):
+    llm, stream = streaming_llm
+
+    assert asyncio.run(_collect(llm)) == ""
+    assert cache._inflight == {}
+
+    stream["chunks"] = ["retry"]
+    assert asyncio.run(asyncio.wait_for(_collect(llm), 5)) == "retry"
+    assert stream["calls"] == 2
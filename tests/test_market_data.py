@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import server
+
+
+class FakeMarketClient:
+    """client ปลอมแทน Yahoo: คืนแท่งทุกวันทำการในช่วง [start, end) ที่ไม่เกิน "วันนี้" ของนาฬิกาจำลอง"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = []
+        self.failing = set()
+        self.delay = 0.0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def fetch_bars(self, ticker, start, end):
+        with self._lock:
+            self.calls.append((ticker, start, end))
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if ticker in self.failing:
+            raise ConnectionError(f"upstream timeout for {ticker}")
+        last = min(end - timedelta(days=1), self.clock.now.date())
+        days = pd.bdate_range(start, last) if start <= last else pd.DatetimeIndex([])
+        price = [100.0 + day.toordinal() % 50 for day in days]
+        return pd.DataFrame(
+            {"Open": price, "High": price, "Low": price, "Close": price, "Volume": [1000.0] * len(days)},
+            index=days,
+        )
+
+
+class FrozenClock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ตรึง datetime.now()/time.time() ที่ server ใช้ไว้ที่ clock.now (เลื่อนเวลาได้ด้วยการแก้ clock.now)"""
+    frozen = FrozenClock(datetime(2026, 8, 10, 17, 0, tzinfo=server.MARKET_TZ))
+    real_time = server.time
+
+    class _FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return frozen.now.astimezone(tz) if tz else frozen.now.replace(tzinfo=None)
+
+    class _FrozenTime:
+        def time(self):
+            return frozen.now.timestamp()
+
+        def __getattr__(self, name):
+            return getattr(real_time, name)
+
+    monkeypatch.setattr(server, "datetime", _FrozenDatetime)
+    monkeypatch.setattr(server, "time", _FrozenTime())
+    return frozen
+
+
+@pytest.fixture
+def store(clock, tmp_path):
+    client = FakeMarketClient(clock)
+    data_store = server.MarketDataStore(client=client, path=os.fspath(tmp_path / "market.sqlite3"))
+    data_store.calls = client.calls
+    data_store.failing = client.failing
+    data_store.fake = client
+    return data_store
+
+
+def _dates(bars) -> list[str]:
+    return [bar["Date"] for bar in bars]
+
+
+def _business_days(start: date, end: date) -> list[str]:
+    return list(pd.bdate_range(start, end).strftime("%Y-%m-%d"))
+
+
+def test_short_period_request_after_a_long_gap_leaves_no_hole(store, clock):
+    assert len(store.get_bars("AAPL", "10d")) == 10
+
+    clock.now += timedelta(days=60)
+    today = clock.now.date()
+    assert _dates(store.get_bars("AAPL", "10d")) == _business_days(today - timedelta(days=30), today)[-10:]
+
+    # 3mo ย้อนไปถึงช่วงระหว่างสองคำขอแรก: ต้องมีครบทุกวันทำการ ไม่มีรูโหว่
+    start = today - timedelta(days=93)
+    assert _dates(store.get_bars("AAPL", "3mo")) == _business_days(start, today)
+
+
+def test_fresh_coverage_is_served_without_fetching(store, clock):
+    store.get_bars("MSFT", "1mo")
+    calls = len(store.calls)
+
+    clock.now += timedelta(hours=2)  # ยังเป็นช่วงหลังปิดตลาดวันเดียวกัน
+    store.get_bars("MSFT", "10d")
+
+    assert len(store.calls) == calls
+
+
+def test_next_day_fetch_only_extends_the_tail(store, clock):
+    store.get_bars("NVDA", "1mo")
+    last_bar = store.get_bars("NVDA", "10d")[-1]["Date"]
+
+    clock.now += timedelta(days=1)
+    bars = store.get_bars("NVDA", "1mo")
+
+    ticker, fetch_start, fetch_end = store.calls[-1]
+    assert fetch_start == date.fromisoformat(last_bar)
+    assert fetch_end == clock.now.date() + timedelta(days=1)
+    assert bars[-1]["Date"] == clock.now.date().isoformat()
+
+
+def test_missing_tickers_are_fetched_concurrently(store):
+    store.fake.delay = 0.2
+    store.max_workers = 4
+    tickers = [f"T{i}" for i in range(8)]
+
+    started = time.perf_counter()
+    bars = store.get_bars_many(tickers, "1mo")
+    elapsed = time.perf_counter() - started
+
+    assert store.fake.peak_in_flight == 4
+    assert elapsed < 0.2 * len(tickers) / 2
+    assert all(len(bars[ticker]) > 15 for ticker in tickers)
+
+
+def test_head_and_tail_gaps_of_one_ticker_are_fetched_together(store, clock):
+    store.get_bars("AAPL", "1mo")
+    clock.now += timedelta(days=3)
+    store.fake.delay = 0.2
+    store.fake.peak_in_flight = 0
+
+    bars = store.get_bars("AAPL", "3mo")
+
+    assert len(store.calls) == 3
+    assert store.fake.peak_in_flight == 2
+    start = clock.now.date() - timedelta(days=93)
+    assert _dates(bars) == _business_days(start, clock.now.date())
+
+
+def test_one_failing_ticker_does_not_fail_the_batch(store):
+    store.failing.add("BROKEN")
+
+    bars = store.get_bars_many(["aapl", "BROKEN", "MSFT"], "10d")
+
+    assert isinstance(bars["BROKEN"], ConnectionError)
+    assert len(bars["aapl"]) == len(bars["MSFT"]) == 10
+
+
+def test_stock_tool_reports_failed_tickers_per_ticker(store, monkeypatch):
+    monkeypatch.setattr(server, "market_data", store)
+    store.failing.add("BROKEN")
+
+    result = json.loads(asyncio.run(server.get_stock_price.fn(["AAPL", "BROKEN"], "10d")))
+
+    assert "upstream timeout" in result["BROKEN"]["error"]
+    assert len(result["AAPL"]) == 10
+
+
+def test_analyze_stocks_reports_failed_tickers_and_keeps_the_rest(store, monkeypatch):
+    monkeypatch.setattr(server, "market_data", store)
+    store.failing.add("BROKEN")
+
+    result = json.loads(asyncio.run(server.analyze_stocks.fn(["AAPL", "broken", "MSFT"], "3mo", [5, 20])))
+
+    assert "error" not in result
+    assert result["missing_tickers"] == ["BROKEN"]
+    assert set(result["summary"]) == {"AAPL", "MSFT"}
+
+
+def test_analyze_stocks_errors_only_when_every_ticker_fails(store, monkeypatch):
+    monkeypatch.setattr(server, "market_data", store)
+    store.failing.update({"AAPL", "MSFT"})
+
+    result = json.loads(asyncio.run(server.analyze_stocks.fn(["AAPL", "MSFT"], "3mo")))
+
+    assert "error" in result
+
+
+def test_table_file_output_refreshes_the_workspace_listing(store, clock, monkeypatch):
+    monkeypatch.setattr(server, "market_data", store)
+    # index ที่ไม่มี watcher และ TTL ยาว: ไฟล์ที่ถูกเขียนทับ (mtime ของโฟลเดอร์ไม่เปลี่ยน) จะเห็นได้ก็ต่อเมื่อ invalidate
+    index = server.WorkspaceIndex(root=server.WORKSPACE_DIR, ttl=3600)
+    if index._observer is not None:
+        index._observer.stop()
+        index._observer = None
+    monkeypatch.setattr(server, "workspace_index", index)
+
+    def _listed_and_actual_size():
+        result = json.loads(asyncio.run(server.get_stock_price.fn(["AAPL"], "ytd", "csv")))
+        listed = index.list(names=[result["file"]])["files"][0]["size_kb"]
+        return listed, f"{os.path.getsize(os.path.join(server.WORKSPACE_DIR, result['file'])) / 1024:.2f} KB"
+
+    listed, actual = _listed_and_actual_size()
+    assert listed == actual
+    clock.now += timedelta(days=7)  # ไฟล์ชื่อเดิมแต่มีแถวเพิ่ม
+    listed, actual = _listed_and_actual_size()
+    assert listed == actual
+
+
+def test_agent_stock_tool_defaults_to_records(mcp_pool):
+    import agent
+
+    payload = json.loads(asyncio.run(agent.get_stock_price.ainvoke({"tickers": ["AAPL"]})))
+    assert payload["arguments"]["output_format"] == "records"
+    payload = json.loads(agent.get_stock_price.invoke({"tickers": ["AAPL"]}))
+    assert payload["arguments"]["output_format"] == "records"
@@ -0,0 +1,54 @@
+import asyncio
+import json
+import threading
+import time
+
+import agent
+
+
+def test_pool_reuses_warm_sessions_instead_of_spawning_per_call(fake_mcp, mcp_pool):
+    # เวลาที่ประหยัดได้จริงวัดด้วย benchmarks/mcp_spawn_cost.py; ที่นี่ตรวจแค่ว่าไม่ spawn ต่อการเรียก
+    calls = 10
+
+    results = [json.loads(agent._run_async_tool("get_current_date", {})) for _ in range(calls)]
+
+    assert all(result["tool"] == "get_current_date" for result in results)
+    assert len(fake_mcp.spawns) == mcp_pool.size
+    assert {result["spawn"] for result in results} <= set(fake_mcp.spawns)
+    assert mcp_pool.stats()["calls"] == calls
+
+
+def test_pinned_tools_always_run_on_the_first_worker(mcp_pool):
+    mcp_pool.call("get_current_date", {})  # เปิด worker ทั้งหมดก่อน
+    spawns = {json.loads(mcp_pool.call("save_memory_chunk", {"delay": 0.01}))["spawn"] for _ in range(6)}
+    assert len(spawns) == 1
+
+
+def test_worker_respawns_and_retries_the_call_after_a_crash(fake_mcp, mcp_pool):
+    started = time.perf_counter()
+    result = json.loads(mcp_pool.call("read_from_file", {"crash": True}))
+
+    assert result["tool"] == "read_from_file"
+    assert len(fake_mcp.spawns) > mcp_pool.size
+    assert mcp_pool.stats()["respawns"] >= 1
+    # งานที่ถูกคืนเข้า queue ต้องได้รันบน session ใหม่ ไม่ใช่รอจน timeout
+    assert time.perf_counter() - started < mcp_pool.call_timeout
+
+
+def test_stats_are_consistent_under_concurrent_callers(mcp_pool):
+    threads, calls_per_thread = 8, 25
+
+    def _caller():
+        for _ in range(calls_per_thread):
+            mcp_pool.call("get_current_date", {})
+
+    workers = [threading.Thread(target=_caller) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    stats = mcp_pool.stats()
+    assert stats["calls"] == threads * calls_per_thread
+    assert stats["errors"] == 0
+    assert stats["pending"] == [0] * mcp_pool.size
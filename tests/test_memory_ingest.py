@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+
+import server
+
+
+def _save(content: str, metadata: dict = None) -> dict:
+    return json.loads(asyncio.run(server.save_memory_chunk.fn(content, metadata)))
+
+
+def test_saved_memory_is_written_before_the_tool_returns(memory_store):
+    result = _save("ลูกค้าชอบกาแฟดำ", {"source": "chat"})
+
+    assert result["status"] == "success"
+    assert memory_store.buffer.stats()["pending"] == 0
+    stored = memory_store.collection.get(include=["documents", "metadatas"])
+    assert stored["documents"] == ["ลูกค้าชอบกาแฟดำ"]
+    assert stored["metadatas"][0]["source"] == "chat"
+    assert server._memory_id("ลูกค้าชอบกาแฟดำ") in result["message"]
+
+
+def test_concurrent_saves_are_written_together(memory_store):
+    memory_store.model.delay = 0.05  # ให้ flush แรกใช้เวลาพอให้ตัวอื่นเข้าคิวระหว่างนั้น
+    callers = 8
+    barrier = threading.Barrier(callers)
+    results = []
+
+    def _caller(i):
+        barrier.wait()
+        results.append(_save(f"memory number {i}"))
+
+    workers = [threading.Thread(target=_caller, args=(i,)) for i in range(callers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+
+    assert [result["status"] for result in results] == ["success"] * callers
+    assert memory_store.collection.count() == callers
+    stats = memory_store.buffer.stats()
+    assert stats["written"] == callers
+    assert stats["flushes"] < callers
+
+
+def test_failed_write_is_reported_and_retried(memory_store, monkeypatch):
+    real_add = memory_store.collection.add
+    failures = iter([True])
+
+    def _flaky_add(**kwargs):
+        if next(failures, False):
+            raise ConnectionError("disk is busy")
+        return real_add(**kwargs)
+
+    monkeypatch.setattr(memory_store.collection, "add", _flaky_add)
+
+    failed = _save("สำคัญมาก")
+
+    assert "error" in failed and "retried" in failed["error"]
+    assert memory_store.buffer.stats()["pending"] == 1
+    assert memory_store.buffer.flush() == 1
+    assert memory_store.collection.get()["documents"] == ["สำคัญมาก"]
+
+
+def test_duplicate_content_is_stored_once(memory_store):
+    first = _save("ประชุมทุกวันจันทร์ 10 โมง")
+    second = _save("  ประชุมทุกวันจันทร์ 10 โมง  ")
+
+    assert first["message"] == second["message"]
+    assert memory_store.collection.count() == 1
+    assert memory_store.buffer.stats()["deduplicated"] == 1
+
+
+def test_batch_save_writes_every_chunk_in_one_flush(memory_store):
+    chunks = [{"content": f"fact {i}", "metadata": {"source": "import"}} for i in range(40)]
+    chunks.append({"content": "fact 0"})
+
+    result = json.loads(asyncio.run(server.save_memory_chunks.fn(chunks)))
+
+    assert result["status"] == "success"
+    assert len(set(result["ids"])) == 40
+    assert memory_store.collection.count() == 40
+    assert result["ingest"]["pending"] == 0
+    # ครบ batch_size (32) ระหว่างเพิ่ม จึง flush ไปก่อนหนึ่งครั้ง แล้วที่เหลือ flush ตอนจบ
+    assert result["ingest"]["flushes"] == 2
+    assert memory_store.model.calls <= 2
+
+
+def test_batch_save_rejects_empty_chunks(memory_store):
+    result = json.loads(asyncio.run(server.save_memory_chunks.fn([{"content": "ok"}, {"content": "  "}])))
+
+    assert "error" in result
+    assert memory_store.collection.count() == 0
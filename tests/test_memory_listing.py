@@ -0,0 +1,135 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import app
+import server
+
+
+def _list(**kwargs) -> dict:
+    return json.loads(asyncio.run(server.list_all_memories.fn(**kwargs)))
+
+
+def _save(memory_store, count: int) -> list[str]:
+    ids = [memory_store.buffer.add(f"memory number {i}", {"source": "test"})[0] for i in range(count)]
+    memory_store.buffer.flush()
+    return ids
+
+
+def test_cursor_pages_cover_every_memory_once(memory_store):
+    ids = _save(memory_store, 7)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = _list(limit=3, cursor=cursor)
+        assert page["total"] == 7
+        seen += [memory["id"] for memory in page["memories"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert sorted(seen) == sorted(ids)
+    assert page["next_offset"] is None
+
+
+def test_offset_and_cursor_agree(memory_store):
+    _save(memory_store, 5)
+
+    first = _list(limit=2)
+    by_cursor = _list(limit=2, cursor=first["next_cursor"])
+    by_offset = _list(limit=2, offset=first["next_offset"])
+
+    assert by_cursor == by_offset
+    assert by_cursor["offset"] == 2
+
+
+def test_limit_is_clamped(memory_store, monkeypatch):
+    monkeypatch.setattr(server, "MEMORY_LIST_MAX_LIMIT", 4)
+    _save(memory_store, 6)
+
+    assert len(_list(limit=100)["memories"]) == 4
+    assert len(_list(limit=0)["memories"]) == 1
+
+
+def test_count_and_metadata_modes(memory_store):
+    _save(memory_store, 3)
+    memory_store.buffer.add("queued but not flushed yet")
+
+    assert _list(mode="count") == {"total": 4}
+    memories = _list(mode="metadata")["memories"]
+    assert len(memories) == 4
+    assert all("content" not in memory and "saved_at" in memory["metadata"] for memory in memories)
+    assert all("content" in memory for memory in _list(mode="full")["memories"])
+
+
+def test_bad_mode_and_cursor_are_reported(memory_store):
+    assert "error" in _list(mode="everything")
+    assert _list(cursor="not-a-cursor") == {"error": "Invalid cursor."}
+
+
+class FakeChainlit:
+    """แทนโมดูล chainlit เท่าที่ปุ่มดูความทรงจำใช้ และบันทึกข้อความที่ถูกส่ง"""
+
+    def __init__(self):
+        self.sent = []
+        ui = self
+
+        class Message:
+            def __init__(self, content="", actions=None):
+                self.content, self.actions = content, actions or []
+
+            async def send(self):
+                ui.sent.append(self)
+                return self
+
+        class Action:
+            def __init__(self, name, payload, label):
+                self.name, self.payload, self.label = name, payload, label
+                self.removed = False
+
+            async def remove(self):
+                self.removed = True
+
+        self.Message, self.ErrorMessage, self.Action = Message, Message, Action
+
+
+def test_view_memories_loads_one_page_per_click(memory_store, monkeypatch):
+    _save(memory_store, 5)
+    ui = FakeChainlit()
+    calls = []
+
+    async def list_memories(**kwargs):
+        calls.append(kwargs)
+        return await server.list_all_memories.fn(**kwargs)
+
+    monkeypatch.setattr(app, "cl", ui)
+    monkeypatch.setattr(app, "MEMORY_PAGE_SIZE", 2)
+    monkeypatch.setattr(app, "async_list_all_memories", list_memories)
+
+    asyncio.run(app.on_action_view_memories(SimpleNamespace(payload={})))
+    pages = [message for message in ui.sent if message.content.startswith("### 🧠")]
+    assert len(pages) == 1 and "(1–2 of 5)" in pages[0].content
+    more = pages[0].actions[0]
+    assert more.name == "view_memories_more"
+
+    asyncio.run(app.on_action_view_memories_more(more))
+    assert more.removed
+    assert "(3–4 of 5)" in ui.sent[-1].content
+
+    asyncio.run(app.on_action_view_memories_more(ui.sent[-1].actions[0]))
+    assert "(5–5 of 5)" in ui.sent[-1].content
+    assert ui.sent[-1].actions == []
+    assert all(call["limit"] == 2 for call in calls) and len(calls) == 3
+
+
+def test_view_memories_reports_an_empty_store(memory_store, monkeypatch):
+    ui = FakeChainlit()
+    monkeypatch.setattr(app, "cl", ui)
+    monkeypatch.setattr(app, "async_list_all_memories", lambda **kwargs: server.list_all_memories.fn(**kwargs))
+
+    asyncio.run(app.on_action_view_memories(SimpleNamespace(payload={})))
+
+    assert ui.sent[-1].content == "ยังไม่มีความทรงจำใดๆ ถูกบันทึกไว้ครับ"
+    assert ui.sent[-1].actions == []
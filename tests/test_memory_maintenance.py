@@ -0,0 +1,121 @@
+import asyncio
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import server
+
+DIMENSIONS = 64
+
+
+def _direction(degrees: float, axis: int = 1) -> list[float]:
+    """vector หน่วยบนระนาบ (แกน 0, แกน axis) ที่ทำมุม degrees กับแกน 0: cosine ระหว่างสอง vector = cos(ผลต่างของมุม)"""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    vector[0], vector[axis] = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+    return vector.tolist()
+
+
+def _remember(store, doc_id: str, document: str, saved_at: str, embedding: list[float] = None, **metadata):
+    # ไม่ระบุ embedding: ได้แกนของตัวเอง (ตั้งฉากกับทุกตัว จึงไม่ซ้ำกับใคร)
+    embedding = embedding or _direction(90, axis=2 + len(store.collection.get()["ids"]) % (DIMENSIONS - 2))
+    store.collection.add(ids=[doc_id], documents=[document], embeddings=[embedding],
+                         metadatas=[{"saved_at": saved_at, **metadata}])
+
+
+def _ids(store) -> set[str]:
+    return set(store.collection.get()["ids"])
+
+
+def _days_ago(days: float) -> str:
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+
+def test_expired_memories_are_deleted(memory_store):
+    _remember(memory_store, "old", "เรื่องเก่า", _days_ago(400))
+    _remember(memory_store, "recent", "เรื่องใหม่", _days_ago(3))
+
+    report = server.run_memory_maintenance(ttl_days=30, merge_threshold=1)
+
+    assert report["expired"] == 1
+    assert _ids(memory_store) == {"recent"}
+    assert "old" not in memory_store.index.search("เรื่องเก่า", 5)
+
+
+def test_ttl_and_older_than_use_the_less_aggressive_cutoff(memory_store):
+    _remember(memory_store, "2020", "ปี 2020", "2020-01-01T00:00:00")
+    _remember(memory_store, "last-year", "ปีที่แล้ว", _days_ago(200))
+    _remember(memory_store, "today", "วันนี้", _days_ago(0))
+
+    # older_than ลบแค่ก่อนปี 2021 ส่วน ttl_days=30 จะลบทั้งสองตัว: ต้องเลือกที่ลบน้อยกว่า
+    report = server.run_memory_maintenance(ttl_days=30, older_than="2021-01-01", merge_threshold=1)
+
+    assert report["expired"] == 1
+    assert _ids(memory_store) == {"last-year", "today"}
+
+
+def test_orphaned_memories_are_deleted(memory_store):
+    os.makedirs(server.WORKSPACE_DIR, exist_ok=True)
+    with open(os.path.join(server.WORKSPACE_DIR, "kept.txt"), "w", encoding="utf-8") as f:
+        f.write("still here")
+    now = _days_ago(0)
+    _remember(memory_store, "empty", "   ", now)
+    _remember(memory_store, "deleted-file", "chunk of a removed file", now, workspace_file="gone.pdf")
+    _remember(memory_store, "live-file", "chunk of a file that exists", now, workspace_file="kept.txt")
+    _remember(memory_store, "plain", "ordinary memory", now)
+
+    report = server.run_memory_maintenance(ttl_days=0, merge_threshold=1)
+
+    assert report["orphaned"] == 2
+    assert _ids(memory_store) == {"live-file", "plain"}
+
+
+def test_near_duplicates_are_compared_with_the_kept_memory_not_chained(memory_store):
+    # newest ~ middle (cos 0.98) และ middle ~ oldest (cos 0.98) แต่ newest กับ oldest ห่างกัน (cos 0.92)
+    step = math.degrees(math.acos(0.98))
+    _remember(memory_store, "newest", "ประชุมวันจันทร์ 10 โมง", _days_ago(1), _direction(0))
+    _remember(memory_store, "middle", "ประชุมวันจันทร์ 10:00", _days_ago(2), _direction(step))
+    _remember(memory_store, "oldest", "ประชุมวันจันทร์ตอนเช้า", _days_ago(3), _direction(2 * step))
+    _remember(memory_store, "other", "ชอบกาแฟดำ", _days_ago(1), _direction(90))
+
+    report = server.run_memory_maintenance(ttl_days=0, merge_threshold=0.97)
+
+    assert report["merged_groups"] == 1
+    assert report["merged_memories"] == 1
+    assert _ids(memory_store) == {"newest", "oldest", "other"}
+    kept = memory_store.collection.get(ids=["newest"], include=["metadatas"])["metadatas"][0]
+    assert kept["merged_count"] == 1
+    assert "middle" not in memory_store.index.search("ประชุมวันจันทร์", 10)
+
+
+def test_dry_run_reports_without_deleting(memory_store):
+    _remember(memory_store, "old", "เรื่องเก่า", _days_ago(400))
+    _remember(memory_store, "empty", "", _days_ago(1))
+    _remember(memory_store, "a", "ซ้ำ", _days_ago(1), _direction(0))
+    _remember(memory_store, "b", "ซ้ำกัน", _days_ago(2), _direction(1))
+
+    report = json.loads(asyncio.run(server.maintain_memories.fn(ttl_days=30, dry_run=True, wait=True)))
+
+    assert (report["expired"], report["orphaned"], report["merged_memories"]) == (1, 1, 1)
+    assert report["dry_run"] is True
+    assert _ids(memory_store) == {"old", "empty", "a", "b"}
+    assert report["after"]["memories"] == report["before"]["memories"] == 4
+
+
+def test_background_run_is_reported(memory_store):
+    _remember(memory_store, "old", "เรื่องเก่า", _days_ago(400))
+
+    previous = server._maintenance_state["last_report"]
+    started = json.loads(asyncio.run(server.maintain_memories.fn(ttl_days=30, merge_threshold=1)))
+    assert started["status"] == "started"
+    deadline = time.monotonic() + 10
+    while server._maintenance_state["last_report"] is previous and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    status = json.loads(asyncio.run(server.memory_maintenance_report.fn()))
+    assert status["running"] is False
+    assert status["last_report"]["expired"] == 1
+    assert _ids(memory_store) == set()
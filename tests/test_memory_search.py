@@ -0,0 +1,142 @@
+import asyncio
+import json
+import math
+
+import server
+
+
+def _search(**kwargs) -> dict:
+    return json.loads(asyncio.run(server.search_relevant_memories.fn(**kwargs)))
+
+
+def _add(memory_store, memories: dict[str, tuple[str, dict]]):
+    """เขียนตรงลง collection (คง saved_at ที่กำหนดเอง) แล้วให้ index รู้เหมือนการเขียนผ่าน buffer"""
+    ids = list(memories)
+    documents = [memories[doc_id][0] for doc_id in ids]
+    metadatas = [memories[doc_id][1] for doc_id in ids]
+    memory_store.collection.add(ids=ids, documents=documents, metadatas=metadatas)
+    memory_store.index.add(ids, documents, metadatas)
+
+
+def _reference_bm25(documents: dict[str, str], query: str, k1=1.5, b=0.75) -> dict[str, float]:
+    tokenized = {doc_id: server._keyword_tokens(text) for doc_id, text in documents.items()}
+    average = sum(len(tokens) for tokens in tokenized.values()) / len(tokenized)
+    scores = {}
+    for token in set(server._keyword_tokens(query)):
+        containing = [doc_id for doc_id, tokens in tokenized.items() if token in tokens]
+        idf = math.log(1 + (len(documents) - len(containing) + 0.5) / (len(containing) + 0.5))
+        for doc_id in containing:
+            tf = tokenized[doc_id].count(token)
+            length = len(tokenized[doc_id])
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average))
+    return scores
+
+
+def test_thai_words_become_character_bigrams():
+    assert server._keyword_tokens("ชอบกาแฟ NVDA-2024") == ["ชอ", "อบ", "บก", "กา", "าแ", "แฟ", "nvda", "2024"]
+    assert server._keyword_tokens("ดี ok") == ["ดี", "ok"]
+
+
+def test_thai_substring_is_found_without_word_boundaries(memory_store):
+    memory_store.buffer.add("วันนี้ชอบกาแฟดำไม่ใส่น้ำตาล")
+    memory_store.buffer.add("ประชุมทีมขายวันจันทร์")
+
+    memories = _search(query="กาแฟ", mode="keyword")["memories"]
+
+    assert [m["content"] for m in memories] == ["วันนี้ชอบกาแฟดำไม่ใส่น้ำตาล"]
+    assert memories[0]["matched_by"] == ["keyword"]
+
+
+def test_exact_ticker_and_id_rank_first(memory_store):
+    for text in ["ราคาหุ้นเทคโนโลยีปรับขึ้น", "ticket INC-4821 ยังไม่ปิด", "ถือ NVDA ไว้ 20 หุ้น", "ticket INC-1000 ปิดแล้ว"]:
+        memory_store.buffer.add(text)
+
+    assert _search(query="NVDA", mode="keyword")["memories"][0]["content"] == "ถือ NVDA ไว้ 20 หุ้น"
+    assert _search(query="INC-4821", mode="keyword")["memories"][0]["content"] == "ticket INC-4821 ยังไม่ปิด"
+
+
+def test_bm25_scores_match_the_formula(memory_store):
+    documents = {
+        "a": "apple banana apple",
+        "b": "banana cherry",
+        "c": "apple cherry cherry durian elderberry",
+        "d": "fig grape",
+    }
+    _add(memory_store, {doc_id: (text, {"source": "test"}) for doc_id, text in documents.items()})
+    memory_store.index.search("warm up", 1)
+    server._delete_memories(["d"])
+    del documents["d"]
+
+    expected = _reference_bm25(documents, "apple cherry")
+    ranked = memory_store.index.search("apple cherry", 10)
+
+    assert ranked == sorted(expected, key=expected.get, reverse=True)
+    assert memory_store.index.search("apple cherry", 1) == ranked[:1]
+
+
+def test_hybrid_fuses_both_rankings(memory_store):
+    for text in ["ถือ NVDA ไว้ 20 หุ้น", "ราคาหุ้นเทคโนโลยี", "นัดหมอฟัน"]:
+        memory_store.buffer.add(text)
+
+    memories = _search(query="NVDA", mode="hybrid", n_results=3)["memories"]
+
+    top = memories[0]
+    assert top["content"] == "ถือ NVDA ไว้ 20 หุ้น"
+    assert sorted(top["matched_by"]) == ["keyword", "vector"]
+    # อันดับ 1 ทั้งสองรายการ: 1/(60+1) สองครั้ง
+    assert top["score"] == round(2 / (server._RRF_K + 1), 5)
+    assert all(m["matched_by"] == ["vector"] for m in memories[1:])
+    assert [m["score"] for m in memories] == sorted((m["score"] for m in memories), reverse=True)
+
+
+def test_source_and_date_filters_apply_to_both_rankings(memory_store):
+    _add(memory_store, {
+        "old-chat": ("NVDA earnings note", {"source": "chat", "saved_at": "2024-01-10T09:00:00"}),
+        "new-chat": ("NVDA guidance note", {"source": "chat", "saved_at": "2025-03-01T09:00:00"}),
+        "new-web": ("NVDA news from the web", {"source": "web", "saved_at": "2025-03-02T09:00:00"}),
+    })
+
+    for mode in ("keyword", "vector", "hybrid"):
+        by_source = _search(query="NVDA", mode=mode, source="chat")["memories"]
+        assert sorted(m["id"] for m in by_source) == ["new-chat", "old-chat"], mode
+        by_date = _search(query="NVDA", mode=mode, saved_after="2025-01-01", saved_before="2025-03-01T23:59")["memories"]
+        assert [m["id"] for m in by_date] == ["new-chat"], mode
+
+
+def test_repeated_query_is_served_from_cache_until_a_write(memory_store, monkeypatch):
+    memory_store.buffer.add("ถือ NVDA ไว้ 20 หุ้น")
+    calls = []
+    search = memory_store.index.search
+    monkeypatch.setattr(memory_store.index, "search", lambda *args: calls.append(args) or search(*args))
+
+    first = _search(query="NVDA", mode="keyword")
+    second = _search(query="NVDA", mode="keyword")
+    assert first == second and len(calls) == 1
+
+    # พารามิเตอร์ต่างกันคือคนละรายการในแคช
+    _search(query="NVDA", mode="keyword", n_results=1)
+    assert len(calls) == 2
+
+    memory_store.buffer.add("ขาย NVDA ไปครึ่งหนึ่ง")
+    after_write = _search(query="NVDA", mode="keyword")
+    assert len(calls) == 3
+    assert len(after_write["memories"]) == 2
+
+
+def test_deleted_memories_leave_the_cache_and_the_index(memory_store):
+    _add(memory_store, {"keep": ("NVDA long term", {"source": "test"}), "drop": ("NVDA short term", {"source": "test"})})
+    assert len(_search(query="NVDA", mode="keyword")["memories"]) == 2
+
+    server._delete_memories(["drop"])
+
+    assert [m["id"] for m in _search(query="NVDA", mode="keyword")["memories"]] == ["keep"]
+
+
+def test_index_compacts_after_many_deletes(memory_store):
+    memories = {f"m{i}": (f"note {i} about {'NVDA' if i % 2 else 'AAPL'}", {"source": "test"}) for i in range(3000)}
+    _add(memory_store, memories)
+    memory_store.index.search("warm up", 1)
+    server._delete_memories([f"m{i}" for i in range(2000)])
+
+    assert len(memory_store.index._ids) < 3000
+    assert sorted(memory_store.index.search("NVDA", 1000)) == sorted(f"m{i}" for i in range(2000, 3000) if i % 2)
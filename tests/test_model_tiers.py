@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.messages import HumanMessage
+
+import agent
+
+CHEAP, STRONG = "cheap-model", "strong-model"
+STRONG_ANSWER = "คำตอบจากโมเดลหลัก"
+SLOW_TOKEN_SECONDS = 0.3
+
+
+def _sse(payload: dict) -> bytes:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _delta(model: str, delta: dict, finish_reason=None) -> bytes:
+    return _sse({
+        "id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    })
+
+
+def _usage(model: str, prompt_tokens: int, completion_tokens: int) -> bytes:
+    return _sse({
+        "id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": [],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+
+def _tool_call(name: str, arguments: str, usage=(120, 15)):
+    yield _delta(CHEAP, {"role": "assistant", "content": None, "tool_calls": [{
+        "index": 0, "id": "call_1", "type": "function", "function": {"name": name, "arguments": arguments},
+    }]})
+    yield _delta(CHEAP, {}, "tool_calls")
+    yield _usage(CHEAP, *usage)
+    yield b"data: [DONE]\n\n"
+
+
+def _slow_text(model: str, tokens: list[str], usage=(300, 40)):
+    yield _delta(model, {"role": "assistant", "content": ""})
+    for token in tokens:
+        yield _delta(model, {"content": token})
+        time.sleep(SLOW_TOKEN_SECONDS)
+    yield _delta(model, {}, "stop")
+    yield _usage(model, *usage)
+    yield b"data: [DONE]\n\n"
+
+
+@pytest.fixture
+def endpoint(local_site):
+    """endpoint แบบ OpenAI ที่แยกคำตอบตามชื่อโมเดล: scenario["cheap"] คือ stream ที่โมเดลราคาถูกจะตอบ"""
+    scenario = {"cheap": None, "calls": {CHEAP: 0, STRONG: 0}}
+
+    def _chat_completions(request):
+        body = json.loads(local_site.requests[-1]["body"])
+        scenario["calls"][body["model"]] += 1
+        if body["model"] == CHEAP:
+            assert body.get("stream"), "cheap model must be streamed so the router can cut it off"
+            return 200, {"Content-Type": "text/event-stream"}, scenario["cheap"]()
+        if body.get("stream"):
+            return 200, {"Content-Type": "text/event-stream"}, _slow_text(STRONG, [STRONG_ANSWER], usage=(310, 25))
+        return 200, {"Content-Type": "application/json"}, json.dumps({
+            "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": STRONG,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": STRONG_ANSWER}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 310, "completion_tokens": 25, "total_tokens": 335},
+        })
+
+    local_site.routes["/v1/chat/completions"] = _chat_completions
+    scenario["base_url"] = local_site.base_url + "/v1"
+    return scenario
+
+
+@pytest.fixture
+def router(endpoint, tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, "llm_cache", agent.LLMResponseCache(path=os.fspath(tmp_path / "llm.sqlite3")))
+
+    def _llm(model):
+        return agent.CachedChatOpenAI(model=model, api_key="test-key", base_url=endpoint["base_url"], stream_usage=True)
+
+    return agent.ModelTierRouter(_llm(CHEAP), _llm(STRONG))
+
+
+PROMPT = ChatPromptValue(messages=[HumanMessage(content="2 + 2 เท่ากับเท่าไร")])
+
+
+def _route(router, prompt=PROMPT):
+    return asyncio.run(asyncio.wait_for(router.runnable([agent.calculator]).ainvoke(prompt), 30))
+
+
+def test_valid_tool_call_from_the_cheap_model_is_used_as_is(router, endpoint):
+    endpoint["cheap"] = lambda: _tool_call("calculator", json.dumps({"expression": "2 + 2"}))
+
+    message = _route(router)
+
+    assert message.tool_calls[0]["name"] == "calculator"
+    assert endpoint["calls"] == {CHEAP: 1, STRONG: 0}
+    assert router.stats()["tool_steps"] == 1
+
+
+@pytest.mark.parametrize("name, arguments", [
+    ("calculator", '{"expression": "2 + '),
+    ("no_such_tool", json.dumps({"expression": "2 + 2"})),
+])
+def test_broken_tool_call_escalates_to_the_strong_model(router, endpoint, name, arguments):
+    endpoint["cheap"] = lambda: _tool_call(name, arguments)
+
+    message = _route(router)
+
+    assert message.content == STRONG_ANSWER
+    assert endpoint["calls"] == {CHEAP: 1, STRONG: 1}
+    stats = router.stats()
+    assert stats["escalations"] == 1
+    assert stats["tool_steps"] == stats["synthesis"] == 0
+
+
+def test_cheap_model_is_cut_off_at_its_first_answer_token(router, endpoint):
+    endpoint["cheap"] = lambda: _slow_text(CHEAP, ["คำตอบ", "ยาว", "ที่", "ไม่", "มี", "ใคร", "อ่าน"])
+
+    started = time.perf_counter()
+    message = _route(router)
+    elapsed = time.perf_counter() - started
+
+    assert message.content == STRONG_ANSWER
+    assert endpoint["calls"] == {CHEAP: 1, STRONG: 1}
+    assert router.stats()["synthesis"] == 1
+    # cheap จะใช้เวลา 7 token * SLOW_TOKEN_SECONDS ถ้าอ่านจนจบ ส่วน strong ใช้ 1 token
+    assert elapsed < SLOW_TOKEN_SECONDS * 4
+
+
+def test_tokens_and_calls_are_accounted_per_tier(router, endpoint):
+    endpoint["cheap"] = lambda: _tool_call("calculator", json.dumps({"expression": "2 + 2"}), usage=(120, 15))
+    _route(router)
+    endpoint["cheap"] = lambda: _tool_call("calculator", '{"broken', usage=(130, 9))
+    _route(router)
+
+    tiers = router.stats()["tiers"]
+    assert tiers["cheap"]["calls"] == 2
+    assert (tiers["cheap"]["prompt_tokens"], tiers["cheap"]["completion_tokens"]) == (250, 24)
+    assert tiers["strong"]["calls"] == 1
+    assert (tiers["strong"]["prompt_tokens"], tiers["strong"]["completion_tokens"]) == (310, 25)
+
+
+def test_cut_off_cheap_step_is_still_accounted(router, endpoint):
+    endpoint["cheap"] = lambda: _slow_text(CHEAP, ["คำตอบ", "ยาว"])
+
+    _route(router)
+
+    cheap = router.stats()["tiers"]["cheap"]
+    assert cheap["calls"] == 1
+    # stream ถูกตัดก่อน provider ส่ง usage จึงประมาณจาก tokenizer แทน
+    assert cheap["prompt_tokens"] > 0
+    assert cheap["completion_tokens"] > 0
+
+
+def test_cheap_model_tokens_are_tagged_for_the_ui_to_skip(router, endpoint):
+    endpoint["cheap"] = lambda: _slow_text(CHEAP, ["คำตอบ", "ยาว"])
+
+    async def _events():
+        runnable = router.runnable([agent.calculator])
+        return [event async for event in runnable.astream_events(PROMPT, version="v2")
+                if event["event"] == "on_chat_model_stream" and event["data"]["chunk"].content]
+
+    events = asyncio.run(asyncio.wait_for(_events(), 30))
+
+    untagged = [event["data"]["chunk"].content for event in events if agent.CHEAP_TIER_TAG not in event["tags"]]
+    assert "".join(untagged) == STRONG_ANSWER
+    assert any(agent.CHEAP_TIER_TAG in event["tags"] for event in events)
@@ -0,0 +1,88 @@
+import uuid
+
+import pytest
+
+import server
+
+ARTICLE = "<html><body><article><p>{text}</p></article></body></html>"
+
+
+@pytest.fixture
+def versioned_page(local_site):
+    """หน้าเว็บที่มี ETag: ตอบ 304 เมื่อ If-None-Match ตรงกับเวอร์ชันปัจจุบัน"""
+    page = {"version": 1, "path": f"/article-{uuid.uuid4().hex}"}
+
+    def _route(request):
+        etag = f'"v{page["version"]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        body = ARTICLE.format(text=f"Article body version {page['version']}")
+        return 200, {"Content-Type": "text/html; charset=utf-8", "ETag": etag}, body
+
+    local_site.routes[page["path"]] = _route
+    page["url"] = local_site.base_url + page["path"]
+    page["requests"] = lambda: [r for r in local_site.requests if r["path"].split("?")[0] == page["path"]]
+    return page
+
+
+def test_fresh_page_is_served_from_cache_without_a_request(versioned_page):
+    before = server.page_cache.stats()
+
+    first = server._browse_page(versioned_page["url"])
+    second = server._browse_page(versioned_page["url"])
+
+    assert "Article body version 1" in first["content"]
+    assert second["content"] == first["content"]
+    assert len(versioned_page["requests"]()) == 1
+    after = server.page_cache.stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+
+def test_stale_page_is_revalidated_with_etag(versioned_page, monkeypatch):
+    server._browse_page(versioned_page["url"])
+    monkeypatch.setattr(server, "PAGE_CACHE_TTL", 0)
+    before = server.page_cache.stats()
+
+    result = server._browse_page(versioned_page["url"])
+
+    requests = versioned_page["requests"]()
+    assert len(requests) == 2
+    assert requests[1]["headers"].get("If-None-Match") == '"v1"'
+    assert "Article body version 1" in result["content"]
+    assert server.page_cache.stats()["revalidated"] == before["revalidated"] + 1
+
+
+def test_changed_page_replaces_the_cached_copy(versioned_page, monkeypatch):
+    server._browse_page(versioned_page["url"])
+    monkeypatch.setattr(server, "PAGE_CACHE_TTL", 0)
+    versioned_page["version"] = 2
+
+    result = server._browse_page(versioned_page["url"])
+
+    assert "Article body version 2" in result["content"]
+    assert "Article body version 2" in server.page_cache.get(server._normalize_url(versioned_page["url"]))["content"]
+
+
+def test_tracking_parameters_share_one_cache_entry(versioned_page):
+    server._browse_page(versioned_page["url"] + "?utm_source=newsletter")
+    server._browse_page(versioned_page["url"])
+
+    assert len(versioned_page["requests"]()) == 1
+
+
+def test_storing_a_page_purges_entries_older_than_the_ttl(tmp_path, monkeypatch):
+    cache = server.PageCache(path=str(tmp_path / "pages.sqlite3"), ttl=60)
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(server.time, "time", lambda: clock["now"])
+
+    cache.put("old", "http://example.test/old", "old page", None, None)
+    clock["now"] += 30
+    cache.put("recent", "http://example.test/recent", "recent page", None, None)
+    clock["now"] += 40
+    cache.put("new", "http://example.test/new", "new page", None, None)
+
+    assert cache.get("old") is None
+    assert cache.get("recent")["content"] == "recent page"
+    assert cache.get("new")["content"] == "new page"
+    assert cache.stats()["expired"] == 1
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import time
+
+from fastmcp import Client
+
+import server
+
+SLOW_FETCH_SECONDS = 0.5
+
+
+class SlowMarketData:
+    """แทน market_data ด้วยตัวที่ block thread เหมือนรอ Yahoo ตอบ"""
+
+    def get_bars_many(self, tickers, period):
+        time.sleep(SLOW_FETCH_SECONDS)
+        bar = {"Date": "2026-08-10", "Open": 1.0, "High": 1.0, "Low": 1.0, "Close": 1.0, "Volume": 1.0}
+        return {ticker: [bar] for ticker in tickers}
+
+
+async def _timed(awaitable):
+    started = time.perf_counter()
+    result = await awaitable
+    return result, time.perf_counter() - started
+
+
+def test_blocking_tool_does_not_stall_other_calls(monkeypatch):
+    monkeypatch.setattr(server, "market_data", SlowMarketData())
+
+    async def _scenario():
+        async with Client(server.mcp) as client:
+            slow = asyncio.create_task(client.call_tool("get_stock_price", {"tickers": ["AAPL"]}))
+            # วัดว่า event loop (ที่ FastMCP ใช้รับ request อื่น) ค้างนานสุดเท่าไรระหว่างที่ tool ช้ากำลังรัน
+            max_lag, dates = 0.0, []
+            while not slow.done():
+                tick = time.perf_counter()
+                await asyncio.sleep(0.01)
+                max_lag = max(max_lag, time.perf_counter() - tick)
+                if not dates:
+                    dates.append(await client.call_tool("get_current_date", {}))
+            return max_lag, dates, await slow
+
+    max_lag, dates, price_result = asyncio.run(_scenario())
+
+    assert "current_datetime" in json.loads(dates[0].content[0].text)
+    assert max_lag < SLOW_FETCH_SECONDS / 2
+    assert json.loads(price_result.content[0].text)["AAPL"][0]["Close"] == 1.0
+
+
+def test_blocking_tools_run_concurrently(monkeypatch):
+    monkeypatch.setattr(server, "market_data", SlowMarketData())
+    calls = 4
+
+    async def _scenario():
+        async with Client(server.mcp) as client:
+            return await _timed(asyncio.gather(*(
+                client.call_tool("get_stock_price", {"tickers": [f"T{i}"]}) for i in range(calls)
+            )))
+
+    results, seconds = asyncio.run(_scenario())
+
+    assert len(results) == calls
+    assert seconds < SLOW_FETCH_SECONDS * calls / 2
+
+
+def test_thread_wrapped_tools_keep_their_schema():
+    schema = server.read_from_file.parameters
+    assert set(schema["properties"]) == {"filename", "offset", "length"}
+    assert schema["required"] == ["filename"]
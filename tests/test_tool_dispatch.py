@@ -0,0 +1,78 @@
+import asyncio
+
+from langchain_core.agents import AgentActionMessageLog, AgentFinish
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import tool
+
+import agent
+
+
+class ConcurrencyProbe:
+    """นับจำนวน tool ที่รันอยู่พร้อมกันสูงสุด (ทั้งหมด และแยกตามแชท)"""
+
+    def __init__(self):
+        self.running, self.peak = 0, 0
+        self.per_chat, self.peak_per_chat = {}, {}
+
+    async def work(self, chat: str, seconds: float = 0.05):
+        self.running += 1
+        self.per_chat[chat] = self.per_chat.get(chat, 0) + 1
+        self.peak = max(self.peak, self.running)
+        self.peak_per_chat[chat] = max(self.peak_per_chat.get(chat, 0), self.per_chat[chat])
+        await asyncio.sleep(seconds)
+        self.running -= 1
+        self.per_chat[chat] -= 1
+
+
+def _step(dispatcher, probe, chat: str, tool_name: str, calls: int):
+    async def _run():
+        dispatcher.begin_step()
+        await asyncio.gather(*(dispatcher.run(tool_name, lambda: probe.work(chat)) for _ in range(calls)))
+    return _run()
+
+
+def test_each_step_gets_its_own_parallel_quota():
+    dispatcher, probe = agent.ToolDispatcher(max_parallel=3), ConcurrencyProbe()
+
+    async def _scenario():
+        await asyncio.gather(*(_step(dispatcher, probe, f"chat-{i}", "browse_url", 6) for i in range(3)))
+
+    asyncio.run(_scenario())
+
+    assert probe.peak_per_chat == {"chat-0": 3, "chat-1": 3, "chat-2": 3}
+    # แชทหนึ่งไม่กิน slot ของแชทอื่น: ทั้ง 3 แชทรันพร้อมกันได้เต็มโควตา
+    assert probe.peak == 9
+
+
+def test_gui_tools_run_one_at_a_time_across_chats():
+    dispatcher, probe = agent.ToolDispatcher(max_parallel=3), ConcurrencyProbe()
+
+    async def _scenario():
+        await asyncio.gather(*(_step(dispatcher, probe, f"chat-{i}", "mouse_click", 3) for i in range(2)))
+
+    asyncio.run(_scenario())
+
+    assert probe.peak == 1
+
+
+def test_executor_limits_tool_calls_from_one_llm_turn(monkeypatch):
+    dispatcher, probe = agent.ToolDispatcher(max_parallel=2), ConcurrencyProbe()
+    monkeypatch.setattr(agent, "tool_dispatcher", dispatcher)
+
+    @tool
+    async def lookup(query: str) -> str:
+        """lookup"""
+        await probe.work("chat")
+        return query
+
+    def _plan(inputs):
+        if inputs["intermediate_steps"]:
+            return AgentFinish({"output": "done"}, "done")
+        return [AgentActionMessageLog(tool="lookup", tool_input={"query": str(i)}, log="", message_log=[])
+                for i in range(6)]
+
+    executor = agent.ParallelAgentExecutor(agent=RunnableLambda(_plan), tools=[lookup])
+    result = asyncio.run(executor.ainvoke({"input": "x"}))
+
+    assert result["output"] == "done"
+    assert probe.peak == 2
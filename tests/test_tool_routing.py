@@ -0,0 +1,54 @@
+import pytest
+
+import agent
+
+
+@pytest.mark.parametrize("message, groups", [
+    ("ราคาหุ้น NVDA ย้อนหลัง 10 วัน", {"stocks"}),
+    ("stocks and returns of PTT.BK", {"stocks"}),
+    ("ราคาNVDA", {"stocks"}),
+    ("ช่วยจำไว้ว่าฉันชอบกาแฟดำ", {"memory"}),
+    ("อ่านไฟล์ report.csv ให้หน่อย", {"files"}),
+    ("สรุป notes.md", {"files"}),
+    ("https://example.com/a สรุปให้หน่อย", {"web"}),
+    ("12*7 เท่ากับเท่าไร", {"date_math"}),
+    ("what time is it", {"date_math"}),
+])
+def test_messages_route_to_their_tool_groups(message, groups):
+    assert agent.route_tool_groups(message) == groups
+
+
+@pytest.mark.parametrize("message", [
+    "จำนวนนักเรียนในห้องมี 30 คน",  # "จำ" อยู่ในคำว่า "จำนวน"
+    "sometimes I wonder",  # "time" อยู่ในคำว่า "sometimes"
+    "อาหารไทยอร่อยไหม",  # "หาร" อยู่ในคำว่า "อาหาร"
+    "the API sends JSON over HTTP",  # ตัวย่อที่ไม่ใช่ชื่อหุ้น
+    "สวัสดีครับ",
+])
+def test_keywords_inside_other_words_do_not_route(message):
+    assert agent.route_tool_groups(message) == set()
+
+
+def test_acronyms_are_not_tickers():
+    assert "stocks" not in agent.route_tool_groups("แปลงไฟล์ CSV เป็น PDF แล้วส่งผ่าน API เป็น HTML")
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(agent, "CHEAP_MODEL", "")
+    monkeypatch.setattr(agent, "TOOL_ROUTER_ENABLED", True)
+    return agent.AdvancedWebAgent()
+
+
+def test_routed_turns_keep_web_search_as_a_fallback(engine):
+    names = {t.name for t in engine.select_tools("อ่านไฟล์ report.csv")}
+
+    assert "tavily_search_results_json" in names
+    assert {"read_from_file", "calculator"} <= names
+    assert "mouse_click" not in names
+
+
+def test_unrouted_turns_and_disabled_router_send_every_tool(engine, monkeypatch):
+    assert engine.select_tools("สวัสดีครับ") == engine.tools
+    monkeypatch.setattr(agent, "TOOL_ROUTER_ENABLED", False)
+    assert engine.select_tools("ราคาหุ้น NVDA") == engine.tools
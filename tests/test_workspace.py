@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+import pytest
+
+import server
+
+
+def _call(tool, **arguments) -> dict:
+    return json.loads(asyncio.run(tool.fn(**arguments)))
+
+
+@pytest.fixture
+def folder():
+    """โฟลเดอร์ย่อยชื่อไม่ซ้ำใน workspace (workspace ใช้ร่วมกันทั้ง test session)"""
+    return f"reports-{uuid.uuid4().hex[:8]}"
+
+
+def test_files_in_subfolders_round_trip_through_every_tool(folder):
+    name = f"{folder}/q3/summary.md"
+    marker = f"quarterly-{uuid.uuid4().hex[:8]}"
+
+    assert "success" in _call(server.write_to_file, filename=name, content=f"# Q3\n{marker} revenue grew\n")
+
+    listed = _call(server.list_workspace_files, pattern=f"{folder}/*")
+    assert [f["filename"] for f in listed["files"]] == [name]
+    assert marker in _call(server.read_from_file, filename=name)["content"]
+
+    # ชื่อไฟล์ที่ search_workspace คืนมาต้องส่งต่อให้ read_from_file ได้ทันที
+    hits = _call(server.search_workspace, query=marker)["results"]
+    assert [hit["filename"] for hit in hits] == [name]
+    assert marker in _call(server.read_from_file, filename=hits[0]["filename"])["content"]
+
+
+def test_windows_separators_are_accepted(folder):
+    _call(server.write_to_file, filename=f"{folder}\\notes.txt", content="hello")
+    assert _call(server.read_from_file, filename=f"{folder}/notes.txt")["content"] == "hello"
+
+
+@pytest.mark.parametrize("filename", [
+    "../outside.txt",
+    "reports/../../outside.txt",
+    "/etc/passwd",
+    "",
+    ".",
+])
+def test_paths_outside_the_workspace_are_rejected(filename):
+    assert server._get_safe_path(filename) is None
+    assert "error" in _call(server.write_to_file, filename=filename, content="x")
+
+
+def test_symlink_escaping_the_workspace_is_rejected(folder, tmp_path):
+    outside = tmp_path / "secret.txt"
+    outside.write_text("secret")
+    os.makedirs(os.path.join(server.WORKSPACE_DIR, folder))
+    os.symlink(tmp_path, os.path.join(server.WORKSPACE_DIR, folder, "link"))
+
+    assert server._get_safe_path(f"{folder}/link/secret.txt") is None
+    assert "error" in _call(server.read_from_file, filename=f"{folder}/link/secret.txt")
+    assert "error" in _call(server.write_to_file, filename=f"{folder}/link/new.txt", content="x")
+    assert not (tmp_path / "new.txt").exists()
+
+
+def test_concurrent_index_syncs_on_one_database_do_not_duplicate_lines(folder, tmp_path):
+    for i in range(40):
+        _call(server.write_to_file, filename=f"{folder}/log-{i}.txt",
+              content="\n".join(f"entry {i}-{n} status ok" for n in range(50)))
+    # เหมือน server process สองตัวใน pool ที่ใช้ไฟล์ index เดียวกัน
+    path = os.fspath(tmp_path / "search.sqlite3")
+    indexes = [server.WorkspaceSearchIndex(path=path) for _ in range(2)]
+    barrier = threading.Barrier(len(indexes))
+    errors = []
+
+    def _sync(index):
+        barrier.wait()
+        try:
+            index.sync()
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=_sync, args=(index,)) for index in indexes]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    conn = sqlite3.connect(path)
+    duplicates = conn.execute(
+        "SELECT name, line FROM lines GROUP BY name, line HAVING COUNT(*) > 1"
+    ).fetchall()
+    assert duplicates == []
+    rows = conn.execute("SELECT COUNT(*) FROM lines WHERE +name GLOB ?", (f"{folder}/*",)).fetchone()[0]
+    assert rows == 40 * 50
+    top = indexes[1].search("entry 7-13 status", pattern=f"{folder}/*")[0]
+    assert (top["filename"], top["line"]) == (f"{folder}/log-7.txt", 14)
+
+
+def test_search_workspace_is_pinned_to_one_mcp_worker():
+    import agent
+
+    assert "search_workspace" in agent.MCP_PINNED_TOOLS
+
+
+def test_hidden_directories_are_not_indexed(folder):
+    os.makedirs(os.path.join(server.WORKSPACE_DIR, folder, ".git", "objects"))
+    with open(os.path.join(server.WORKSPACE_DIR, folder, ".git", "objects", "pack.idx"), "w") as f:
+        f.write("x")
+    _call(server.write_to_file, filename=f"{folder}/readme.md", content="hello")
+    server.workspace_index.invalidate()
+
+    listed = _call(server.list_workspace_files, pattern=f"{folder}/*")
+    assert [f["filename"] for f in listed["files"]] == [f"{folder}/readme.md"]